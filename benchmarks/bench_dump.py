@@ -0,0 +1,109 @@
+"""
+Throughput of save_dump against the per-line writer it replaced
+
+Run with ``python -m benchmarks.bench_dump --points 1000000``
+"""
+
+import argparse
+import filecmp
+import os
+import tempfile
+import time
+import numpy as np
+from shapes_3d.modules.buffer import PointBuffer
+from shapes_3d.modules.dump import save_dump_parallel
+from shapes_3d.modules.utils import save_dump
+
+
+def save_dump_per_line(points: list[np.ndarray], filename: str, box_len: float):
+    """The original save_dump, one f-string and one write per line"""
+    num: float = sum(pt.shape[0] for pt in points)
+    with open(filename, "w") as f:
+        f.write("ITEM: TIMESTEP\n0\n")
+        f.write(f"ITEM: NUMBER OF ATOMS\n{num}\n")
+        f.write(
+            f"ITEM: BOX BOUNDS pp pp pp\n{-box_len // 2} {box_len // 2}\n{-box_len // 2} {box_len // 2}\n{-box_len // 2} {box_len // 2}\n"
+        )
+        f.write("ITEM: ATOMS id type x y z\n")
+        max_type: int = 0
+        for i in range(0, len(points)):
+            if points[i].shape[1] == 4:
+                for j in range(points[i].shape[0]):
+                    f.write(
+                        f"{j + 1} {int(points[i][j][3] + i)} {points[i][j][0]:.6f} {points[i][j][1]:.6f} {points[i][j][2]:.6f}\n"
+                    )
+                    max_type = max(max_type, int(points[i][j][3]))
+            else:
+                for j, (x, y, z) in enumerate(points[i], start=1):
+                    f.write(f"{j} {i + 1 + max_type} {x:.6f} {y:.6f} {z:.6f}\n")
+
+
+def make_points(num_pts: int, box_len: float, seed: int) -> list[np.ndarray]:
+    """A typed block and an untyped block, like the patchy builders dump"""
+    rng: np.random.Generator = np.random.default_rng(seed)
+    half: int = num_pts // 2
+    typed: np.ndarray = np.column_stack(
+        (
+            rng.uniform(-box_len / 2, box_len / 2, (half, 3)),
+            rng.integers(1, 6, half),
+        )
+    )
+    untyped: np.ndarray = rng.uniform(-box_len / 2, box_len / 2, (num_pts - half, 3))
+    return [typed, untyped]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--points", type=int, default=1_000_000)
+    parser.add_argument("--box-len", type=float, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--skip-reference", action="store_true", help="only time save_dump"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="*",
+        default=[],
+        help="also time save_dump_parallel with these worker counts",
+    )
+    args = parser.parse_args()
+
+    points: list[np.ndarray] = make_points(args.points, args.box_len, args.seed)
+    with tempfile.TemporaryDirectory() as directory:
+        fast: str = os.path.join(directory, "fast.dump")
+        start: float = time.perf_counter()
+        save_dump(points, fast, args.box_len)
+        fast_time: float = time.perf_counter() - start
+        size_mb: float = os.path.getsize(fast) / 1e6
+        print(
+            f"save_dump: {args.points} points, {size_mb:.1f} MB in {fast_time:.2f} s, {size_mb / fast_time:.1f} MB/s"
+        )
+        if args.workers:
+            buffer: PointBuffer = PointBuffer(len(points[0]) + len(points[1]))
+            buffer.append_rows(points[0])
+            buffer.append_rows(points[1])
+        for workers in args.workers:
+            parallel: str = os.path.join(directory, f"parallel_{workers}.dump")
+            start = time.perf_counter()
+            save_dump_parallel(buffer, parallel, args.box_len, workers=workers)
+            parallel_time: float = time.perf_counter() - start
+            print(
+                f"save_dump_parallel, {workers} workers: {size_mb / parallel_time:.1f} MB/s, {fast_time / parallel_time:.2f}x save_dump"
+            )
+        if args.skip_reference:
+            return
+
+        reference: str = os.path.join(directory, "reference.dump")
+        start = time.perf_counter()
+        save_dump_per_line(points, reference, args.box_len)
+        reference_time: float = time.perf_counter() - start
+        print(
+            f"per-line:  {args.points} points, {size_mb:.1f} MB in {reference_time:.2f} s, {size_mb / reference_time:.1f} MB/s"
+        )
+        print(f"speedup: {reference_time / fast_time:.2f}x")
+        print("byte-identical:", filecmp.cmp(fast, reference, shallow=False))
+
+
+if __name__ == "__main__":
+    main()
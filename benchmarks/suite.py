@@ -0,0 +1,537 @@
+"""
+Benchmarks of the shape samplers and pipeline stages, with a regression check
+
+Every case runs in a fresh process over a grid of its parameters, and records the
+wall time, points per second, the fraction of candidates its sampler accepted and
+the peak memory, also at the end of each stage of a whole box. Run with
+
+``python -m benchmarks.suite run --output bench.json``
+
+and compare a run against a saved baseline with
+
+``python -m benchmarks.suite compare baseline.json bench.json``
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable
+import numpy as np
+from shapes_3d.modules.buffer import PointBuffer
+from shapes_3d.modules.config import expand_grid
+from shapes_3d.modules.cylinder import Cylinder
+from shapes_3d.modules.ellipsoid import Ellipsoid, EllipsoidPopulation
+from shapes_3d.modules.form_factors import analytic_intensity
+from shapes_3d.modules.parallelepiped import Parallelepiped
+from shapes_3d.modules.population import ParticleTable
+from shapes_3d.modules.profiling import PROFILE_ENV, peak_rss_mb
+from shapes_3d.modules.rotations import random_quaternions
+from shapes_3d.modules.patch_shell import PatchShell
+from shapes_3d.modules.scattering import PairHistogram, fft_intensity
+from shapes_3d.modules.sizes import fill_shells
+from shapes_3d.modules.utils import (
+    create_network_graph,
+    make_centers,
+    relax_network_positions_alt,
+    save_dump,
+)
+
+# A case sets up its inputs and returns the work to time, which returns the number
+# of points it made and the number of candidates its sampler drew (or None)
+Case = Callable[..., Callable[[], dict]]
+
+
+class CountingGenerator:
+    """
+    A random generator that counts the values drawn with uniform
+
+    The rejection samplers draw their candidates as uniform (x, y, z) triples, so a
+    third of the values drawn is the number of candidates.
+    """
+
+    def __init__(self, seed: int):
+        self.rng: np.random.Generator = np.random.default_rng(seed)
+        self.draws: int = 0
+
+    def uniform(self, low=0.0, high=1.0, size=None):
+        values = self.rng.uniform(low, high, size)
+        self.draws += int(np.size(values))
+        return values
+
+    def __getattr__(self, name: str):
+        return getattr(self.rng, name)
+
+    @property
+    def candidates(self) -> int:
+        return self.draws // 3
+
+
+def case_ellipsoid(seed: int, radius: float, density: float) -> Callable[[], dict]:
+    """Ellipsoid.make_obj of an ellipsoidal shell around a hollow of half the radius"""
+    rng = CountingGenerator(seed)
+    shell = Ellipsoid(density, radius, 1.5 * radius, 0.8 * radius, radius / 2)
+
+    def run() -> dict:
+        return {"points": len(shell.make_obj(rng=rng)), "candidates": rng.candidates}
+
+    return run
+
+
+def case_cylinder(seed: int, length: float, density: float) -> Callable[[], dict]:
+    """Cylinder.make_obj of a tilted cylinder of radius 5"""
+    rng = CountingGenerator(seed)
+    cylinder = Cylinder(density, length, 5.0, np.pi / 3, np.pi / 4)
+
+    def run() -> dict:
+        return {"points": len(cylinder.make_obj(rng=rng)), "candidates": rng.candidates}
+
+    return run
+
+
+def case_parallelepiped(seed: int, density: float) -> Callable[[], dict]:
+    """Parallelepiped.make_obj of two slanted shells"""
+    rng = CountingGenerator(seed)
+    obj = Parallelepiped(
+        np.array([[50.0, 20.0, 30.0], [10.0, 20.0, 10.0]]),
+        np.array([density, density / 2]),
+        np.pi / 3,
+        np.pi / 4,
+    )
+
+    def run() -> dict:
+        return {"points": len(obj.make_obj(rng=rng)), "candidates": rng.candidates}
+
+    return run
+
+
+def case_patch_shell(seed: int, patch_density: float) -> Callable[[], dict]:
+    """PatchShell.make_patches of 8 patches, which rejects nothing"""
+    rng: np.random.Generator = np.random.default_rng(seed)
+    shell = PatchShell(50.0, np.full(8, 5000.0), 8, patch_density)
+
+    def run() -> dict:
+        return {"points": len(shell.make_patches(rng=rng)), "candidates": None}
+
+    return run
+
+
+def case_make_centers(
+    seed: int, particles: int, box_length: float
+) -> Callable[[], dict]:
+    """make_centers of particles 20 apart; a candidate is one placement attempt"""
+    rng = CountingGenerator(seed)
+
+    def run() -> dict:
+        centers = make_centers(particles, -box_length / 2, box_length / 2, 20.0, rng)
+        return {"points": len(centers), "candidates": rng.candidates}
+
+    return run
+
+
+def case_fill_shells(seed: int, box_length: float) -> Callable[[], dict]:
+    """fill_shells of 5-shell onions, about 3 apart, to a volume fraction of 0.3"""
+    rng: np.random.Generator = np.random.default_rng(seed)
+    target: float = 0.3 * box_length**3
+
+    def run() -> dict:
+        radii = fill_shells([3.0] * 5, [0.5] * 5, target, rng)
+        return {"points": radii.shape[0], "candidates": None}
+
+    return run
+
+
+def case_save_dump(seed: int, points: int) -> Callable[[], dict]:
+    """save_dump of a buffer of uniform points with 5 types"""
+    rng: np.random.Generator = np.random.default_rng(seed)
+    buffer: PointBuffer = PointBuffer(points)
+    buffer.append(rng.uniform(-500, 500, (points, 3)), types=rng.integers(1, 6, points))
+
+    def run() -> dict:
+        with tempfile.TemporaryDirectory() as directory:
+            save_dump(buffer, os.path.join(directory, "bench.dump"), 1000.0)
+        return {"points": points, "candidates": None}
+
+    return run
+
+
+def case_pair_histogram(seed: int, points: int) -> Callable[[], dict]:
+    """PairHistogram.from_points of uniform points in a ball, in bins of 0.5"""
+    rng: np.random.Generator = np.random.default_rng(seed)
+    radius: float = 50.0
+    xyz: np.ndarray = Ellipsoid(
+        points / ((4 / 3) * np.pi * radius**3), radius
+    ).make_obj(rng=rng)
+    buffer: PointBuffer = PointBuffer(len(xyz))
+    buffer.append(xyz, types=rng.integers(1, 3, len(xyz)))
+
+    def run() -> dict:
+        PairHistogram.from_points(buffer, 0.5)
+        return {"points": len(buffer), "candidates": None}
+
+    return run
+
+
+def case_fft_intensity(seed: int, grid_size: int) -> Callable[[], dict]:
+    """fft_intensity of 10^6 uniform points with 2 types in a periodic box"""
+    rng: np.random.Generator = np.random.default_rng(seed)
+    points: int = 10**6
+    buffer: PointBuffer = PointBuffer(points)
+    buffer.append(rng.uniform(-500, 500, (points, 3)), types=rng.integers(1, 3, points))
+
+    def run() -> dict:
+        fft_intensity(buffer, 1000.0, grid_size, {1: 1.0, 2: 2.0})
+        return {"points": points, "candidates": None}
+
+    return run
+
+
+def case_form_factors(seed: int, particles: int) -> Callable[[], dict]:
+    """analytic_intensity of core-shell spheres at 200 q, with the Debye sum"""
+    rng: np.random.Generator = np.random.default_rng(seed)
+    core: np.ndarray = rng.uniform(5, 10, particles)
+    table: ParticleTable = ParticleTable(
+        "core_shell",
+        rng.uniform(-500, 500, (particles, 3)),
+        np.stack((core, core + rng.uniform(2, 5, particles)), axis=1),
+        1000.0,
+        {"core_density": 0.1, "shell_density": 0.1},
+    )
+    q: np.ndarray = np.geomspace(1e-3, 1.0, 200)
+
+    def run() -> dict:
+        analytic_intensity(table, q, {1: 1.0, 2: 2.0})
+        return {"points": particles, "candidates": None}
+
+    return run
+
+
+def case_oriented_ellipsoids(seed: int, particles: int) -> Callable[[], dict]:
+    """An EllipsoidPopulation in uniformly random orientations, rotated in chunks"""
+    rng: np.random.Generator = np.random.default_rng(seed)
+    population: EllipsoidPopulation = EllipsoidPopulation(
+        0.05,
+        rng.uniform(5, 15, (particles, 3)),
+        rng.uniform(-500, 500, (particles, 3)),
+        orientations=random_quaternions(particles, rng),
+    )
+    counting: CountingGenerator = CountingGenerator(seed)
+
+    def run() -> dict:
+        points: PointBuffer = PointBuffer.for_count(population.expected_count())
+        population.write(points, counting)
+        return {"points": len(points), "candidates": counting.candidates}
+
+    return run
+
+
+def case_network(seed: int, nodes: int) -> Callable[[], dict]:
+    """The graph and 2000 relaxation steps of a network in a periodic box"""
+    rng: np.random.Generator = np.random.default_rng(seed)
+
+    def run() -> dict:
+        graph = create_network_graph(nodes, 3, rng)
+        assert graph is not None
+        branches: list[tuple[int, int]] = sorted(
+            {(min(a, b), max(a, b)) for a in graph for b in graph[a]}
+        )
+        positions: np.ndarray = relax_network_positions_alt(
+            rng.uniform(-100, 100, (nodes, 3)),
+            graph,
+            branches,
+            np.full(nodes, 5.0),
+            3.0,
+            200.0,
+            iterations=2000,
+            rng=rng,
+        )
+        return {"points": len(positions), "candidates": None}
+
+    return run
+
+
+def case_box_onions(
+    seed: int, box_length: float, volume_fraction: float
+) -> Callable[[], dict]:
+    """build_box_onions end to end, writing its dump to a temporary directory"""
+    from shapes_3d.objects.box_onions import build_box_onions
+
+    def run() -> dict:
+        stages: dict[str, dict] = {}
+        with tempfile.TemporaryDirectory() as directory:
+            result: dict = build_box_onions(
+                {
+                    "box_length": box_length,
+                    "volume_fraction": volume_fraction,
+                    "output_dir": directory,
+                },
+                np.random.default_rng(seed),
+            )
+            # written when the build is profiled
+            report: str = os.path.join(directory, "box_onions_profile.json")
+            if os.path.exists(report):
+                with open(report) as f:
+                    stages = json.load(f)["stages"]
+        return {
+            "points": result["num_points"],
+            "candidates": None,
+            "stage_rss_mb": {
+                name: entry["rss_peak_mb"] for name, entry in stages.items()
+            },
+        }
+
+    return run
+
+
+# Each case and the grid of parameters it is run over
+CASES: dict[str, tuple[Case, dict[str, list]]] = {
+    "ellipsoid": (case_ellipsoid, {"radius": [20.0, 50.0], "density": [0.05, 0.2]}),
+    "cylinder": (case_cylinder, {"length": [50.0, 200.0], "density": [0.1, 0.4]}),
+    "parallelepiped": (case_parallelepiped, {"density": [0.05, 0.2]}),
+    "patch_shell": (case_patch_shell, {"patch_density": [0.1, 0.4]}),
+    "make_centers": (
+        case_make_centers,
+        {"particles": [50, 200], "box_length": [300.0, 600.0]},
+    ),
+    "fill_shells": (case_fill_shells, {"box_length": [400.0, 1600.0]}),
+    "save_dump": (case_save_dump, {"points": [10**5, 10**6]}),
+    "pair_histogram": (case_pair_histogram, {"points": [2000, 8000]}),
+    "fft_intensity": (case_fft_intensity, {"grid_size": [64, 256]}),
+    "form_factors": (case_form_factors, {"particles": [500, 2000]}),
+    "oriented_ellipsoids": (case_oriented_ellipsoids, {"particles": [1000, 10000]}),
+    "network": (case_network, {"nodes": [10, 30]}),
+    "box_onions": (
+        case_box_onions,
+        {"box_length": [200.0, 300.0], "volume_fraction": [0.05]},
+    ),
+}
+
+
+def measure(name: str, params: dict, repeats: int, seed: int) -> dict:
+    """
+    Time one case with one set of parameters, in the calling process
+
+    The case is set up afresh for each repeat, and only its work is timed. A first,
+    untimed run profiles the builders, whose reports give the peak RSS at the end of
+    each stage, and one more run under tracemalloc measures the peak of the
+    allocations.
+
+    Parameters
+    ----------
+    name : str
+        The name of the case
+    params : dict
+        The parameters of the case
+    repeats : int
+        The number of timed runs
+    seed : int
+        The seed of every run
+
+    Returns
+    -------
+    dict
+        The result, see run_suite
+    """
+    case: Case = CASES[name][0]
+    times: list[float] = []
+    counts: dict = {}
+    # the samplers print their progress, which would be timed too
+    with contextlib.redirect_stdout(io.StringIO()):
+        # first, as the RSS only ever grows: a stage's peak is the process's so far
+        os.environ[PROFILE_ENV] = "1"
+        try:
+            stage_rss: dict | None = case(seed, **params)().get("stage_rss_mb")
+        finally:
+            del os.environ[PROFILE_ENV]
+        for _ in range(repeats):
+            work: Callable[[], dict] = case(seed, **params)
+            start: float = time.perf_counter()
+            counts = work()
+            times.append(time.perf_counter() - start)
+        work = case(seed, **params)
+        tracemalloc.start()
+        work()
+        peak_alloc: int = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    wall: float = statistics.median(times)
+    candidates: int | None = counts["candidates"]
+    return {
+        "name": name,
+        "params": params,
+        "wall_s": wall,
+        "min_s": min(times),
+        "points": counts["points"],
+        "points_per_s": counts["points"] / wall if wall > 0 else None,
+        "candidates": candidates,
+        "acceptance": counts["points"] / candidates if candidates else None,
+        "peak_alloc_mb": peak_alloc / 2**20,
+        "peak_rss_mb": peak_rss_mb(),
+        "stage_rss_mb": stage_rss,
+    }
+
+
+def run_suite(
+    names: list[str], repeats: int = 3, seed: int = 0, quick: bool = False
+) -> dict:
+    """
+    Run cases over their grids, each set of parameters in a fresh process
+
+    Parameters
+    ----------
+    names : list[str]
+        The cases to run
+    repeats : int
+        The number of timed runs of each set of parameters
+    seed : int
+        The seed of every run
+    quick : bool
+        Only run the first value of every parameter
+
+    Returns
+    -------
+    dict
+        The machine it ran on ("meta") and one entry per case and parameters
+        ("results"), with the median and minimum wall time in seconds, the points
+        per second, the fraction of candidates accepted, and the peak of the
+        traced allocations and of the resident memory in MB. The whole boxes also
+        have the peak resident memory at the end of each of their stages
+    """
+    results: list[dict] = []
+    for name in names:
+        grid: dict[str, list] = CASES[name][1]
+        if quick:
+            grid = {key: values[:1] for key, values in grid.items()}
+        for params in expand_grid({}, grid):
+            # a new process per run, so the peak RSS is the run's own
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                result: dict = executor.submit(
+                    measure, name, params, repeats, seed
+                ).result()
+            results.append(result)
+            print(
+                f"{name} {params}: {result['min_s']:.4f} s,"
+                f" {result['peak_rss_mb']:.0f} MB RSS"
+            )
+    return {"meta": machine(), "results": results}
+
+
+def machine() -> dict:
+    """What a run was made on, to tell apart baselines of different machines"""
+    try:
+        commit: str | None = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def result_key(result: dict) -> str:
+    return result["name"] + " " + json.dumps(result["params"], sort_keys=True)
+
+
+def compare(baseline: dict, current: dict, threshold: float = 0.1) -> list[str]:
+    """
+    Find the cases that got slower or use more memory than in a baseline
+
+    The minimum wall time is compared, since it is the least noisy.
+
+    Parameters
+    ----------
+    baseline : dict
+        A saved run_suite result
+    current : dict
+        The run_suite result to check
+    threshold : float
+        The relative increase that counts as a regression, e.g. 0.1 for 10%
+
+    Returns
+    -------
+    list[str]
+        A line per regression
+    """
+    before: dict[str, dict] = {
+        result_key(result): result for result in baseline["results"]
+    }
+    regressions: list[str] = []
+    for result in current["results"]:
+        key: str = result_key(result)
+        if key not in before:
+            print(f"{key}: new")
+            continue
+        old: dict = before[key]
+        for metric in ("min_s", "peak_alloc_mb"):
+            ratio: float = result[metric] / max(old[metric], 1e-12)
+            line: str = (
+                f"{key}: {metric} {old[metric]:.4g} -> {result[metric]:.4g}"
+                f" ({ratio:.2f}x)"
+            )
+            print(line)
+            if ratio > 1 + threshold:
+                regressions.append(line)
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="run the benchmarks")
+    run.add_argument("cases", nargs="*", help=f"a subset of {', '.join(CASES)}")
+    run.add_argument("--output", default="bench.json")
+    run.add_argument("--repeats", type=int, default=3)
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument(
+        "--quick", action="store_true", help="only the first value of every parameter"
+    )
+    check = commands.add_parser("compare", help="flag regressions against a baseline")
+    check.add_argument("baseline")
+    check.add_argument("current")
+    check.add_argument(
+        "--threshold", type=float, default=0.1, help="the relative slowdown to flag"
+    )
+    args = parser.parse_args()
+
+    if args.command == "run":
+        unknown: set[str] = set(args.cases) - set(CASES)
+        assert not unknown, f"unknown cases: {', '.join(sorted(unknown))}"
+        suite: dict = run_suite(
+            args.cases or list(CASES), args.repeats, args.seed, args.quick
+        )
+        with open(args.output, "w") as f:
+            json.dump(suite, f, indent=2)
+        print("saved the results to", args.output)
+        return 0
+
+    with open(args.baseline) as f:
+        baseline: dict = json.load(f)
+    with open(args.current) as f:
+        current: dict = json.load(f)
+    regressions: list[str] = compare(baseline, current, args.threshold)
+    print(f"{len(regressions)} regressions over {args.threshold:.0%}")
+    for line in regressions:
+        print("REGRESSION", line)
+    return int(bool(regressions))
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,270 @@
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from importlib import import_module
+from pathlib import Path
+from typing import Callable
+import json
+import os
+import sys
+import numpy as np
+from .modules.config import expand_grid, load_config, parse_assignment
+from .modules.population import spawn_seeds
+from .modules.profiling import PROFILE_ENV
+
+# The builder of each structure kind, imported only when it is run
+BUILDERS: dict[str, str] = {
+    "box_ellipsoids": "shapes_3d.objects.box_ellipsoids:build_box_ellipsoids",
+    "box_onions": "shapes_3d.objects.box_onions:build_box_onions",
+    "box_parra": "shapes_3d.objects.box_parra:build_box_parra",
+    "box_spheres": "shapes_3d.objects.box_spheres:build_box_spheres",
+    "ellipsoid": "shapes_3d.objects.ellipsoidal_obj:build_ellipsoid",
+    "network": "shapes_3d.objects.network:build_network",
+    "network_alternative": (
+        "shapes_3d.objects.network_alternative:build_network_alternative"
+    ),
+    "onion": "shapes_3d.objects.onion:build_onion",
+    "onions_3d": "shapes_3d.objects.onions_3d:build_onions_3d",
+    "parallelepiped": "shapes_3d.objects.parallelepiped:build_parallelepiped",
+    "patchy_box": "shapes_3d.objects.patchy_box:build_patchy_box",
+    "patchy_onion": "shapes_3d.objects.patchy_onion:build_patchy_onion",
+    "patchy_sphere": "shapes_3d.objects.patchy_sphere:build_patchy_sphere",
+    "sphere": "shapes_3d.objects.sphere:build_sphere",
+}
+
+
+def get_builder(kind: str) -> Callable[..., dict]:
+    """
+    Import the builder of a structure kind
+
+    Parameters
+    ----------
+    kind : str
+        One of the keys of BUILDERS
+
+    Returns
+    -------
+    Callable[..., dict]
+        The function taking a config and a random generator
+    """
+    assert kind in BUILDERS, f"unknown kind {kind}, expected one of {list(BUILDERS)}"
+    module, name = BUILDERS[kind].split(":")
+    return getattr(import_module(module), name)
+
+
+def run_job(kind: str, config: dict, seed: int | None = None) -> dict:
+    """
+    Build one structure
+
+    Parameters
+    ----------
+    kind : str
+        The structure kind
+    config : dict
+        The parameters to override
+    seed : int | None
+        The seed of the job's random generator
+
+    Returns
+    -------
+    dict
+        What the builder returned
+    """
+    return get_builder(kind)(config, np.random.default_rng(seed))
+
+
+def make_jobs(
+    kind: str,
+    base: dict,
+    grid: dict[str, list],
+    output_dir: str,
+    seed: int | None = None,
+) -> list[dict]:
+    """
+    Expand a sweep into jobs, each with its own seed and output directory
+
+    Parameters
+    ----------
+    kind : str
+        The structure kind
+    base : dict
+        The parameters shared by every job
+    grid : dict[str, list]
+        The values to sweep each parameter over
+    output_dir : str
+        The directory the job directories are made in
+    seed : int | None
+        The root seed the job seeds are spawned from
+
+    Returns
+    -------
+    list[dict]
+        The jobs, with their index, seed and config
+    """
+    configs: list[dict] = expand_grid(base, grid)
+    seeds, entropy = spawn_seeds(len(configs), seed)
+    return [
+        {
+            "job": i,
+            "seed": int(job_seed),
+            "root_entropy": str(entropy),
+            "config": config
+            | {"output_dir": str(Path(output_dir) / f"{kind}_{i:04d}")},
+        }
+        for i, (config, job_seed) in enumerate(zip(configs, seeds))
+    ]
+
+
+def run_sweep(
+    kind: str, jobs: list[dict], output_dir: str, workers: int | None = None
+) -> list[dict]:
+    """
+    Run the jobs of a sweep on a process pool and record them in jobs.json
+
+    Parameters
+    ----------
+    kind : str
+        The structure kind
+    jobs : list[dict]
+        The jobs made by make_jobs
+    output_dir : str
+        The directory of the sweep, where jobs.json is written
+    workers : int | None
+        The number of worker processes. Defaults to every CPU
+
+    Returns
+    -------
+    list[dict]
+        The jobs, each with its result or the error it failed with
+    """
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    manifest: str = str(Path(output_dir) / "jobs.json")
+    workers = min(workers or os.cpu_count() or 1, max(len(jobs), 1))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures: dict[Future, dict] = {
+            executor.submit(run_job, kind, job["config"], job["seed"]): job
+            for job in jobs
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            job: dict = futures[future]
+            try:
+                job["result"] = future.result()
+            except Exception as error:
+                job["error"] = repr(error)
+            print(f"finished {done} out of {len(jobs)} jobs (job {job['job']})")
+    with open(manifest, "w") as f:
+        json.dump({"kind": kind, "jobs": jobs}, f, indent=2)
+    print("saved the jobs to", manifest)
+    return jobs
+
+
+def read_config(args: Namespace) -> dict:
+    """Merge the config file and the --set overrides of the command line"""
+    config: dict = load_config(args.config) if args.config else {}
+    config |= dict(parse_assignment(assignment) for assignment in args.set)
+    return config
+
+
+def main(argv: list[str] | None = None) -> int:
+    """
+    Build one structure, or a sweep of them, from a config file
+
+    Examples::
+
+        python -m shapes_3d build box_onions --config box.toml --seed 1
+        python -m shapes_3d sweep box_onions --config sweep.toml --workers 32
+        python -m shapes_3d build box_onions --config box.toml --dry-run
+
+    A sweep config holds the shared parameters plus a [grid] table of lists; every
+    combination of the lists becomes a job with its own seed and output directory.
+
+    Parameters
+    ----------
+    argv : list[str] | None
+        The arguments. Defaults to sys.argv
+
+    Returns
+    -------
+    int
+        The exit status, 1 if a job of a sweep failed
+    """
+    parser = ArgumentParser(
+        prog="python -m shapes_3d", description="Build structures from config files"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="build one structure")
+    sweep = commands.add_parser("sweep", help="build every combination of a grid")
+    for command in (build, sweep):
+        command.add_argument("kind", choices=sorted(BUILDERS))
+        command.add_argument("--config", help="a .toml or .json file of parameters")
+        command.add_argument(
+            "--set",
+            action="append",
+            default=[],
+            metavar="KEY=VALUE",
+            help="override a parameter, the value is read as JSON",
+        )
+        command.add_argument("--seed", type=int, help="the (root) random seed")
+        command.add_argument("--output-dir", help="where to write the files")
+        command.add_argument(
+            "--profile",
+            nargs="?",
+            const="1",
+            choices=["1", "memory"],
+            help="write a JSON report of the stages, with 'memory' also tracing the"
+            " allocations",
+        )
+        command.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="only estimate the points, memory and runtime (box builders)",
+        )
+    sweep.add_argument(
+        "--grid",
+        action="append",
+        default=[],
+        metavar="KEY=[VALUES]",
+        help="sweep a parameter over a JSON list, on top of the [grid] of the config",
+    )
+    sweep.add_argument("--workers", type=int, help="the number of worker processes")
+    sweep.add_argument(
+        "--list", action="store_true", help="only print the jobs of the sweep"
+    )
+    commands.add_parser(
+        "calibrate", help="measure the rates the dry-run estimates are based on"
+    )
+    args: Namespace = parser.parse_args(argv)
+    if args.command == "calibrate":
+        from .modules.estimate import calibrate
+
+        print(json.dumps(calibrate()))
+        return 0
+    if args.profile:
+        # set in the environment, so the workers of a sweep profile their jobs too
+        os.environ[PROFILE_ENV] = args.profile
+
+    config: dict = read_config(args)
+    if args.dry_run:
+        module: str = BUILDERS[args.kind].split(":")[0]
+        if "dry_run" not in import_module(module).DEFAULT_CONFIG:
+            parser.error(f"{args.kind} has no dry run, only the box builders do")
+        config["dry_run"] = True
+    if args.command == "build":
+        if args.output_dir:
+            config["output_dir"] = args.output_dir
+        result: dict = run_job(args.kind, config, args.seed)
+        print(json.dumps(result))
+        return 0
+
+    grid: dict[str, list] = config.pop("grid", {})
+    grid |= dict(parse_assignment(assignment) for assignment in args.grid)
+    output_dir: str = args.output_dir or config.get("output_dir", "out")
+    jobs: list[dict] = make_jobs(args.kind, config, grid, output_dir, args.seed)
+    if args.list:
+        print(json.dumps(jobs, indent=2))
+        return 0
+    jobs = run_sweep(args.kind, jobs, output_dir, args.workers)
+    return int(any("error" in job for job in jobs))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,436 @@
+from pathlib import Path
+from typing import Callable, Iterable
+import json
+import struct
+import numpy as np
+from .buffer import PointBuffer, column_dtypes
+
+# First bytes of a points container
+MAGIC: bytes = b"SHAPES3D"
+VERSION: int = 1
+# Columns start on multiples of this many bytes
+ALIGN: int = 64
+# Room left in the header of a mapped file for its final offsets and count
+HEADER_SLACK: int = 512
+COLUMNS: tuple[str, ...] = ("xyz", "types", "particles")
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ALIGN) * ALIGN
+
+
+def _encode_header(header: dict, size: int | None = None) -> bytes:
+    """The magic, the JSON length and the JSON, padded with spaces to size bytes"""
+    text: bytes = json.dumps(header).encode()
+    size = size or _aligned(len(MAGIC) + 8 + len(text))
+    assert len(MAGIC) + 8 + len(text) <= size, "header does not fit"
+    prefix: bytes = MAGIC + struct.pack("<Q", size - len(MAGIC) - 8)
+    return prefix + text.ljust(size - len(prefix))
+
+
+def _layout(
+    start: int, columns: dict[str, tuple[np.dtype, tuple[int, ...]]]
+) -> dict[str, dict]:
+    """Lay out columns of the given dtype and shape one after the other from start"""
+    layout: dict[str, dict] = {}
+    offset: int = start
+    for name, (dtype, shape) in columns.items():
+        layout[name] = {"dtype": dtype.str, "shape": list(shape), "offset": offset}
+        offset = _aligned(offset + int(np.prod(shape)) * dtype.itemsize)
+    return layout
+
+
+def _column_layout(
+    start: int, capacity: int, dtypes: dict[str, np.dtype]
+) -> dict[str, dict]:
+    """Lay out the point columns for capacity points one after the other from start"""
+    shapes: dict[str, tuple[int, ...]] = {
+        "xyz": (capacity, 3),
+        "types": (capacity,),
+        "particles": (capacity,),
+    }
+    return _layout(start, {name: (dtypes[name], shapes[name]) for name in COLUMNS})
+
+
+def _end_of(layout: dict[str, dict], capacity: int, dtypes: dict[str, np.dtype]) -> int:
+    """The end of the last column of a layout"""
+    return layout["particles"]["offset"] + capacity * dtypes["particles"].itemsize
+
+
+def file_header(
+    num_points: int, box_len: float, columns: dict[str, dict], metadata: dict | None
+) -> dict:
+    return {
+        "format": "shapes_3d-points",
+        "version": VERSION,
+        "num_points": num_points,
+        "box_len": box_len,
+        "columns": columns,
+        "metadata": metadata or {},
+    }
+
+
+def save_points(
+    points: PointBuffer,
+    filename: str,
+    box_len: float,
+    metadata: dict | None = None,
+) -> None:
+    """
+    Save points to a binary container that load_points can memory-map
+
+    The file is a JSON header followed by the raw xyz, type and particle id columns,
+    each aligned to 64 bytes.
+
+    Parameters
+    ----------
+    points : PointBuffer
+        The points to write
+    filename : str
+        The name of the file to save the points, e.g. out/box.pts
+    box_len : float
+        The length of the simulation box for the points.
+    metadata : dict | None
+        Extra JSON-serializable information stored in the header
+    """
+    print("saving...")
+    header: dict = file_header(len(points), box_len, {}, metadata)
+    write_container(filename, header, {name: getattr(points, name) for name in COLUMNS})
+    print("saved to", filename)
+
+
+def write_container(filename: str, header: dict, arrays: dict[str, np.ndarray]) -> None:
+    """
+    Write arrays after a JSON header that records where each of them starts
+
+    Parameters
+    ----------
+    filename : str
+        The name of the file
+    header : dict
+        The JSON-serializable header. Its "columns" entry is filled in here
+    arrays : dict[str, np.ndarray]
+        The arrays, written in order
+    """
+    header_size: int = len(_encode_header(dict(header, columns={})))
+    header_size = _aligned(header_size + HEADER_SLACK * (1 + len(arrays) // 4))
+    header["columns"] = _layout(
+        header_size, {name: (a.dtype, a.shape) for name, a in arrays.items()}
+    )
+    Path(filename).parent.mkdir(parents=True, exist_ok=True)
+    with open(filename, "wb") as f:
+        f.write(_encode_header(header, header_size))
+        for name, array in arrays.items():
+            f.seek(header["columns"][name]["offset"])
+            f.write(np.ascontiguousarray(array).data)
+
+
+def read_header(filename: str) -> dict:
+    """
+    Read the JSON header of a points container
+
+    Parameters
+    ----------
+    filename : str
+        The name of the container
+
+    Returns
+    -------
+    dict
+        The header, with the number of points, box length, column layout and metadata
+    """
+    with open(filename, "rb") as f:
+        prefix: bytes = f.read(len(MAGIC) + 8)
+        assert prefix[: len(MAGIC)] == MAGIC, f"{filename} is not a points container"
+        (length,) = struct.unpack("<Q", prefix[len(MAGIC) :])
+        return json.loads(f.read(length))
+
+
+def load_points(filename: str, mmap: bool = True) -> tuple[PointBuffer, dict]:
+    """
+    Load a points container, by default without reading it into memory
+
+    Parameters
+    ----------
+    filename : str
+        The name of the container
+    mmap : bool
+        Whether to memory-map the columns read-only instead of reading them
+
+    Returns
+    -------
+    tuple[PointBuffer, dict]
+        The points and the header of the file
+    """
+    header: dict = read_header(filename)
+    arrays: list[np.ndarray] = [
+        read_column(filename, header["columns"][name], mmap) for name in COLUMNS
+    ]
+    return PointBuffer.from_columns(*arrays), header
+
+
+def read_column(filename: str, column: dict, mmap: bool = True) -> np.ndarray:
+    """
+    Read one column of a container
+
+    Parameters
+    ----------
+    filename : str
+        The name of the container
+    column : dict
+        The entry of the column in the "columns" of the header
+    mmap : bool
+        Whether to memory-map the column read-only instead of reading it
+
+    Returns
+    -------
+    np.ndarray
+        The column
+    """
+    dtype: np.dtype = np.dtype(column["dtype"])
+    shape: tuple[int, ...] = tuple(column["shape"])
+    if mmap and np.prod(shape) > 0:
+        return np.memmap(
+            filename, dtype, mode="r", offset=column["offset"], shape=shape
+        )
+    with open(filename, "rb") as f:
+        f.seek(column["offset"])
+        return np.fromfile(f, dtype, count=int(np.prod(shape))).reshape(shape)
+
+
+def save_npy(points: PointBuffer, prefix: str) -> list[str]:
+    """
+    Save the columns of the points as .npy files
+
+    Parameters
+    ----------
+    points : PointBuffer
+        The points to write
+    prefix : str
+        The start of the file names, e.g. out/box gives out/box.xyz.npy,
+        out/box.types.npy and out/box.particles.npy
+
+    Returns
+    -------
+    list[str]
+        The files written
+    """
+    Path(prefix).parent.mkdir(parents=True, exist_ok=True)
+    files: list[str] = [f"{prefix}.{name}.npy" for name in COLUMNS]
+    for name, filename in zip(COLUMNS, files):
+        np.save(filename, getattr(points, name))
+    return files
+
+
+def load_npy(prefix: str, mmap: bool = True) -> PointBuffer:
+    """
+    Load points saved by save_npy
+
+    Parameters
+    ----------
+    prefix : str
+        The prefix the points were saved with
+    mmap : bool
+        Whether to memory-map the columns read-only instead of reading them
+
+    Returns
+    -------
+    PointBuffer
+        The points
+    """
+    mode: str | None = "r" if mmap else None
+    return PointBuffer.from_columns(
+        *(np.load(f"{prefix}.{name}.npy", mmap_mode=mode) for name in COLUMNS)
+    )
+
+
+class MappedPointBuffer(PointBuffer):
+    """
+    A PointBuffer whose columns live in a memory-mapped points container
+
+    Builders write straight into the file, so a box larger than memory never has
+    to be held in RAM. If the points outgrow the preallocated capacity the file is
+    extended and the later columns are moved up. On close the columns are packed
+    together, the header is finalized and the file is truncated, leaving a file
+    load_points can open.
+
+    Attributes
+    ----------
+    filename : str
+        The name of the container
+    box_len : float
+        The length of the simulation box for the points.
+    metadata : dict
+        Extra information stored in the header
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        box_len: float,
+        capacity: int = 0,
+        growth: float = 1.5,
+        compact: bool = False,
+        max_type: int = 255,
+        metadata: dict | None = None,
+    ):
+        """
+        Creates the file, sized for capacity points
+
+        Parameters
+        ----------
+        filename : str
+            The name of the container, e.g. out/box.pts
+        box_len : float
+            The length of the simulation box for the points.
+        capacity : int
+            The number of points to preallocate in the file
+        growth : float
+            The factor the capacity is multiplied by when it runs out
+        compact : bool
+            Whether to use the float32 / small integer column dtypes
+        max_type : int
+            The largest type id, used to pick the compact type dtype
+        metadata : dict | None
+            Extra JSON-serializable information stored in the header
+        """
+        assert growth > 1
+        self.filename: str = filename
+        self.box_len: float = box_len
+        self.metadata: dict = metadata or {}
+        self.size: int = 0
+        self.growth: float = growth
+        coord_dtype, type_dtype, particle_dtype = column_dtypes(compact, max_type)
+        self._dtypes: dict[str, np.dtype] = {
+            "xyz": coord_dtype,
+            "types": type_dtype,
+            "particles": particle_dtype,
+        }
+        header: bytes = _encode_header(file_header(0, box_len, {}, self.metadata))
+        self._header_size: int = _aligned(len(header) + HEADER_SLACK)
+        self._map: np.memmap | None = None
+        self._columns: dict[str, dict] = {}
+        Path(filename).parent.mkdir(parents=True, exist_ok=True)
+        open(filename, "wb").close()
+        self._remap(max(int(capacity), 1))
+
+    def __enter__(self) -> "MappedPointBuffer":
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        self.close()
+
+    @property
+    def closed(self) -> bool:
+        return self._map is None
+
+    def _remap(self, capacity: int) -> None:
+        """Resize the file for capacity points, moving the columns into place"""
+        new: dict[str, dict] = _column_layout(self._header_size, capacity, self._dtypes)
+        self._release()
+        with open(self.filename, "r+b") as f:
+            f.truncate(_end_of(new, capacity, self._dtypes))
+        self._map = np.memmap(self.filename, np.uint8, mode="r+")
+        # the later columns move up, so move them last to first
+        for name in reversed(COLUMNS):
+            if name in self._columns:
+                self._move(name, self._columns[name], new[name])
+        self._columns = new
+        self._xyz = self._column("xyz", capacity)
+        self._types = self._column("types", capacity)
+        self._particles = self._column("particles", capacity)
+
+    def _column(self, name: str, num: int) -> np.ndarray:
+        """A view of a column in the mapped file"""
+        column: dict = self._columns[name]
+        dtype: np.dtype = self._dtypes[name]
+        shape: tuple[int, ...] = (num,) + tuple(column["shape"][1:])
+        nbytes: int = int(np.prod(shape)) * dtype.itemsize
+        start: int = column["offset"]
+        return self._map[start : start + nbytes].view(dtype).reshape(shape)
+
+    def _move(self, name: str, source: dict, target: dict) -> None:
+        """Move the used part of a column to where another layout puts it"""
+        nbytes: int = self.size * self._dtypes[name].itemsize
+        nbytes *= int(np.prod(source["shape"][1:]))
+        start, stop = source["offset"], target["offset"]
+        if nbytes and start != stop:
+            self._map[stop : stop + nbytes] = self._map[start : start + nbytes].copy()
+
+    def _release(self) -> None:
+        """Flush and drop the mapping and every view of it"""
+        if self._map is not None:
+            self._map.flush()
+        self._xyz = self._types = self._particles = None
+        self._map = None
+
+    def reserve(self, num_pts: int) -> None:
+        """
+        Make sure another num_pts points fit, growing the file geometrically
+
+        Parameters
+        ----------
+        num_pts : int
+            The number of points about to be written
+        """
+        needed: int = self.size + num_pts
+        if needed <= self.capacity:
+            return
+        self._remap(max(needed, int(self.capacity * self.growth), 1024))
+
+    def close(self) -> None:
+        """
+        Pack the columns, write the final header and truncate the file
+        """
+        if self.closed:
+            return
+        num: int = self.size
+        packed: dict[str, dict] = _column_layout(self._header_size, num, self._dtypes)
+        # the later columns move down, so move them first to last
+        for name in COLUMNS:
+            self._move(name, self._columns[name], packed[name])
+        header: dict = file_header(num, self.box_len, packed, self.metadata)
+        self._map[: self._header_size] = np.frombuffer(
+            _encode_header(header, self._header_size), np.uint8
+        )
+        self._release()
+        with open(self.filename, "r+b") as f:
+            f.truncate(_end_of(packed, num, self._dtypes))
+        print("saved to", self.filename)
+
+
+def save_points_stream(
+    writers: Iterable[Callable[[PointBuffer], None]],
+    filename: str,
+    box_len: float,
+    expected: float = 0,
+    **kwargs,
+) -> int:
+    """
+    Run particle writers straight into a memory-mapped points container
+
+    Parameters
+    ----------
+    writers : Iterable[Callable[[PointBuffer], None]]
+        Callables that each append one particle (or one group of particles)
+    filename : str
+        The name of the container, e.g. out/box.pts
+    box_len : float
+        The length of the simulation box for the points.
+    expected : float
+        The expected number of points, used to size the file
+    **kwargs
+        Passed on to MappedPointBuffer, e.g. compact=True
+
+    Returns
+    -------
+    int
+        The number of points written
+    """
+    print("saving...")
+    with MappedPointBuffer.for_count(
+        expected, filename=filename, box_len=box_len, **kwargs
+    ) as points:
+        for write in writers:
+            write(points)
+        return len(points)
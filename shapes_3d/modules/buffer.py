@@ -0,0 +1,310 @@
+from typing import Callable, Iterable, Iterator
+import numpy as np
+
+
+class PointBuffer:
+    """
+    A growable, columnar store for points, their type and the particle they belong to
+
+    Builders write their points straight into the preallocated columns instead of
+    collecting rows in a Python list, so every point is only held once. In compact
+    mode the coordinates are float32 (about 7 significant digits), the types are
+    uint8 (uint16 for more than 255 types) and the particle ids are uint32.
+
+    Attributes
+    ----------
+    size : int
+        The number of points written so far
+    capacity : int
+        The number of points that fit before the columns have to grow
+    growth : float
+        The factor the capacity is multiplied by when it runs out
+    """
+
+    def __init__(
+        self,
+        capacity: int = 0,
+        growth: float = 1.5,
+        compact: bool = False,
+        max_type: int = 255,
+        coord_dtype: np.dtype | None = None,
+        type_dtype: np.dtype | None = None,
+        particle_dtype: np.dtype | None = None,
+    ):
+        """
+        Initializes an empty buffer
+
+        Parameters
+        ----------
+        capacity : int
+            The number of points to preallocate
+        growth : float
+            The factor the capacity is multiplied by when it runs out
+        compact : bool
+            Whether to default to the float32 / small integer column dtypes
+        max_type : int
+            The largest type id, used to pick the compact type dtype
+        coord_dtype : np.dtype | None
+            The dtype of the x, y, z columns, overriding the default
+        type_dtype : np.dtype | None
+            The dtype of the type column, overriding the default
+        particle_dtype : np.dtype | None
+            The dtype of the particle id column, overriding the default
+        """
+        assert growth > 1
+        default_coord, default_type, default_particle = column_dtypes(compact, max_type)
+        # np.dtype objects can be falsy, so only None falls back to the default
+        if coord_dtype is None:
+            coord_dtype = default_coord
+        if type_dtype is None:
+            type_dtype = default_type
+        if particle_dtype is None:
+            particle_dtype = default_particle
+        self.size: int = 0
+        self.growth: float = growth
+        self._xyz: np.ndarray = np.empty((int(capacity), 3), dtype=coord_dtype)
+        self._types: np.ndarray = np.empty(int(capacity), dtype=type_dtype)
+        self._particles: np.ndarray = np.empty(int(capacity), dtype=particle_dtype)
+
+    @classmethod
+    def for_count(cls, expected: float, **kwargs) -> "PointBuffer":
+        """
+        Make a buffer sized for an expected number of points
+
+        The capacity leaves room for the Poisson fluctuation of the rejection
+        sampling, so the columns rarely have to grow.
+
+        Parameters
+        ----------
+        expected : float
+            The expected number of points, e.g. density times shell volume
+
+        Returns
+        -------
+        PointBuffer
+            The empty buffer
+        """
+        return cls(capacity=estimate_capacity(expected), **kwargs)
+
+    @classmethod
+    def from_columns(
+        cls, xyz: np.ndarray, types: np.ndarray, particles: np.ndarray
+    ) -> "PointBuffer":
+        """
+        Wrap existing columns, e.g. memory-mapped ones, without copying them
+
+        Parameters
+        ----------
+        xyz : np.ndarray
+            The (x, y, z) coordinates, with shape (M, 3)
+        types : np.ndarray
+            The type of each point, with shape (M,)
+        particles : np.ndarray
+            The particle id of each point, with shape (M,)
+
+        Returns
+        -------
+        PointBuffer
+            A full buffer holding the columns
+        """
+        assert xyz.shape[0] == types.shape[0] == particles.shape[0]
+        buffer: PointBuffer = cls.__new__(cls)
+        buffer.size = xyz.shape[0]
+        buffer.growth = 1.5
+        buffer._xyz, buffer._types, buffer._particles = xyz, types, particles
+        return buffer
+
+    @property
+    def capacity(self) -> int:
+        return self._xyz.shape[0]
+
+    @property
+    def coord_dtype(self) -> np.dtype:
+        """The dtype shapes should sample their coordinates in"""
+        return self._xyz.dtype
+
+    @property
+    def xyz(self) -> np.ndarray:
+        """The (x, y, z) coordinates written so far"""
+        return self._xyz[: self.size]
+
+    @property
+    def types(self) -> np.ndarray:
+        """The type of each point written so far"""
+        return self._types[: self.size]
+
+    @property
+    def particles(self) -> np.ndarray:
+        """The particle id of each point written so far"""
+        return self._particles[: self.size]
+
+    def __len__(self) -> int:
+        return self.size
+
+    def reserve(self, num_pts: int) -> None:
+        """
+        Make sure another num_pts points fit, growing the columns geometrically
+
+        Parameters
+        ----------
+        num_pts : int
+            The number of points about to be written
+        """
+        needed: int = self.size + num_pts
+        if needed <= self.capacity:
+            return
+        new_capacity: int = max(needed, int(self.capacity * self.growth), 1024)
+        self._xyz = _resized(self._xyz, new_capacity, self.size)
+        self._types = _resized(self._types, new_capacity, self.size)
+        self._particles = _resized(self._particles, new_capacity, self.size)
+
+    def allocate(self, num_pts: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Claim the next num_pts rows for writing
+
+        Parameters
+        ----------
+        num_pts : int
+            The number of rows to claim
+
+        Returns
+        -------
+        tuple[np.ndarray, np.ndarray, np.ndarray]
+            Writable views of the xyz, type and particle id columns for the rows
+        """
+        self.reserve(num_pts)
+        start: int = self.size
+        self.size += num_pts
+        rows = slice(start, self.size)
+        return self._xyz[rows], self._types[rows], self._particles[rows]
+
+    def append(
+        self,
+        xyz: np.ndarray,
+        types: int | np.ndarray = 1,
+        particles: int | np.ndarray = 0,
+    ) -> None:
+        """
+        Copy points into the buffer
+
+        Parameters
+        ----------
+        xyz : np.ndarray
+            The points, with shape (M, 3)
+        types : int | np.ndarray
+            The type of every point, or of each point
+        particles : int | np.ndarray
+            The particle id of every point, or of each point
+        """
+        xyz_out, types_out, particles_out = self.allocate(xyz.shape[0])
+        xyz_out[:] = xyz
+        types_out[:] = types
+        particles_out[:] = particles
+
+    def append_rows(self, rows: np.ndarray, particles: int | None = None) -> None:
+        """
+        Copy points in the row layout the shape classes return
+
+        Parameters
+        ----------
+        rows : np.ndarray
+            The points, with columns (x, y, z), (x, y, z, t) or (x, y, z, t, particle id)
+        particles : int | None
+            The particle id of every point. Overrides a particle id column
+        """
+        types: int | np.ndarray = rows[:, 3] if rows.shape[1] >= 4 else 1
+        if particles is None:
+            particles = rows[:, 4] if rows.shape[1] >= 5 else 0
+        self.append(rows[:, :3], types, particles)
+
+    def to_rows(self) -> np.ndarray:
+        """
+        Copy the points into the (x, y, z, t) row layout
+
+        Returns
+        -------
+        np.ndarray
+            The points, with shape (M, 4)
+        """
+        return np.column_stack((self.xyz, self.types))
+
+
+def column_dtypes(
+    compact: bool = False, max_type: int = 255
+) -> tuple[np.dtype, np.dtype, np.dtype]:
+    """
+    The dtypes of the xyz, type and particle id columns
+
+    Parameters
+    ----------
+    compact : bool
+        Whether to use float32 coordinates and small unsigned integer ids
+    max_type : int
+        The largest type id that has to fit
+
+    Returns
+    -------
+    tuple[np.dtype, np.dtype, np.dtype]
+        The coordinate, type and particle id dtypes
+    """
+    if not compact:
+        return np.dtype(np.float64), np.dtype(np.int32), np.dtype(np.int64)
+    type_dtype: np.dtype = np.dtype(np.uint8 if max_type <= 255 else np.uint16)
+    return np.dtype(np.float32), type_dtype, np.dtype(np.uint32)
+
+
+def estimate_capacity(expected: float) -> int:
+    """
+    Pad an expected point count by four standard deviations of a Poisson count
+
+    Parameters
+    ----------
+    expected : float
+        The expected number of points
+
+    Returns
+    -------
+    int
+        The number of points to preallocate
+    """
+    return int(np.ceil(expected + 4 * np.sqrt(expected)))
+
+
+def _resized(column: np.ndarray, capacity: int, used: int) -> np.ndarray:
+    """Copy the used part of a column into a new, larger column"""
+    grown: np.ndarray = np.empty((capacity,) + column.shape[1:], dtype=column.dtype)
+    grown[:used] = column[:used]
+    return grown
+
+
+def iter_batches(
+    writers: Iterable[Callable[[PointBuffer], None]], batch_size: int, **kwargs
+) -> Iterator[PointBuffer]:
+    """
+    Run particle writers into a sequence of buffers of about batch_size points
+
+    A buffer is handed out as soon as it holds batch_size points, so only one batch
+    (plus the particle that overflowed it) has to be held in memory at a time.
+
+    Parameters
+    ----------
+    writers : Iterable[Callable[[PointBuffer], None]]
+        Callables that each append one particle (or one group of particles)
+    batch_size : int
+        The number of points after which a batch is handed out
+    **kwargs
+        Passed on to PointBuffer, e.g. compact=True
+
+    Yields
+    ------
+    PointBuffer
+        The batches, in the order the writers ran
+    """
+    buffer: PointBuffer = PointBuffer(capacity=batch_size, **kwargs)
+    for write in writers:
+        write(buffer)
+        if len(buffer) >= batch_size:
+            yield buffer
+            buffer = PointBuffer(capacity=batch_size, **kwargs)
+    if len(buffer) > 0:
+        yield buffer
@@ -0,0 +1,282 @@
+from pathlib import Path
+from typing import Callable
+import hashlib
+import json
+import os
+import pickle
+import numpy as np
+
+# The default size cap of a cache directory, in bytes
+CACHE_SIZE: int = 2**30
+# Part of every cache key. Bump it whenever a cached stage samples differently, so
+# the entries of older versions are never read back
+CACHE_VERSION: int = 2
+# The stages of a box builder, each sampled with its own seed
+BUILD_STAGES: tuple[str, ...] = ("sizes", "centers", "points")
+# The stages of a builder of anisotropic particles. The orientations come last, so
+# the other seeds are those of BUILD_STAGES
+ORIENTED_STAGES: tuple[str, ...] = BUILD_STAGES + ("orientations",)
+
+
+def _canonical(value: object) -> object:
+    """Turn numpy values into the plain JSON types they stand for"""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} can not be part of a cache key")
+
+
+def stage_key(stage: str, inputs: dict) -> str:
+    """
+    The content address of a stage's output
+
+    Parameters
+    ----------
+    stage : str
+        The name of the stage, e.g. "centers"
+    inputs : dict
+        Everything the output depends on, including the seed of the stage
+
+    Returns
+    -------
+    str
+        The sha256 of the cache version, the stage name and its inputs in
+        canonical JSON
+    """
+    text: str = json.dumps(
+        [CACHE_VERSION, stage, inputs],
+        sort_keys=True,
+        default=_canonical,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def stage_seeds(
+    rng: np.random.Generator | None, stages: tuple[str, ...]
+) -> dict[str, int | None]:
+    """
+    Draw one seed per stage, so each stage samples independently of the others
+
+    A stage that is read from the cache then does not shift the random numbers of
+    the stages after it.
+
+    Parameters
+    ----------
+    rng : np.random.Generator | None
+        The generator of the whole run. None keeps the global np.random state for
+        every stage, and nothing is cached
+    stages : tuple[str, ...]
+        The names of the stages
+
+    Returns
+    -------
+    dict[str, int | None]
+        The seed of each stage
+    """
+    if rng is None:
+        return {stage: None for stage in stages}
+    return {
+        stage: int(seed)
+        for stage, seed in zip(stages, rng.integers(2**63, size=len(stages)))
+    }
+
+
+def stage_rng(seed: int | None) -> np.random.Generator | None:
+    """The generator of a stage, or None for the global np.random state"""
+    return None if seed is None else np.random.default_rng(seed)
+
+
+class StageCache:
+    """
+    A size-capped directory of stage outputs, addressed by the hash of their inputs
+
+    Every entry is one .npy file named after its key. Reading an entry refreshes its
+    modification time, and writing one evicts the least recently used entries until
+    the directory fits in max_bytes again.
+
+    Attributes
+    ----------
+    directory : Path
+        The directory of the entries
+    max_bytes : int
+        The size the directory is kept under
+    hits : int
+        The number of stages read from the cache
+    misses : int
+        The number of stages computed and written
+    """
+
+    def __init__(self, directory: str, max_bytes: int = CACHE_SIZE):
+        """
+        Opens (and makes) the cache directory
+
+        Parameters
+        ----------
+        directory : str
+            The directory of the entries, e.g. out/.cache
+        max_bytes : int
+            The size the directory is kept under
+        """
+        self.directory: Path = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes: int = max_bytes
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def path(self, key: str) -> Path:
+        return self.directory / f"{key}.npy"
+
+    def get(self, key: str) -> np.ndarray | None:
+        """
+        Read an entry
+
+        Parameters
+        ----------
+        key : str
+            The key of the entry
+
+        Returns
+        -------
+        np.ndarray | None
+            The stored array, or None if it is not (or no longer) cached. A truncated
+            or corrupt entry is a miss, and is removed
+        """
+        path: Path = self.path(key)
+        try:
+            value: np.ndarray = np.load(path)
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+            path.unlink(missing_ok=True)
+            return None
+        return value
+
+    def put(self, key: str, value: np.ndarray) -> None:
+        """
+        Write an entry, then evict the least recently used ones over the cap
+
+        Parameters
+        ----------
+        key : str
+            The key of the entry
+        value : np.ndarray
+            The array to store
+        """
+        path: Path = self.path(key)
+        # write under a temporary name so readers never see a partial file
+        partial_path: Path = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(partial_path, "wb") as f:
+            np.save(f, value)
+        os.replace(partial_path, path)
+        self.evict(keep=path)
+
+    def evict(self, keep: Path | None = None) -> None:
+        """
+        Remove the least recently used entries until the directory fits the cap
+
+        Parameters
+        ----------
+        keep : Path | None
+            An entry never to remove, e.g. the one just written
+        """
+        entries: list[tuple[float, int, Path]] = []
+        for path in self.directory.glob("*.npy"):
+            try:
+                stat: os.stat_result = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total: int = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def stage(
+        self, stage: str, inputs: dict, compute: Callable[[], np.ndarray]
+    ) -> np.ndarray:
+        """
+        Read a stage's output from the cache, or compute and store it
+
+        Parameters
+        ----------
+        stage : str
+            The name of the stage
+        inputs : dict
+            Everything the output depends on, including the seed of the stage
+        compute : Callable[[], np.ndarray]
+            Computes the output
+
+        Returns
+        -------
+        np.ndarray
+            The output
+        """
+        key: str = stage_key(stage, inputs)
+        value: np.ndarray | None = self.get(key)
+        if value is not None:
+            self.hits += 1
+            print(f"read the {stage} from the cache")
+            return value
+        self.misses += 1
+        value = np.asarray(compute())
+        self.put(key, value)
+        return value
+
+
+def cached_stage(
+    cache: StageCache | None,
+    stage: str,
+    inputs: dict,
+    compute: Callable[[], np.ndarray],
+) -> np.ndarray:
+    """
+    Run a stage through the cache, if there is one
+
+    Parameters
+    ----------
+    cache : StageCache | None
+        The cache, or None to always compute
+    stage : str
+        The name of the stage
+    inputs : dict
+        Everything the output depends on, including the seed of the stage
+    compute : Callable[[], np.ndarray]
+        Computes the output
+
+    Returns
+    -------
+    np.ndarray
+        The output
+    """
+    if cache is None:
+        return np.asarray(compute())
+    return cache.stage(stage, inputs, compute)
+
+
+def open_cache(config: dict, rng: np.random.Generator | None) -> StageCache | None:
+    """
+    The cache of a builder's config, if it has a cache_dir and a seeded generator
+
+    Parameters
+    ----------
+    config : dict
+        The parameters of the builder, with cache_dir and cache_size
+    rng : np.random.Generator | None
+        The generator of the run. Runs on the global np.random state are not cached,
+        since their seed is unknown
+
+    Returns
+    -------
+    StageCache | None
+        The cache, or None
+    """
+    if config["cache_dir"] is None or rng is None:
+        return None
+    return StageCache(config["cache_dir"], config["cache_size"])
@@ -0,0 +1,261 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+import os
+import struct
+import zlib
+
+# Number of characters compressed as one independent block
+COMPRESS_BLOCK: int = 2**22
+
+COMPRESSION_SUFFIXES: dict[str, str] = {".gz": "gzip", ".zst": "zstd", ".zstd": "zstd"}
+
+
+def compression_from_name(filename: str) -> str | None:
+    """
+    The compression implied by a file name, e.g. "gzip" for out/box.dump.gz
+
+    Parameters
+    ----------
+    filename : str
+        The name of the output file
+
+    Returns
+    -------
+    str | None
+        "gzip", "zstd" or None for plain text
+    """
+    return COMPRESSION_SUFFIXES.get(os.path.splitext(filename)[1])
+
+
+class CompressedTextFile:
+    """
+    A write-only text file compressed in parallel blocks as it is written
+
+    The text is cut into blocks of COMPRESS_BLOCK characters that are compressed
+    independently on a thread pool (zlib and zstd release the GIL) and written
+    in order. gzip output is one member whose deflate blocks are sync-flushed so
+    they can be concatenated, like pigz. zstd output is a sequence of frames.
+
+    The header is stored uncompressed at the start of the stream, so it can be
+    replaced by a header of the same length when the file is closed.
+
+    Attributes
+    ----------
+    filename : str
+        The name of the file
+    compression : str
+        "gzip" or "zstd"
+    level : int
+        The compression level
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        header: str,
+        compression: str = "gzip",
+        level: int | None = None,
+        threads: int | None = None,
+    ):
+        """
+        Opens the file and writes the header
+
+        Parameters
+        ----------
+        filename : str
+            The name of the file
+        header : str
+            The text at the start of the file
+        compression : str
+            "gzip" or "zstd"
+        level : int | None
+            The compression level. Defaults to 6 for gzip and 3 for zstd
+        threads : int | None
+            The number of compression threads. Defaults to the number of CPUs
+        """
+        assert compression in ("gzip", "zstd")
+        if compression == "zstd":
+            import zstandard  # noqa: F401, fail early if the optional package is missing
+        self.filename: str = filename
+        self.compression: str = compression
+        self.level: int = (
+            level if level is not None else (6 if compression == "gzip" else 3)
+        )
+        self.closed: bool = False
+        self._threads: int = threads or os.cpu_count() or 1
+        self._executor = ThreadPoolExecutor(max_workers=self._threads)
+        self._pending: list[Future] = []
+        self._text: list[str] = []
+        self._text_size: int = 0
+        self._crc: int = 0
+        self._length: int = 0
+        self._header: bytes = header.encode()
+        self._raw = open(filename, "wb")
+        if compression == "gzip":
+            # magic, deflate, no flags, no mtime, no extra flags, unknown OS
+            self._raw.write(b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff")
+        self._header_offset: int = self._raw.tell()
+        self._raw.write(self._stored(self._header))
+
+    def __enter__(self) -> "CompressedTextFile":
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        self.close()
+
+    def write(self, text: str) -> None:
+        """
+        Append text, compressing it once a whole block has been collected
+
+        Parameters
+        ----------
+        text : str
+            The text to append
+        """
+        self._text.append(text)
+        self._text_size += len(text)
+        if self._text_size >= COMPRESS_BLOCK:
+            self._submit()
+
+    def close(self, header: str | None = None) -> None:
+        """
+        Compress what is left, replace the header if given and close the file
+
+        Parameters
+        ----------
+        header : str | None
+            A new header, with the same length as the one the file was opened with
+        """
+        if self.closed:
+            return
+        self._submit()
+        while self._pending:
+            self._write_next()
+        self._executor.shutdown()
+        if header is not None:
+            new_header: bytes = header.encode()
+            assert len(new_header) == len(self._header)
+            self._header = new_header
+        if self.compression == "gzip":
+            # an empty final block ends the deflate stream
+            self._raw.write(zlib.compressobj(wbits=-15).flush(zlib.Z_FINISH))
+            crc: int = crc32_combine(zlib.crc32(self._header), self._crc, self._length)
+            size: int = (len(self._header) + self._length) & 0xFFFFFFFF
+            self._raw.write(struct.pack("<II", crc, size))
+        self._raw.seek(self._header_offset)
+        self._raw.write(self._stored(self._header))
+        self._raw.close()
+        self.closed = True
+
+    def _stored(self, data: bytes) -> bytes:
+        """Wrap data without compressing it, so its size only depends on its length"""
+        if self.compression == "gzip":
+            stored = zlib.compressobj(0, zlib.DEFLATED, -15)
+            return stored.compress(data) + stored.flush(zlib.Z_SYNC_FLUSH)
+        return zstd_raw_frame(data)
+
+    def _submit(self) -> None:
+        """Hand the collected text to the thread pool"""
+        if not self._text:
+            return
+        text: str = "".join(self._text)
+        self._text = []
+        self._text_size = 0
+        self._pending.append(self._executor.submit(self._compress, text))
+        if len(self._pending) >= 2 * self._threads:
+            self._write_next()
+
+    def _compress(self, text: str) -> tuple[bytes, int, int]:
+        """Compress one block on a worker thread"""
+        data: bytes = text.encode()
+        if self.compression == "gzip":
+            deflate = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+            block: bytes = deflate.compress(data) + deflate.flush(zlib.Z_SYNC_FLUSH)
+            return block, zlib.crc32(data), len(data)
+        import zstandard
+
+        return zstandard.ZstdCompressor(level=self.level).compress(data), 0, len(data)
+
+    def _write_next(self) -> None:
+        """Write the oldest compressed block"""
+        block, crc, length = self._pending.pop(0).result()
+        self._raw.write(block)
+        self._crc = crc32_combine(self._crc, crc, length)
+        self._length += length
+
+
+def zstd_raw_frame(data: bytes) -> bytes:
+    """
+    A zstd frame holding data in raw (uncompressed) blocks
+
+    Parameters
+    ----------
+    data : bytes
+        The data, at most 1 KiB so it fits the smallest window
+
+    Returns
+    -------
+    bytes
+        The frame
+    """
+    assert len(data) <= 1024
+    # magic number, no flags, 1 KiB window
+    frame: bytes = struct.pack("<I", 0xFD2FB528) + b"\x00\x00"
+    # last block flag, raw block type (0), block size
+    block_header: int = 1 | (len(data) << 3)
+    return frame + block_header.to_bytes(3, "little") + data
+
+
+def crc32_combine(crc1: int, crc2: int, len2: int) -> int:
+    """
+    The CRC-32 of two concatenated byte strings from their separate CRCs
+
+    This is zlib's crc32_combine, which the zlib module does not expose.
+
+    Parameters
+    ----------
+    crc1 : int
+        The CRC-32 of the first bytes
+    crc2 : int
+        The CRC-32 of the second bytes
+    len2 : int
+        The length of the second bytes
+
+    Returns
+    -------
+    int
+        The CRC-32 of the concatenation
+    """
+    if len2 == 0:
+        return crc1
+    odd: list[int] = [0xEDB88320] + [1 << n for n in range(31)]
+    even: list[int] = _gf2_matrix_square(odd)
+    odd = _gf2_matrix_square(even)
+    while True:
+        even = _gf2_matrix_square(odd)
+        if len2 & 1:
+            crc1 = _gf2_matrix_times(even, crc1)
+        len2 >>= 1
+        if len2 == 0:
+            break
+        odd = _gf2_matrix_square(even)
+        if len2 & 1:
+            crc1 = _gf2_matrix_times(odd, crc1)
+        len2 >>= 1
+        if len2 == 0:
+            break
+    return crc1 ^ crc2
+
+
+def _gf2_matrix_times(matrix: list[int], vector: int) -> int:
+    result: int = 0
+    row: int = 0
+    while vector:
+        if vector & 1:
+            result ^= matrix[row]
+        vector >>= 1
+        row += 1
+    return result
+
+
+def _gf2_matrix_square(matrix: list[int]) -> list[int]:
+    return [_gf2_matrix_times(matrix, matrix[n]) for n in range(32)]
@@ -0,0 +1,150 @@
+from itertools import product
+from pathlib import Path
+import json
+from .cache import CACHE_SIZE
+
+# The generation and output options every box builder accepts besides its parameters
+OUTPUT_CONFIG: dict = {
+    "output_dir": "out",  # the directory the files are written to
+    "compact": False,  # float32 coordinates and small integer ids
+    "stream": False,  # write batches while generating, for boxes too big for memory
+    "binary": False,  # write a memory-mapped .pts container instead of the text dump
+    "save_table": False,  # also save the particle table (.npz) and an OVITO shape dump
+    "compression": None,  # "gzip" or "zstd" to compress the dump
+    "batch_size": 2**22,
+    "cache_dir": None,  # a directory to cache the sizes and centers in, by their inputs
+    "cache_size": CACHE_SIZE,  # the bytes the cache directory is kept under
+    "workers": 1,  # processes generating the particles from their own seeds, 0 for all
+    "dry_run": False,  # only draw the sizes and report the expected points and costs
+    "memory_budget": None,  # bytes; switch to compact or streamed output to stay under
+    "voxels": None,  # a grid size; write the density of each type (.vox), not points
+    "rasterize": False,  # with voxels, fill the grid from the shapes without points
+}
+# The output options of the builders of a single object or network
+OBJECT_CONFIG: dict = {
+    "output_dir": "out",
+    "compact": False,
+    "compression": None,
+}
+# The suffix of a compressed dump
+DUMP_SUFFIXES: dict[str, str] = {"gzip": ".gz", "zstd": ".zst"}
+
+
+def load_config(filename: str) -> dict:
+    """
+    Read a config file
+
+    Parameters
+    ----------
+    filename : str
+        The name of a .toml or .json file
+
+    Returns
+    -------
+    dict
+        The parameters in the file
+    """
+    path: Path = Path(filename)
+    if path.suffix == ".toml":
+        # tomllib is only in the standard library from Python 3.11
+        try:
+            import tomllib
+        except ModuleNotFoundError:
+            import tomli as tomllib
+        with open(path, "rb") as f:
+            return tomllib.load(f)
+    assert path.suffix == ".json", f"{filename} is neither .toml nor .json"
+    with open(path) as f:
+        return json.load(f)
+
+
+def merge_config(defaults: dict, config: dict | None = None) -> dict:
+    """
+    Override the defaults of a builder with the values of a config
+
+    Parameters
+    ----------
+    defaults : dict
+        The default parameters of the builder
+    config : dict | None
+        The parameters to override. Every key has to be one of the defaults
+
+    Returns
+    -------
+    dict
+        A new dict with every parameter
+    """
+    config = dict(config or {})
+    unknown: set = set(config) - set(defaults)
+    assert not unknown, f"unknown parameters: {', '.join(sorted(unknown))}"
+    return defaults | config
+
+
+def output_path(config: dict, filename: str) -> str:
+    """
+    The path of an output file of a builder
+
+    Parameters
+    ----------
+    config : dict
+        The parameters of the builder, with output_dir and compression
+    filename : str
+        The name of the file, e.g. box_onion.dump
+
+    Returns
+    -------
+    str
+        The file inside output_dir, with .gz or .zst added to compressed dumps
+    """
+    path: str = str(Path(config["output_dir"]) / filename)
+    if path.endswith(".dump"):
+        path += DUMP_SUFFIXES.get(config["compression"], "")
+    return path
+
+
+def parse_assignment(assignment: str) -> tuple[str, object]:
+    """
+    Parse a key=value override from the command line
+
+    The value is read as JSON, so numbers, lists and booleans keep their type, and
+    anything that is not valid JSON is kept as a string.
+
+    Parameters
+    ----------
+    assignment : str
+        e.g. volume_fraction=0.1 or density=[0.0,0.05]
+
+    Returns
+    -------
+    tuple[str, object]
+        The key and its value
+    """
+    key, sep, value = assignment.partition("=")
+    assert sep, f"expected key=value, got {assignment}"
+    try:
+        return key.strip(), json.loads(value)
+    except json.JSONDecodeError:
+        return key.strip(), value
+
+
+def expand_grid(base: dict, grid: dict[str, list]) -> list[dict]:
+    """
+    Expand a parameter grid into one config per combination of values
+
+    Parameters
+    ----------
+    base : dict
+        The parameters shared by every job
+    grid : dict[str, list]
+        The values to sweep each parameter over
+
+    Returns
+    -------
+    list[dict]
+        One config per element of the cartesian product of the grid, with the last
+        parameter varying fastest
+    """
+    keys: list[str] = list(grid)
+    for key in keys:
+        assert isinstance(grid[key], list), f"the grid values of {key} are not a list"
+    return [base | dict(zip(keys, values)) for values in product(*grid.values())]
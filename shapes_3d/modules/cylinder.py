@@ -1,5 +1,6 @@
 import numpy as np
-from scipy.spatial.transform import Rotation as Rot
+from .profiling import count
+from .rotations import polar_rotation, rotate, to_body
 
 
 class Cylinder:
@@ -10,18 +11,52 @@ class Cylinder:
         radius: float,
         polar: float,
         azmiuthal: float,
+        center: np.ndarray | None = None,
     ) -> None:
         self.polar = polar
         self.azmiuthal = azmiuthal
         self.density = density
         self.length = length
         self.radius = radius
+        # where contains and signed_distance put the cylinder, None for the origin
+        self.center = center
 
-    def make_obj(self) -> np.ndarray:
+    def expected_count(self) -> float:
+        return self.density * np.pi * self.radius**2 * self.length
+
+    def rotation(self) -> np.ndarray:
+        """The matrix of make_obj's rotation, by polar about y then azmiuthal about z"""
+        return polar_rotation(self.polar, self.azmiuthal)
+
+    def contains(self, points: np.ndarray) -> np.ndarray:
+        """Whether each of the (n, 3) points in world coordinates is in the cylinder"""
+        body: np.ndarray = to_body(points, self.center, self.rotation())
+        return (np.sum(body[:, :2] ** 2, axis=1) <= self.radius**2) & (
+            np.abs(body[:, 2]) <= self.length / 2
+        )
+
+    def signed_distance(self, points: np.ndarray) -> np.ndarray:
+        """The distance of each of the (n, 3) points to the surface, negative inside"""
+        body: np.ndarray = to_body(points, self.center, self.rotation())
+        # the distances past the side and past the caps
+        past: np.ndarray = np.column_stack(
+            (
+                np.linalg.norm(body[:, :2], axis=1) - self.radius,
+                np.abs(body[:, 2]) - self.length / 2,
+            )
+        )
+        return np.minimum(np.max(past, axis=1), 0) + np.linalg.norm(
+            np.maximum(past, 0), axis=1
+        )
+
+    def make_obj(
+        self, dtype: np.dtype = np.float64, rng: np.random.Generator | None = None
+    ) -> np.ndarray:
         volume_box = (2 * self.radius) ** 2 * self.length
         num_points: int = int(self.density * volume_box)
 
-        points: np.ndarray = np.random.uniform(
+        random = np.random if rng is None else rng
+        points: np.ndarray = random.uniform(
             low=[-self.radius, -self.radius, -self.length / 2],
             high=[self.radius, self.radius, self.length / 2],
             size=(num_points, 3),
@@ -30,24 +65,6 @@ class Cylinder:
         r2 = np.sum(points[:, :2] ** 2, axis=1)
         inside = r2 <= self.radius**2
         result = points[inside]
-        quaternion_y: np.ndarray = np.array(
-            [
-                0,
-                np.sin(self.polar / 2),
-                0,
-                np.cos(self.polar / 2),
-            ],
-        )
-        quaternion_z: np.ndarray = np.array(
-            [
-                0,
-                0,
-                np.sin(self.azmiuthal / 2),
-                np.cos(self.azmiuthal / 2),
-            ]
-        )
-        rotation_1: Rot = Rot.from_quat(quaternion_y)
-        rotation_2: Rot = Rot.from_quat(quaternion_z)
-
-        position_1: np.ndarray = rotation_1.apply(result)
-        return rotation_2.apply(position_1)
+        count("cylinder.candidates", num_points)
+        count("cylinder.accepted", result.shape[0])
+        return rotate(result, self.rotation()).astype(dtype, copy=False)
@@ -0,0 +1,502 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from queue import Queue
+import io
+import json
+import os
+from threading import Thread
+from typing import IO, Iterable
+import numpy as np
+from .buffer import PointBuffer
+from .compress import CompressedTextFile, compression_from_name
+
+# Width of the zero-padded atom count written when it is only known at the end
+COUNT_WIDTH: int = 15
+# One line of the ATOMS section. "%d" truncates like int(), "%.6f" rounds like f"{x:.6f}"
+ATOM_FORMAT: str = "%d %d %.6f %.6f %.6f\n"
+# Number of lines formatted with one % operation
+BLOCK_SIZE: int = 2**16
+# Size of the write buffer of the dump files
+WRITE_BUFFER: int = 2**22
+
+
+def dump_header(
+    num_atoms: int | str, box_len: float, columns: str = "id type x y z"
+) -> str:
+    """
+    The header save_dump writes before the atoms
+
+    Parameters
+    ----------
+    num_atoms : int | str
+        The number of atoms, as it should appear in the file
+    box_len : float
+        The length of the simulation box for the points.
+    columns : str
+        The names of the per-atom columns
+
+    Returns
+    -------
+    str
+        The header, ending with the ITEM: ATOMS line
+    """
+    return (
+        "ITEM: TIMESTEP\n0\n"
+        f"ITEM: NUMBER OF ATOMS\n{num_atoms}\n"
+        f"ITEM: BOX BOUNDS pp pp pp\n{-box_len // 2} {box_len // 2}\n{-box_len // 2} {box_len // 2}\n{-box_len // 2} {box_len // 2}\n"
+        f"ITEM: ATOMS {columns}\n"
+    )
+
+
+def format_atoms(first_id: int, types: np.ndarray, xyz: np.ndarray) -> str:
+    """
+    Format a block of atoms into ATOMS lines with a single string operation
+
+    Parameters
+    ----------
+    first_id : int
+        The id of the first atom. The ids count up from there
+    types : np.ndarray
+        The type of each atom. Float types are truncated like int()
+    xyz : np.ndarray
+        The (x, y, z) coordinates, with shape (M, 3)
+
+    Returns
+    -------
+    str
+        The lines, byte for byte what a per-line f-string would produce
+    """
+    num: int = xyz.shape[0]
+    ids: np.ndarray = np.arange(first_id, first_id + num)
+    block: np.ndarray = np.column_stack((ids, types, xyz))
+    return (ATOM_FORMAT * num) % tuple(block.ravel().tolist())
+
+
+def write_atoms(
+    f: IO[str],
+    first_id: int,
+    types: np.ndarray | float,
+    xyz: np.ndarray,
+    block_size: int = BLOCK_SIZE,
+) -> None:
+    """
+    Write atoms in blocks of block_size lines
+
+    Parameters
+    ----------
+    f : IO[str]
+        The open dump file
+    first_id : int
+        The id of the first atom. The ids count up from there
+    types : np.ndarray | float
+        The type of each atom, or one type for all of them
+    xyz : np.ndarray
+        The (x, y, z) coordinates, with shape (M, 3)
+    block_size : int
+        The number of lines formatted at once
+    """
+    types = np.broadcast_to(types, (xyz.shape[0],))
+    for start in range(0, xyz.shape[0], block_size):
+        stop: int = start + block_size
+        f.write(format_atoms(first_id + start, types[start:stop], xyz[start:stop]))
+
+
+class PlainTextFile:
+    """
+    A buffered text file whose header can be replaced by one of the same length on close
+    """
+
+    def __init__(self, filename: str, header: str):
+        self.closed: bool = False
+        self._header_length: int = len(header)
+        self._file = open(filename, "w", buffering=WRITE_BUFFER)
+        self._file.write(header)
+
+    def __enter__(self) -> "PlainTextFile":
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        self.close()
+
+    def write(self, text: str) -> None:
+        self._file.write(text)
+
+    def close(self, header: str | None = None) -> None:
+        if self.closed:
+            return
+        if header is not None:
+            assert len(header) == self._header_length
+            self._file.seek(0)
+            self._file.write(header)
+        self._file.close()
+        self.closed = True
+
+
+def open_dump(
+    filename: str, header: str, compression: str | None = None
+) -> PlainTextFile | CompressedTextFile:
+    """
+    Open a dump file for writing, compressed if the name ends in .gz or .zst
+
+    Parameters
+    ----------
+    filename : str
+        The name of the file to save the coordinates.
+    header : str
+        The header to start the file with
+    compression : str | None
+        "gzip", "zstd" or "none". Defaults to what the file name implies
+
+    Returns
+    -------
+    PlainTextFile | CompressedTextFile
+        The open file. Its close() takes an optional replacement header
+    """
+    Path(filename).parent.mkdir(parents=True, exist_ok=True)
+    compression = compression or compression_from_name(filename)
+    if compression is None or compression == "none":
+        return PlainTextFile(filename, header)
+    return CompressedTextFile(filename, header, compression)
+
+
+class DumpWriter:
+    """
+    Writes a dump file incrementally, one chunk of points at a time
+
+    The ids keep counting up across chunks. When the number of atoms is not known
+    up front, a zero-padded placeholder is written and patched when the writer closes.
+
+    Attributes
+    ----------
+    filename : str
+        The name of the file to save the coordinates.
+    box_len : float
+        The length of the simulation box for the points.
+    num_atoms : int | None
+        The number of atoms announced in the header, if known up front
+    written : int
+        The number of atoms written so far
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        box_len: float,
+        num_atoms: int | None = None,
+        compression: str | None = None,
+    ):
+        """
+        Opens the file and writes the header
+
+        Parameters
+        ----------
+        filename : str
+            The name of the file to save the coordinates.
+        box_len : float
+            The length of the simulation box for the points.
+        num_atoms : int | None
+            The number of atoms, if known up front
+        compression : str | None
+            "gzip", "zstd" or "none". Defaults to what the file name implies
+        """
+        self.filename: str = filename
+        self.box_len: float = box_len
+        self.num_atoms: int | None = num_atoms
+        self.written: int = 0
+        count: int | str = num_atoms if num_atoms is not None else "0" * COUNT_WIDTH
+        self._file = open_dump(filename, dump_header(count, box_len), compression)
+
+    def __enter__(self) -> "DumpWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        self.close()
+
+    def write(self, xyz: np.ndarray, types: np.ndarray) -> None:
+        """
+        Append atoms to the file
+
+        Parameters
+        ----------
+        xyz : np.ndarray
+            The (x, y, z) coordinates, with shape (M, 3)
+        types : np.ndarray
+            The type of each point, with shape (M,)
+        """
+        write_atoms(self._file, self.written + 1, types, xyz)
+        self.written += xyz.shape[0]
+
+    def write_buffer(self, buffer: PointBuffer) -> None:
+        """
+        Append every point of a buffer to the file
+
+        Parameters
+        ----------
+        buffer : PointBuffer
+            The points to write
+        """
+        self.write(buffer.xyz, buffer.types)
+
+    def consume(self, chunks: Iterable[PointBuffer], queue_size: int = 2) -> None:
+        """
+        Write chunks as they are generated
+
+        The chunks are written on a background thread, so the next chunk can be
+        generated while the previous one is written. At most queue_size chunks
+        wait in memory at a time.
+
+        Parameters
+        ----------
+        chunks : Iterable[PointBuffer]
+            The chunks of points, in order
+        queue_size : int
+            The number of generated chunks allowed to wait for the writer
+        """
+        pending: Queue = Queue(maxsize=queue_size)
+        errors: list[BaseException] = []
+
+        def drain() -> None:
+            while (chunk := pending.get()) is not None:
+                if not errors:
+                    try:
+                        self.write_buffer(chunk)
+                    except BaseException as error:
+                        errors.append(error)
+
+        worker = Thread(target=drain, daemon=True)
+        worker.start()
+        try:
+            for chunk in chunks:
+                if errors:
+                    break
+                pending.put(chunk)
+        finally:
+            pending.put(None)
+            worker.join()
+        if errors:
+            raise errors[0]
+
+    def close(self) -> None:
+        """
+        Patch the atom count into the header if needed and close the file
+        """
+        if self._file.closed:
+            return
+        if self.num_atoms is None:
+            assert len(str(self.written)) <= COUNT_WIDTH
+            count: str = str(self.written).zfill(COUNT_WIDTH)
+            self._file.close(header=dump_header(count, self.box_len))
+            return
+        if self.num_atoms != self.written:
+            print(
+                f"Warning: {self.filename} announces {self.num_atoms} atoms but {self.written} were written"
+            )
+        self._file.close()
+
+
+def save_dump_stream(
+    chunks: Iterable[PointBuffer],
+    filename: str,
+    box_len: float,
+    num_atoms: int | None = None,
+    compression: str | None = None,
+) -> int:
+    """
+    Save chunks of points to a dump file as they are generated, for use with OVITO.
+
+    Parameters
+    ----------
+    chunks : Iterable[PointBuffer]
+        The chunks of points, in order
+    filename : str
+        The name of the file to save the coordinates.
+    box_len : float
+        The length of the simulation box for the points.
+    num_atoms : int | None
+        The number of atoms, if known up front. Otherwise it is patched in at the end
+    compression : str | None
+        "gzip", "zstd" or "none". Defaults to what the file name implies
+
+    Returns
+    -------
+    int
+        The number of atoms written
+    """
+    print("dumping...")
+    with DumpWriter(filename, box_len, num_atoms, compression) as writer:
+        writer.consume(chunks)
+    print("dumped to", filename)
+    return writer.written
+
+
+def _format_shard(first_id: int, types: np.ndarray, xyz: np.ndarray) -> str:
+    """Format one shard in a worker process"""
+    out = io.StringIO()
+    write_atoms(out, first_id, types, xyz)
+    return out.getvalue()
+
+
+def _write_shard(
+    filename: str,
+    box_len: float,
+    first_id: int,
+    types: np.ndarray,
+    xyz: np.ndarray,
+    compression: str | None,
+) -> int:
+    """Write one shard as a standalone dump file in a worker process"""
+    with open_dump(filename, dump_header(xyz.shape[0], box_len), compression) as f:
+        write_atoms(f, first_id, types, xyz)
+    return xyz.shape[0]
+
+
+def shard_bounds(num_atoms: int, shard_size: int) -> list[tuple[int, int]]:
+    """
+    Split the atoms into consecutive [start, stop) ranges of at most shard_size
+
+    Parameters
+    ----------
+    num_atoms : int
+        The number of atoms
+    shard_size : int
+        The largest number of atoms in one shard
+
+    Returns
+    -------
+    list[tuple[int, int]]
+        The start and stop index of each shard
+    """
+    return [
+        (start, min(start + shard_size, num_atoms))
+        for start in range(0, num_atoms, shard_size)
+    ]
+
+
+def save_dump_parallel(
+    points: PointBuffer,
+    filename: str,
+    box_len: float,
+    workers: int | None = None,
+    shard_size: int = 2**21,
+    sharded: bool = False,
+    compression: str | None = None,
+) -> list[str]:
+    """
+    Save points to a dump file, formatting shards of them on a process pool.
+
+    The ids are unique and contiguous over the whole box, running from 1. In the
+    default mode the shards are written to filename in order, giving one valid dump.
+    With sharded=True every shard becomes its own valid dump file next to filename,
+    and filename.manifest.json lists them with their id ranges.
+
+    Parameters
+    ----------
+    points : PointBuffer
+        The points to write
+    filename : str
+        The name of the file to save the coordinates.
+    box_len : float
+        The length of the simulation box for the points.
+    workers : int | None
+        The number of worker processes. Defaults to the number of CPUs
+    shard_size : int
+        The number of atoms formatted by one task
+    sharded : bool
+        Whether to write one file per shard plus a manifest
+    compression : str | None
+        "gzip", "zstd" or "none". Defaults to what the file name implies
+
+    Returns
+    -------
+    list[str]
+        The files written, excluding the manifest
+    """
+    print("dumping...")
+    workers = workers or os.cpu_count() or 1
+    bounds: list[tuple[int, int]] = shard_bounds(len(points), shard_size)
+    Path(filename).parent.mkdir(parents=True, exist_ok=True)
+    compression = compression or compression_from_name(filename)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        if sharded:
+            files: list[str] = _write_shards(
+                executor, points, filename, box_len, bounds, compression
+            )
+        else:
+            _write_concatenated(
+                executor, points, filename, box_len, bounds, workers, compression
+            )
+            files = [filename]
+    print("dumped to", filename)
+    return files
+
+
+def _write_concatenated(
+    executor: ProcessPoolExecutor,
+    points: PointBuffer,
+    filename: str,
+    box_len: float,
+    bounds: list[tuple[int, int]],
+    workers: int,
+    compression: str | None,
+) -> None:
+    """Format shards in parallel, keeping at most 2 * workers in flight, and write in order"""
+    pending: list[Future] = []
+    with open_dump(filename, dump_header(len(points), box_len), compression) as f:
+        for start, stop in bounds:
+            pending.append(
+                executor.submit(
+                    _format_shard,
+                    start + 1,
+                    points.types[start:stop],
+                    points.xyz[start:stop],
+                )
+            )
+            if len(pending) >= 2 * workers:
+                f.write(pending.pop(0).result())
+        for future in pending:
+            f.write(future.result())
+
+
+def _write_shards(
+    executor: ProcessPoolExecutor,
+    points: PointBuffer,
+    filename: str,
+    box_len: float,
+    bounds: list[tuple[int, int]],
+    compression: str | None,
+) -> list[str]:
+    """Write every shard as its own dump and describe them in a manifest"""
+    path: Path = Path(filename)
+    stem, suffix = os.path.splitext(path.name)
+    if compression_from_name(path.name) is not None:
+        stem, extension = os.path.splitext(stem)
+        suffix = extension + suffix
+    names: list[str] = [
+        str(path.with_name(f"{stem}.{k:05d}{suffix}")) for k in range(len(bounds))
+    ]
+    futures: list[Future] = [
+        executor.submit(
+            _write_shard,
+            name,
+            box_len,
+            start + 1,
+            points.types[start:stop],
+            points.xyz[start:stop],
+            compression,
+        )
+        for name, (start, stop) in zip(names, bounds)
+    ]
+    for future in futures:
+        future.result()
+    manifest: dict = {
+        "format": "lammps-dump",
+        "box_len": box_len,
+        "num_atoms": len(points),
+        "shards": [
+            {"file": Path(name).name, "first_id": start + 1, "num_atoms": stop - start}
+            for name, (start, stop) in zip(names, bounds)
+        ],
+    }
+    with open(f"{filename}.manifest.json", "w") as f:
+        json.dump(manifest, f, indent=2)
+    return names
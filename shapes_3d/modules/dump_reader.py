@@ -0,0 +1,220 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import IO, Iterator
+import gzip
+import io
+import os
+import numpy as np
+from .binary import save_points
+from .buffer import PointBuffer
+from .compress import compression_from_name
+
+# Number of bytes of ATOMS lines parsed as one block
+READ_BLOCK: int = 2**25
+# The columns save_dump writes
+DUMP_COLUMNS: list[str] = ["id", "type", "x", "y", "z"]
+
+
+def open_dump_for_reading(filename: str) -> IO[bytes]:
+    """
+    Open a dump file, decompressing it if its name ends in .gz or .zst
+
+    Parameters
+    ----------
+    filename : str
+        The name of the dump file
+
+    Returns
+    -------
+    IO[bytes]
+        The file, in binary mode
+    """
+    compression: str | None = compression_from_name(filename)
+    if compression == "gzip":
+        return gzip.open(filename, "rb")
+    if compression == "zstd":
+        import zstandard
+
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            open(filename, "rb"), read_across_frames=True, closefd=True
+        )
+        return io.BufferedReader(reader, buffer_size=READ_BLOCK)
+    return open(filename, "rb")
+
+
+def read_dump_header(f: IO[bytes]) -> dict:
+    """
+    Read the header of a dump file up to and including its ITEM: ATOMS line
+
+    Parameters
+    ----------
+    f : IO[bytes]
+        The open dump file, at its start
+
+    Returns
+    -------
+    dict
+        The timestep, number of atoms, box bounds, box length and atom columns
+    """
+    header: dict = {}
+    while True:
+        line: str = f.readline().decode()
+        assert line, "the dump ended before its ITEM: ATOMS line"
+        if line.startswith("ITEM: TIMESTEP"):
+            header["timestep"] = int(f.readline())
+        elif line.startswith("ITEM: NUMBER OF ATOMS"):
+            header["num_atoms"] = int(f.readline())
+        elif line.startswith("ITEM: BOX BOUNDS"):
+            bounds: list[list[float]] = [
+                [float(value) for value in f.readline().split()[:2]] for _ in range(3)
+            ]
+            header["bounds"] = bounds
+            header["box_len"] = bounds[0][1] - bounds[0][0]
+        elif line.startswith("ITEM: ATOMS"):
+            header["columns"] = line.split()[2:]
+            return header
+
+
+def iter_blocks(f: IO[bytes], block_size: int = READ_BLOCK) -> Iterator[bytes]:
+    """
+    Cut the rest of a file into blocks of about block_size bytes of whole lines
+
+    Parameters
+    ----------
+    f : IO[bytes]
+        The open file
+    block_size : int
+        The number of bytes read at a time
+
+    Yields
+    ------
+    bytes
+        The blocks, each ending at the end of a line
+    """
+    rest: bytes = b""
+    while data := f.read(block_size):
+        data = rest + data
+        end: int = data.rfind(b"\n") + 1
+        if end == 0:
+            rest = data
+            continue
+        rest = data[end:]
+        yield data[:end]
+    if rest.strip():
+        yield rest
+
+
+def parse_atoms(block: bytes, num_columns: int = len(DUMP_COLUMNS)) -> np.ndarray:
+    """
+    Parse whole ATOMS lines with a single call into numpy
+
+    Parameters
+    ----------
+    block : bytes
+        The lines
+    num_columns : int
+        The number of values on every line
+
+    Returns
+    -------
+    np.ndarray
+        The values, with shape (M, num_columns)
+    """
+    values: np.ndarray = np.fromstring(block, sep=" ")
+    assert values.shape[0] % num_columns == 0, "a line has the wrong number of values"
+    return values.reshape(-1, num_columns)
+
+
+def read_dump(
+    filename: str,
+    workers: int | None = 1,
+    block_size: int = READ_BLOCK,
+    compact: bool = False,
+) -> tuple[PointBuffer, np.ndarray, dict]:
+    """
+    Read a dump file written by save_dump into typed arrays
+
+    The ATOMS lines are parsed in large blocks, optionally on a process pool,
+    and copied straight into preallocated columns. Compressed dumps (.gz, .zst)
+    are decompressed while they are read.
+
+    Parameters
+    ----------
+    filename : str
+        The name of the dump file
+    workers : int | None
+        The number of worker processes. 1 parses in this process, None uses every CPU
+    block_size : int
+        The number of bytes parsed by one task
+    compact : bool
+        Whether to return float32 coordinates and small integer types
+
+    Returns
+    -------
+    tuple[PointBuffer, np.ndarray, dict]
+        The points with their types (every particle id is 0, since dumps do not
+        store them), the atom ids and the header of the file
+    """
+    print("reading...")
+    with open_dump_for_reading(filename) as f:
+        header: dict = read_dump_header(f)
+        assert header["columns"] == DUMP_COLUMNS, "expected ATOMS id type x y z"
+        num: int = header["num_atoms"]
+        # the largest type is only known once everything is read, so allow uint16
+        points: PointBuffer = PointBuffer(
+            capacity=num, compact=compact, max_type=np.iinfo(np.uint16).max
+        )
+        ids: np.ndarray = np.empty(num, dtype=np.int64)
+
+        def store(atoms: np.ndarray) -> None:
+            start: int = len(points)
+            assert (
+                start + atoms.shape[0] <= num
+            ), f"{filename} announces {num} atoms but has more"
+            xyz, types, particles = points.allocate(atoms.shape[0])
+            ids[start : len(points)] = atoms[:, 0]
+            types[:] = atoms[:, 1]
+            xyz[:] = atoms[:, 2:]
+            particles[:] = 0
+
+        blocks: Iterator[bytes] = iter_blocks(f, block_size)
+        workers = workers or os.cpu_count() or 1
+        if workers == 1:
+            for block in blocks:
+                store(parse_atoms(block))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                pending: list[Future] = []
+                for block in blocks:
+                    pending.append(executor.submit(parse_atoms, block))
+                    if len(pending) >= 2 * workers:
+                        store(pending.pop(0).result())
+                for future in pending:
+                    store(future.result())
+    assert len(points) == num, f"{filename} announces {num} atoms but has {len(points)}"
+    print("read", filename)
+    return points, ids, header
+
+
+def convert_dump(
+    filename: str,
+    out_filename: str,
+    workers: int | None = 1,
+    compact: bool = False,
+) -> None:
+    """
+    Convert a dump file to a binary points container, to be memory-mapped later
+
+    Parameters
+    ----------
+    filename : str
+        The name of the dump file
+    out_filename : str
+        The name of the container, e.g. out/box.pts
+    workers : int | None
+        The number of worker processes used to parse the dump
+    compact : bool
+        Whether to store float32 coordinates and small integer types
+    """
+    points, ids, header = read_dump(filename, workers, compact=compact)
+    metadata: dict = {"source": os.path.basename(filename), "bounds": header["bounds"]}
+    save_points(points, out_filename, header["box_len"], metadata)
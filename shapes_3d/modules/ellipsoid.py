@@ -1,4 +1,10 @@
 import numpy as np
+from .buffer import PointBuffer
+from .profiling import count
+from .rotations import rotate, rotation_matrices, to_body
+
+# The bisection steps of the nearest point on an ellipsoid, enough for double precision
+ELLIPSOID_BISECTIONS: int = 64
 
 
 class Ellipsoid:
@@ -21,6 +27,12 @@ class Ellipsoid:
         The z axis outer radius
     z_inner_radius : float | None
         The z axis inner radius
+    center : np.ndarray | None
+        The center of the ellipsoid, for contains and signed_distance. None for the
+        origin
+    orientation : np.ndarray | None
+        The (w, x, y, z) quaternion that rotates the axes of the ellipsoid. None
+        keeps them along x, y and z
     """
 
     def __init__(
@@ -32,6 +44,8 @@ class Ellipsoid:
         x_inner_radius: float | None = None,
         y_inner_radius: float | None = None,
         z_inner_radius: float | None = None,
+        center: np.ndarray | None = None,
+        orientation: np.ndarray | None = None,
     ):
         """
         Initalizes an ellipsoid
@@ -52,6 +66,12 @@ class Ellipsoid:
             The z axis outer radius
         z_inner_radius : float | None
             The z axis inner radius
+        center : np.ndarray | None
+            The center of the ellipsoid, for contains and signed_distance. None for
+            the origin
+        orientation : np.ndarray | None
+            The (w, x, y, z) quaternion that rotates the axes of the ellipsoid. None
+            keeps them along x, y and z
         """
         self.density: float = density
         assert x_outer_radius >= 0
@@ -61,11 +81,117 @@ class Ellipsoid:
         self.y_inner_radius: float | None = y_inner_radius
         self.z_outer_radius: float | None = z_outer_radius
         self.z_inner_radius: float | None = z_inner_radius
+        self.center: np.ndarray | None = center
+        self.orientation: np.ndarray | None = orientation
+
+    def expected_count(self) -> float:
+        """
+        The expected number of points, density times the shell volume
+
+        Returns
+        -------
+        float
+            The expected number of points
+        """
+        x_outer: float = self.x_outer_radius
+        y_outer: float = self.y_outer_radius or x_outer
+        z_outer: float = self.z_outer_radius or x_outer
+        x_inner: float = self.x_inner_radius or 0
+        y_inner: float = self.y_inner_radius or x_inner
+        z_inner: float = self.z_inner_radius or x_inner
+        volume: float = (
+            (4 / 3)
+            * np.pi
+            * (x_outer * y_outer * z_outer - x_inner * y_inner * z_inner)
+        )
+        return self.density * volume
+
+    def axes(self) -> tuple[np.ndarray, np.ndarray | None]:
+        """
+        The outer and inner semi-axes, with the defaults of the missing radii
+
+        Returns
+        -------
+        tuple[np.ndarray, np.ndarray | None]
+            The x, y and z outer semi-axes, and the inner ones if the ellipsoid is
+            hollow
+        """
+        x_outer: float = self.x_outer_radius
+        outer: np.ndarray = np.array(
+            [x_outer, self.y_outer_radius or x_outer, self.z_outer_radius or x_outer]
+        )
+        x_inner: float | None = self.x_inner_radius
+        if not x_inner:
+            return outer, None
+        return outer, np.array(
+            [x_inner, self.y_inner_radius or x_inner, self.z_inner_radius or x_inner]
+        )
+
+    def body(self, points: np.ndarray) -> np.ndarray:
+        """The points in the frame of the ellipsoid, see to_body"""
+        rotation: np.ndarray | None = (
+            None if self.orientation is None else rotation_matrices(self.orientation)[0]
+        )
+        return to_body(points, self.center, rotation)
 
-    def make_obj(self) -> np.ndarray:
+    def contains(self, points: np.ndarray) -> np.ndarray:
+        """
+        Whether points lie in the ellipsoid (outside its hollow, if any)
+
+        The same test make_obj keeps its points with.
+
+        Parameters
+        ----------
+        points : np.ndarray
+            The points in world coordinates, with shape (n, 3)
+
+        Returns
+        -------
+        np.ndarray
+            Whether each point is inside, with shape (n,)
+        """
+        outer, inner = self.axes()
+        body: np.ndarray = self.body(points)
+        inside: np.ndarray = np.sum((body / outer) ** 2, axis=1) <= 1
+        if inner is not None:
+            inside &= np.sum((body / inner) ** 2, axis=1) >= 1
+        return inside
+
+    def signed_distance(self, points: np.ndarray) -> np.ndarray:
+        """
+        The distance of points to the surface, negative inside the ellipsoid
+
+        Parameters
+        ----------
+        points : np.ndarray
+            The points in world coordinates, with shape (n, 3)
+
+        Returns
+        -------
+        np.ndarray
+            The signed distance of each point, with shape (n,)
+        """
+        outer, inner = self.axes()
+        body: np.ndarray = self.body(points)
+        distance: np.ndarray = ellipsoid_distance(body, outer)
+        if inner is None:
+            return distance
+        # inside the hollow, the nearest surface is the inner one
+        return np.maximum(distance, -ellipsoid_distance(body, inner))
+
+    def make_obj(
+        self, dtype: np.dtype = np.float64, rng: np.random.Generator | None = None
+    ) -> np.ndarray:
         """
         Makes the ellipsoid object
 
+        Parameters
+        ----------
+        dtype : np.dtype
+            The dtype of the returned coordinates, e.g. np.float32 for compact output
+        rng : np.random.Generator | None
+            The random generator to sample with. Defaults to the global np.random state
+
         Returns
         -------
         np.ndarray
@@ -82,17 +208,334 @@ class Ellipsoid:
         volume_box = (2 * max_radius) ** 3
         num_points: int = int(self.density * volume_box)
 
-        points: np.ndarray = np.random.uniform(
+        random = np.random if rng is None else rng
+        points: np.ndarray = random.uniform(
             low=-max_radius, high=max_radius, size=(num_points, 3)
-        )
+        ).astype(dtype, copy=False)
 
-        norm_pts: np.ndarray = points / np.array([x_outer, y_outer, z_outer])
+        norm_pts: np.ndarray = points / np.array([x_outer, y_outer, z_outer], dtype)
 
         if x_inner == 0:
-            norm_i = np.ones(shape=points.shape)
+            norm_i = np.ones(shape=points.shape, dtype=dtype)
         else:
-            norm_i = points / np.array([x_inner, y_inner, z_inner])
+            norm_i = points / np.array([x_inner, y_inner, z_inner], dtype)
         distance_outer: float = np.sum(norm_pts**2, axis=1)
         distance_inner: float = np.sum(norm_i**2, axis=1)
         inside = (distance_outer <= 1) & (distance_inner >= 1)
-        return points[inside]
+        result: np.ndarray = points[inside]
+        count("ellipsoid.candidates", num_points)
+        count("ellipsoid.accepted", result.shape[0])
+        if self.orientation is not None:
+            result = rotate(result, rotation_matrices(self.orientation)[0])
+        return result
+
+
+def ellipsoid_distance(points: np.ndarray, axes: np.ndarray) -> np.ndarray:
+    """
+    The signed distance of points to an ellipsoid centered on the origin
+
+    The nearest point of the surface to y is a_i^2 y_i / (t + a_i^2) along each
+    axis, where t is the root of sum_i (a_i y_i / (t + a_i^2))^2 = 1 above -min
+    a_i^2. The sum decreases with t, so the root is bisected for every point at once.
+
+    Parameters
+    ----------
+    points : np.ndarray
+        The points in the frame of the ellipsoid, with shape (n, 3)
+    axes : np.ndarray
+        The x, y and z semi-axes
+
+    Returns
+    -------
+    np.ndarray
+        The distance of each point to the surface, negative inside
+    """
+    axes = np.asarray(axes, dtype=float)
+    squared: np.ndarray = axes**2
+    absolute: np.ndarray = np.abs(np.asarray(points, dtype=float))
+    # a point on an axis can have a whole ring of nearest points, and the root is then
+    # below -min a_i^2; moving it off the axis by a billionth of the largest axis picks
+    # one of them
+    y: np.ndarray = np.maximum(absolute, 1e-9 * np.max(axes))
+    low: np.ndarray = np.full(y.shape[0], -np.min(squared))
+    high: np.ndarray = np.max(axes) * np.linalg.norm(y, axis=1)
+    for _ in range(ELLIPSOID_BISECTIONS):
+        middle: np.ndarray = (low + high) / 2
+        above: np.ndarray = (
+            np.sum((axes * y / (middle[:, None] + squared)) ** 2, axis=1) > 1
+        )
+        low = np.where(above, middle, low)
+        high = np.where(above, high, middle)
+    t: np.ndarray = (low + high) / 2
+    nearest: np.ndarray = squared * y / (t[:, None] + squared)
+    distance: np.ndarray = np.linalg.norm(nearest - y, axis=1)
+    inside: np.ndarray = np.sum((absolute / axes) ** 2, axis=1) <= 1
+    return np.where(inside, -distance, distance)
+
+
+class EllipsoidPopulation:
+    """
+    A population of uniform ellipsoids, sampled together in vectorized chunks
+
+    Attributes
+    ----------
+    density : float
+        The uniform density of every ellipsoid
+    outer_axes : np.ndarray
+        The outer radii of each ellipsoid, with shape (N, 3)
+    centers : np.ndarray
+        The center of each ellipsoid, with shape (N, 3)
+    inner_axes : np.ndarray | None
+        The inner radii of each ellipsoid, with shape (N, 3). Rows of zeros are solid
+    types : np.ndarray
+        The type id of each ellipsoid, with shape (N,)
+    particle_offset : int
+        The id given to the first ellipsoid
+    chunk_size : int
+        The maximum number of candidate points drawn at once
+    rotations : np.ndarray | None
+        The rotation matrix of each ellipsoid, with shape (N, 3, 3). None keeps every
+        ellipsoid along the axes
+    """
+
+    def __init__(
+        self,
+        density: float,
+        outer_axes: np.ndarray,
+        centers: np.ndarray,
+        inner_axes: np.ndarray | None = None,
+        types: int | np.ndarray = 1,
+        particle_offset: int = 0,
+        chunk_size: int = 2**22,
+        orientations: np.ndarray | None = None,
+    ):
+        """
+        Initializes the population
+
+        Parameters
+        ----------
+        density : float
+            The uniform density of every ellipsoid
+        outer_axes : np.ndarray
+            The outer radii of each ellipsoid, with shape (N, 3), or (N,) for spheres
+        centers : np.ndarray
+            The center of each ellipsoid, with shape (N, 3)
+        inner_axes : np.ndarray | None
+            The inner radii of each ellipsoid, with shape (N, 3), or (N,) for spheres
+        types : int | np.ndarray
+            The type id of each ellipsoid, or one type id for all of them
+        particle_offset : int
+            The id given to the first ellipsoid
+        chunk_size : int
+            The maximum number of candidate points drawn at once
+        orientations : np.ndarray | None
+            The (w, x, y, z) quaternion of each ellipsoid, with shape (N, 4). None
+            keeps every ellipsoid along the axes
+        """
+        self.density: float = density
+        self.outer_axes: np.ndarray = _as_axes(outer_axes)
+        self.centers: np.ndarray = np.asarray(centers, dtype=float).reshape(-1, 3)
+        self.inner_axes: np.ndarray | None = (
+            None if inner_axes is None else _as_axes(inner_axes)
+        )
+        num_particles: int = self.outer_axes.shape[0]
+        assert self.centers.shape[0] == num_particles
+        assert np.all(self.outer_axes >= 0)
+        self.types: np.ndarray = np.broadcast_to(
+            np.asarray(types, dtype=float), (num_particles,)
+        )
+        self.particle_offset: int = particle_offset
+        self.chunk_size: int = chunk_size
+        self.rotations: np.ndarray | None = (
+            None if orientations is None else rotation_matrices(orientations)
+        )
+        if self.rotations is not None:
+            assert self.rotations.shape[0] == num_particles
+
+    def candidate_counts(self) -> np.ndarray:
+        """
+        The number of uniform points drawn in each ellipsoid's bounding box
+
+        Returns
+        -------
+        np.ndarray
+            The number of candidates for each ellipsoid
+        """
+        box_volume: np.ndarray = np.prod(2 * self.outer_axes, axis=1)
+        return (self.density * box_volume).astype(np.int64)
+
+    def chunks(self) -> list[np.ndarray]:
+        """
+        Split the ellipsoids into consecutive groups of at most chunk_size candidates
+
+        Returns
+        -------
+        list[np.ndarray]
+            The indices of the ellipsoids in each group
+        """
+        counts: np.ndarray = self.candidate_counts()
+        if counts.shape[0] == 0:
+            return []
+        boundaries: np.ndarray = np.cumsum(counts) // max(self.chunk_size, 1)
+        splits: np.ndarray = np.flatnonzero(np.diff(boundaries)) + 1
+        return np.split(np.arange(counts.shape[0]), splits)
+
+    def expected_count(self) -> float:
+        """
+        The expected number of points, density times the total shell volume
+
+        Returns
+        -------
+        float
+            The expected number of points
+        """
+        volume: np.ndarray = np.prod(self.outer_axes, axis=1)
+        if self.inner_axes is not None:
+            volume = volume - np.prod(self.inner_axes, axis=1)
+        return self.density * (4 / 3) * np.pi * float(np.sum(volume))
+
+    def sample_chunk(
+        self,
+        indices: np.ndarray,
+        dtype: np.dtype = np.float64,
+        rng: np.random.Generator | None = None,
+        rngs: list[np.random.Generator] | None = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Sample a group of ellipsoids at once
+
+        Parameters
+        ----------
+        indices : np.ndarray
+            The ellipsoids to sample
+        dtype : np.dtype
+            The dtype of the returned coordinates
+        rng : np.random.Generator | None
+            The random generator to sample with. Defaults to the global np.random state
+        rngs : list[np.random.Generator] | None
+            One generator per ellipsoid of indices, used instead of rng, so the
+            points of each ellipsoid only depend on its own generator
+
+        Returns
+        -------
+        tuple[np.ndarray, np.ndarray]
+            The (x, y, z) points and the index of the ellipsoid each belongs to
+        """
+        counts: np.ndarray = self.candidate_counts()[indices]
+        owner: np.ndarray = np.repeat(indices, counts)
+        if rngs is None:
+            random = np.random if rng is None else rng
+            drawn: np.ndarray = random.uniform(-1, 1, size=(owner.shape[0], 3))
+        else:
+            assert len(rngs) == len(indices), "expected one generator per ellipsoid"
+            drawn = np.concatenate(
+                [np.zeros((0, 3))]
+                + [g.uniform(-1, 1, size=(c, 3)) for g, c in zip(rngs, counts)]
+            )
+        unit_points: np.ndarray = drawn.astype(dtype, copy=False)
+        inside = np.sum(unit_points**2, axis=1) <= 1
+        points: np.ndarray = unit_points * self.outer_axes[owner].astype(dtype)
+
+        if self.inner_axes is not None:
+            inner: np.ndarray = self.inner_axes[owner].astype(dtype)
+            has_core = np.all(inner > 0, axis=1)
+            safe_inner: np.ndarray = np.where(inner > 0, inner, 1)
+            distance_inner: np.ndarray = np.sum((points / safe_inner) ** 2, axis=1)
+            inside &= ~has_core | (distance_inner >= 1)
+
+        count("ellipsoid.candidates", owner.shape[0])
+        owner = owner[inside]
+        points = points[inside]
+        count("ellipsoid.accepted", owner.shape[0])
+        if self.rotations is not None:
+            # one batched product for the whole chunk, not one per ellipsoid
+            points = rotate(points, self.rotations.astype(dtype), owner)
+        points += self.centers[owner].astype(dtype)
+        return points, owner
+
+    def make_chunk(
+        self, indices: np.ndarray, rng: np.random.Generator | None = None
+    ) -> np.ndarray:
+        """
+        Sample a group of ellipsoids at once
+
+        Parameters
+        ----------
+        indices : np.ndarray
+            The ellipsoids to sample
+        rng : np.random.Generator | None
+            The random generator to sample with. Defaults to the global np.random state
+
+        Returns
+        -------
+        np.ndarray
+            The points, with shape (M, 5) and columns (x, y, z, type, particle id)
+        """
+        points, owner = self.sample_chunk(indices, rng=rng)
+        return np.column_stack(
+            (points, self.types[owner], owner + self.particle_offset)
+        )
+
+    def make_obj(self, rng: np.random.Generator | None = None) -> np.ndarray:
+        """
+        Makes every ellipsoid in the population
+
+        Parameters
+        ----------
+        rng : np.random.Generator | None
+            The random generator to sample with. Defaults to the global np.random state
+
+        Returns
+        -------
+        np.ndarray
+            The points, with shape (M, 5) and columns (x, y, z, type, particle id)
+        """
+        chunks: list[np.ndarray] = [self.make_chunk(idx, rng) for idx in self.chunks()]
+        if not chunks:
+            return np.zeros((0, 5))
+        return np.concatenate(chunks)
+
+    def write(
+        self, buffer: PointBuffer, rng: np.random.Generator | None = None
+    ) -> None:
+        """
+        Makes every ellipsoid in the population, writing the points into a buffer
+
+        Parameters
+        ----------
+        buffer : PointBuffer
+            The buffer to append the points, types and particle ids to
+        rng : np.random.Generator | None
+            The random generator to sample with. Defaults to the global np.random state
+        """
+        for indices in self.chunks():
+            self.write_chunk(buffer, indices, rng)
+
+    def write_chunk(
+        self,
+        buffer: PointBuffer,
+        indices: np.ndarray,
+        rng: np.random.Generator | None = None,
+    ) -> None:
+        """
+        Sample a group of ellipsoids at once, writing the points into a buffer
+
+        Parameters
+        ----------
+        buffer : PointBuffer
+            The buffer to append the points, types and particle ids to
+        indices : np.ndarray
+            The ellipsoids to sample
+        rng : np.random.Generator | None
+            The random generator to sample with. Defaults to the global np.random state
+        """
+        points, owner = self.sample_chunk(indices, buffer.coord_dtype, rng)
+        buffer.append(points, self.types[owner], owner + self.particle_offset)
+
+
+def _as_axes(axes: np.ndarray) -> np.ndarray:
+    """Broadcast radii of shape (N,) or (N, 3) to shape (N, 3)"""
+    axes = np.asarray(axes, dtype=float)
+    if axes.ndim == 1:
+        return np.repeat(axes[:, None], 3, axis=1)
+    return axes
@@ -0,0 +1,371 @@
+from pathlib import Path
+import json
+import os
+import tempfile
+import time
+import numpy as np
+from .buffer import PointBuffer, column_dtypes, estimate_capacity
+from .parallel import PARALLEL_CHUNK
+
+# The rates of the stages on one core, used until calibrate() measures this machine
+THROUGHPUT: dict[str, float] = {
+    "points_per_s": 1.5e6,  # accepted points sampled per second
+    "dump_bytes_per_s": 4.5e7,  # text dump written per second
+    "gzip_bytes_per_s": 1.1e7,  # text dump gzip-compressed and written per second
+    "binary_bytes_per_s": 1.7e8,  # .pts container written per second
+    "center_checks_per_s": 7.0e5,  # distance checks of make_centers per second
+}
+# Where calibrate() saves the measured rates
+THROUGHPUT_FILE: Path = Path.home() / ".cache" / "shapes_3d" / "throughput.json"
+# The memory of the interpreter and the imported modules, in bytes
+BASE_MEMORY: int = 64 * 2**20
+# The size of a compressed text dump relative to the plain one
+COMPRESSION_RATIOS: dict[str, float] = {"gzip": 0.44, "zstd": 0.47}
+
+
+def load_throughput(filename: str | Path = THROUGHPUT_FILE) -> dict[str, float]:
+    """
+    The stage rates of this machine, if calibrated, else the defaults
+
+    Parameters
+    ----------
+    filename : str | Path
+        The file calibrate() saved the rates to
+
+    Returns
+    -------
+    dict[str, float]
+        The rates, see THROUGHPUT
+    """
+    try:
+        with open(filename) as f:
+            return THROUGHPUT | json.load(f)
+    except FileNotFoundError:
+        return dict(THROUGHPUT)
+
+
+def calibrate(
+    filename: str | Path = THROUGHPUT_FILE, num_points: int = 10**6
+) -> dict[str, float]:
+    """
+    Measure the stage rates of this machine and save them for the estimates
+
+    Parameters
+    ----------
+    filename : str | Path
+        The file to save the rates to
+    num_points : int
+        The number of points to sample and write
+
+    Returns
+    -------
+    dict[str, float]
+        The measured rates, see THROUGHPUT
+    """
+    from .binary import save_points
+    from .ellipsoid import Ellipsoid
+    from .utils import save_dump
+
+    rng: np.random.Generator = np.random.default_rng(0)
+    radius: float = 100.0
+    density: float = num_points / ((4 / 3) * np.pi * radius**3)
+    start: float = time.perf_counter()
+    sampled: int = len(Ellipsoid(density, radius).make_obj(rng=rng))
+    rates: dict[str, float] = {"points_per_s": sampled / (time.perf_counter() - start)}
+
+    buffer: PointBuffer = PointBuffer(num_points)
+    buffer.append(
+        rng.uniform(-500, 500, (num_points, 3)), types=rng.integers(1, 6, num_points)
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        plain: int = 0
+        for key, name in (
+            ("dump_bytes_per_s", "calibrate.dump"),
+            ("gzip_bytes_per_s", "calibrate.dump.gz"),
+        ):
+            path: str = os.path.join(directory, name)
+            start = time.perf_counter()
+            save_dump(buffer, path, 1000.0)
+            # both rates are of the uncompressed text, which is what the estimates know
+            plain = plain or os.path.getsize(path)
+            rates[key] = plain / (time.perf_counter() - start)
+        path = os.path.join(directory, "calibrate.pts")
+        start = time.perf_counter()
+        save_points(buffer, path, 1000.0)
+        rates["binary_bytes_per_s"] = os.path.getsize(path) / (
+            time.perf_counter() - start
+        )
+
+    # make_centers checks a candidate against every row with np.linalg.norm
+    rows: np.ndarray = rng.uniform(-500, 500, (20000, 3))
+    candidate: np.ndarray = rows[0]
+    start = time.perf_counter()
+    for row in rows:
+        np.linalg.norm(candidate - row)
+    rates["center_checks_per_s"] = rows.shape[0] / (time.perf_counter() - start)
+
+    Path(filename).parent.mkdir(parents=True, exist_ok=True)
+    with open(filename, "w") as f:
+        json.dump(rates, f, indent=2)
+    print("saved the rates to", filename)
+    return rates
+
+
+def mean_digits(maximum: float) -> float:
+    """
+    The mean number of integer digits of numbers uniform in [0, maximum)
+
+    Parameters
+    ----------
+    maximum : float
+        The upper bound, e.g. half the box length
+
+    Returns
+    -------
+    float
+        The mean number of digits, at least 1
+    """
+    digits: float = 1.0
+    power: float = 10.0
+    while power < maximum:
+        digits += (maximum - power) / maximum
+        power *= 10
+    return digits
+
+
+def dump_line_bytes(num_points: float, box_length: float, max_type: int) -> float:
+    """
+    The mean length of a line "id type x y z" of a text dump
+
+    The coordinates are taken as uniform in the box, written with six decimals.
+
+    Parameters
+    ----------
+    num_points : float
+        The number of points, which sets the width of the ids
+    box_length : float
+        The length of the box
+    max_type : int
+        The largest type id
+
+    Returns
+    -------
+    float
+        The mean number of bytes of a line
+    """
+    coordinate: float = mean_digits(box_length / 2) + 7 + 0.5  # ".dddddd" and a sign
+    return (
+        mean_digits(num_points + 1)
+        + len(str(max_type))
+        + 3 * coordinate
+        + 5  # four spaces and the newline
+    )
+
+
+def type_counts(counts: np.ndarray) -> dict[int, float]:
+    """
+    Sum the expected points of every particle by type
+
+    Parameters
+    ----------
+    counts : np.ndarray
+        The expected points of each type of each particle, with shape (N, T). The
+        column t holds the type t + 1
+
+    Returns
+    -------
+    dict[int, float]
+        The expected points of each type
+    """
+    return {t + 1: float(total) for t, total in enumerate(np.sum(counts, axis=0))}
+
+
+def estimate_build(
+    points_by_type: dict[int, float],
+    num_particles: int,
+    box_length: float,
+    config: dict,
+    extra_bytes_per_point: int = 0,
+    text_files: int = 1,
+    throughput: dict[str, float] | None = None,
+) -> dict:
+    """
+    Predict the memory, output size and runtime of a box from its expected points
+
+    Parameters
+    ----------
+    points_by_type : dict[int, float]
+        The expected number of points of each type
+    num_particles : int
+        The number of particles, whose centers are placed by make_centers
+    box_length : float
+        The length of the box
+    config : dict
+        The parameters of the builder, with its OUTPUT_CONFIG options
+    extra_bytes_per_point : int
+        Memory a builder needs per point on top of the buffer, e.g. a row copy
+    text_files : int
+        The number of text files every point is written to
+    throughput : dict[str, float] | None
+        The stage rates. Defaults to load_throughput()
+
+    Returns
+    -------
+    dict
+        The expected points (total and by type), the peak memory in bytes of each
+        output mode, the predicted peak of the configured mode, the output size in
+        bytes and the runtime of each stage in seconds. The center placement time is
+        a lower bound, it grows with the number of rejected attempts
+    """
+    rates: dict[str, float] = throughput or load_throughput()
+    num_points: float = float(sum(points_by_type.values()))
+    max_type: int = max(points_by_type, default=1)
+    workers: int = config["workers"] or os.cpu_count() or 1
+
+    def point_bytes(compact: bool) -> int:
+        return sum(
+            dtype.itemsize * width
+            for dtype, width in zip(column_dtypes(compact, max_type), (3, 1, 1))
+        )
+
+    in_memory: dict[str, float] = {
+        "in_memory": BASE_MEMORY
+        + estimate_capacity(num_points) * point_bytes(False)
+        + num_points * extra_bytes_per_point,
+        "in_memory_compact": BASE_MEMORY
+        + estimate_capacity(num_points) * point_bytes(True)
+        + num_points * extra_bytes_per_point,
+        # a batch being filled and one being written
+        "stream": BASE_MEMORY + 2 * config["batch_size"] * point_bytes(False),
+        "stream_compact": BASE_MEMORY + 2 * config["batch_size"] * point_bytes(True),
+    }
+    if workers != 1:
+        # the chunks the workers generate ahead, and the workers themselves
+        parallel: float = workers * (
+            BASE_MEMORY + 3 * PARALLEL_CHUNK * point_bytes(config["compact"])
+        )
+        in_memory = {mode: memory + parallel for mode, memory in in_memory.items()}
+    if config["voxels"]:
+        # a float32 grid per type, and its stacked copy while it is saved
+        voxel_bytes: float = 4.0 * len(points_by_type) * config["voxels"] ** 3
+        in_memory["voxels"] = BASE_MEMORY + 2 * voxel_bytes
+        if not config["rasterize"]:
+            in_memory["voxels"] += 2 * config["batch_size"] * point_bytes(False)
+    mode: str = output_mode(config)
+
+    line: float = dump_line_bytes(num_points, box_length, max_type)
+    if config["voxels"]:
+        file_bytes: float = voxel_bytes
+        write_s: float = file_bytes / rates["binary_bytes_per_s"]
+    elif config["binary"]:
+        file_bytes = num_points * point_bytes(config["compact"])
+        write_s = file_bytes / rates["binary_bytes_per_s"]
+    else:
+        plain: float = text_files * num_points * line
+        file_bytes = plain * COMPRESSION_RATIOS.get(config["compression"], 1.0)
+        rate: str = "gzip_bytes_per_s" if config["compression"] else "dump_bytes_per_s"
+        write_s = plain / rates[rate]
+    runtime: dict[str, float] = {
+        "sampling": (
+            0.0
+            if config["voxels"] and config["rasterize"]
+            else num_points / rates["points_per_s"] / workers
+        ),
+        "centers_at_least": num_particles**2 / rates["center_checks_per_s"],
+        "writing": write_s,
+    }
+    runtime["total"] = sum(runtime.values())
+    return {
+        "num_particles": num_particles,
+        "num_points": num_points,
+        "points_by_type": points_by_type,
+        "memory_bytes": in_memory,
+        "mode": mode,
+        "peak_memory_bytes": in_memory[mode],
+        "file_bytes": file_bytes,
+        "runtime_s": runtime,
+    }
+
+
+def output_mode(config: dict) -> str:
+    """The key of memory_bytes that a config writes its points with"""
+    if config["voxels"]:
+        return "voxels"
+    mode: str = "stream" if config["stream"] or config["binary"] else "in_memory"
+    return mode + "_compact" if config["compact"] else mode
+
+
+def plan_output(config: dict, estimate: dict) -> dict:
+    """
+    Switch to compact or streamed output when a build would exceed its memory budget
+
+    Compact columns are tried first, since they keep the output in one step, then
+    streaming, then both.
+
+    Parameters
+    ----------
+    config : dict
+        The parameters of the builder, with memory_budget in bytes (or None)
+    estimate : dict
+        What estimate_build predicted for the config
+
+    Returns
+    -------
+    dict
+        The config, with compact and stream set to fit the budget if they can
+    """
+    budget: float | None = config["memory_budget"]
+    # a grid takes the same memory whatever the points are written with
+    if budget is None or config["voxels"] or estimate["peak_memory_bytes"] <= budget:
+        return config
+    for change in (
+        {"compact": True},
+        {"stream": True},
+        {"compact": True, "stream": True},
+    ):
+        planned: dict = config | change
+        if estimate["memory_bytes"][output_mode(planned)] <= budget:
+            print(
+                f"{estimate['peak_memory_bytes'] / 2**30:.2f} GiB is over the memory"
+                f" budget, writing with {change}"
+            )
+            return planned
+    print("no output mode fits the memory budget, streaming compact points")
+    return config | {"compact": True, "stream": True}
+
+
+def dry_run(estimate: dict) -> dict:
+    """
+    Report an estimate instead of building
+
+    Parameters
+    ----------
+    estimate : dict
+        What estimate_build predicted
+
+    Returns
+    -------
+    dict
+        The result of the builder, with the estimate and no files
+    """
+    runtime: dict[str, float] = estimate["runtime_s"]
+    print(f"particles: {estimate['num_particles']}")
+    print(f"points: {estimate['num_points']:.4g}")
+    for t, points in estimate["points_by_type"].items():
+        print(f"  type {t}: {points:.4g}")
+    print(
+        f"peak memory ({estimate['mode']}):"
+        f" {estimate['peak_memory_bytes'] / 2**30:.2f} GiB"
+    )
+    print(f"output: {estimate['file_bytes'] / 2**30:.2f} GiB")
+    print(
+        f"runtime: {runtime['total']:.1f} s (sampling {runtime['sampling']:.1f} s,"
+        f" centers at least {runtime['centers_at_least']:.1f} s,"
+        f" writing {runtime['writing']:.1f} s)"
+    )
+    return {
+        "num_particles": estimate["num_particles"],
+        "num_points": int(round(estimate["num_points"])),
+        "files": [],
+        "estimate": estimate,
+    }
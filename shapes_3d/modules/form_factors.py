@@ -0,0 +1,535 @@
+import numpy as np
+from .buffer import PointBuffer
+from .cylinder import Cylinder
+from .ellipsoid import Ellipsoid
+from .onion import Onion
+from .population import ParticleTable
+from .rotations import rotation_matrices
+from .scattering import PairHistogram, contrast_weights
+
+# scipy is imported where a cylinder needs its Bessel function, so that importing the
+# form factors stays fast
+
+# The Gauss-Legendre nodes in the cosine of the polar angle, and the azimuths, of the
+# orientation averages
+ORIENTATION_NODES: tuple[int, int] = (32, 32)
+# The most entries of one (particles, orientations or particles, q) block
+FORM_FACTOR_BLOCK: int = 2**24
+# The kinds of particles of a table that have a form factor
+FORM_FACTOR_KINDS: tuple[str, ...] = ("ellipsoid", "core_shell", "onion")
+
+
+def sphere_amplitude(x: np.ndarray) -> np.ndarray:
+    """
+    The amplitude of a uniform ball of volume 1, 3 (sin x - x cos x) / x^3
+
+    Parameters
+    ----------
+    x : np.ndarray
+        q times the radius
+
+    Returns
+    -------
+    np.ndarray
+        The amplitude, 1 at x = 0
+    """
+    x = np.asarray(x, dtype=float)
+    amplitude: np.ndarray = 1 - x**2 / 10
+    # the series is exact to double precision below 1e-3, where the formula cancels
+    large: np.ndarray = np.abs(x) >= 1e-3
+    xl: np.ndarray = x[large]
+    amplitude[large] = 3 * (np.sin(xl) - xl * np.cos(xl)) / xl**3
+    return amplitude
+
+
+def orientation_nodes(
+    num_polar: int = ORIENTATION_NODES[0], num_azimuthal: int = ORIENTATION_NODES[1]
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Directions of a hemisphere and their weights, to average over orientations
+
+    The particles are centrosymmetric, so the directions q and -q scatter alike and
+    a hemisphere covers every orientation.
+
+    Parameters
+    ----------
+    num_polar : int
+        The number of Gauss-Legendre nodes in the cosine of the polar angle
+    num_azimuthal : int
+        The number of equally spaced azimuths
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        The unit directions, with shape (M, 3), and their weights, which sum to 1
+    """
+    cosine, polar_weights = np.polynomial.legendre.leggauss(num_polar)
+    cosine, polar_weights = (cosine + 1) / 2, polar_weights / 2
+    azimuth: np.ndarray = (np.arange(num_azimuthal) + 0.5) * 2 * np.pi / num_azimuthal
+    sine: np.ndarray = np.sqrt(1 - cosine**2)
+    directions: np.ndarray = np.stack(
+        np.broadcast_arrays(
+            sine[:, None] * np.cos(azimuth),
+            sine[:, None] * np.sin(azimuth),
+            cosine[:, None],
+        ),
+        axis=-1,
+    ).reshape(-1, 3)
+    weights: np.ndarray = np.repeat(polar_weights / num_azimuthal, num_azimuthal)
+    return directions, weights
+
+
+def shell_amplitudes(
+    q: np.ndarray, thickness: np.ndarray, contrast: np.ndarray
+) -> np.ndarray:
+    """
+    The amplitudes of concentric spherical shells, e.g. onions or core-shell spheres
+
+    Every shell is the ball of its outer radius less the ball inside it.
+
+    Parameters
+    ----------
+    q : np.ndarray
+        The magnitudes of the scattering vector, with shape (Q,)
+    thickness : np.ndarray
+        The thickness of each shell of each particle, from the inside out, with
+        shape (N, K)
+    contrast : np.ndarray
+        The scattering length density of each shell less the solvent's, with
+        shape (K,)
+
+    Returns
+    -------
+    np.ndarray
+        The amplitude of each particle at each q, with shape (N, Q)
+    """
+    outer: np.ndarray = np.cumsum(thickness, axis=1)[:, :, None]
+    balls: np.ndarray = (4 / 3) * np.pi * outer**3 * sphere_amplitude(outer * q)
+    shells: np.ndarray = np.diff(balls, axis=1, prepend=0)
+    return np.einsum("k,nkq->nq", np.asarray(contrast, dtype=float), shells)
+
+
+def _average(
+    amplitude: np.ndarray, weights: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """The mean amplitude and mean squared amplitude over the orientations"""
+    return (
+        np.einsum("m,nmq->nq", weights, amplitude),
+        np.einsum("m,nmq->nq", weights, amplitude**2),
+    )
+
+
+def _body_directions(
+    directions: np.ndarray, orientations: np.ndarray | None, num: int
+) -> np.ndarray:
+    """The directions in the frame of each particle, with shape (N, M, 3)"""
+    if orientations is None:
+        return np.broadcast_to(directions, (num,) + directions.shape)
+    # a particle rotated by R sees the direction n as R^T n
+    return np.einsum("nji,mj->nmi", rotation_matrices(orientations), directions)
+
+
+def ellipsoid_amplitudes(
+    q: np.ndarray,
+    axes: np.ndarray,
+    contrast: float,
+    orientations: np.ndarray | None = None,
+    nodes: tuple[int, int] = ORIENTATION_NODES,
+    inner_axes: np.ndarray | None = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    The amplitudes of uniform (hollow) ellipsoids, averaged over orientations
+
+    Along the direction n, an ellipsoid scatters like a ball of the radius
+    sqrt((a n_x)^2 + (b n_y)^2 + (c n_z)^2) and of the ellipsoid's volume.
+
+    Parameters
+    ----------
+    q : np.ndarray
+        The magnitudes of the scattering vector, with shape (Q,)
+    axes : np.ndarray
+        The x, y and z semi-axes of each ellipsoid, with shape (N, 3)
+    contrast : float
+        The scattering length density less the solvent's
+    orientations : np.ndarray | None
+        The (w, x, y, z) quaternion of each ellipsoid. None keeps the axes along x,
+        y and z
+    nodes : tuple[int, int]
+        The polar and azimuthal nodes of the orientation average
+    inner_axes : np.ndarray | None
+        The semi-axes of the hollow of each ellipsoid, if any
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        The mean amplitude and the mean squared amplitude of each ellipsoid at each
+        q, each with shape (N, Q)
+    """
+    directions, weights = orientation_nodes(*nodes)
+    q = np.asarray(q, dtype=float)
+    axes = np.asarray(axes, dtype=float).reshape(-1, 3)
+    mean: np.ndarray = np.zeros((axes.shape[0], q.shape[0]))
+    mean_square: np.ndarray = np.zeros_like(mean)
+    rows: int = max(1, FORM_FACTOR_BLOCK // (weights.shape[0] * max(q.shape[0], 1)))
+    for start in range(0, axes.shape[0], rows):
+        chunk: slice = slice(start, start + rows)
+        body: np.ndarray = _body_directions(
+            directions,
+            None if orientations is None else orientations[chunk],
+            axes[chunk].shape[0],
+        )
+        amplitude: np.ndarray = np.zeros(body.shape[:2] + q.shape)
+        for sign, semi_axes in ((1, axes), (-1, inner_axes)):
+            if semi_axes is None:
+                continue
+            semi_axes = np.asarray(semi_axes, dtype=float).reshape(-1, 3)[chunk]
+            radius: np.ndarray = np.sqrt(
+                np.sum((semi_axes[:, None, :] * body) ** 2, axis=2)
+            )
+            volume: np.ndarray = (4 / 3) * np.pi * np.prod(semi_axes, axis=1)
+            amplitude += (
+                sign * volume[:, None, None] * sphere_amplitude(radius[:, :, None] * q)
+            )
+        mean[chunk], mean_square[chunk] = _average(contrast * amplitude, weights)
+    return mean, mean_square
+
+
+def cylinder_amplitudes(
+    q: np.ndarray,
+    radius: np.ndarray,
+    length: np.ndarray,
+    contrast: float,
+    orientations: np.ndarray | None = None,
+    nodes: tuple[int, int] = ORIENTATION_NODES,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    The amplitudes of uniform cylinders, averaged over orientations
+
+    A cylinder along z scatters along n with 2 J1(q R s) / (q R s) sinc(q L c / 2),
+    where c and s are the cosine and sine of the angle between n and its axis.
+
+    Parameters
+    ----------
+    q : np.ndarray
+        The magnitudes of the scattering vector, with shape (Q,)
+    radius : np.ndarray
+        The radius of each cylinder, with shape (N,)
+    length : np.ndarray
+        The length of each cylinder, with shape (N,)
+    contrast : float
+        The scattering length density less the solvent's
+    orientations : np.ndarray | None
+        The (w, x, y, z) quaternion of each cylinder. None keeps the axes along z
+    nodes : tuple[int, int]
+        The polar and azimuthal nodes of the orientation average
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        The mean amplitude and the mean squared amplitude of each cylinder at each
+        q, each with shape (N, Q)
+    """
+    from scipy.special import j1
+
+    directions, weights = orientation_nodes(*nodes)
+    q = np.asarray(q, dtype=float)
+    radius = np.atleast_1d(np.asarray(radius, dtype=float))
+    length = np.broadcast_to(np.asarray(length, dtype=float), radius.shape)
+    mean: np.ndarray = np.zeros((radius.shape[0], q.shape[0]))
+    mean_square: np.ndarray = np.zeros_like(mean)
+    rows: int = max(1, FORM_FACTOR_BLOCK // (weights.shape[0] * max(q.shape[0], 1)))
+    for start in range(0, radius.shape[0], rows):
+        chunk: slice = slice(start, start + rows)
+        body: np.ndarray = _body_directions(
+            directions,
+            None if orientations is None else orientations[chunk],
+            radius[chunk].shape[0],
+        )
+        cosine: np.ndarray = np.abs(body[:, :, 2])[:, :, None]
+        sine: np.ndarray = np.sqrt(np.maximum(1 - cosine**2, 0))
+        x: np.ndarray = q * radius[chunk, None, None] * sine
+        # 2 J1(x) / x tends to 1 at x = 0
+        safe: np.ndarray = np.where(x > 1e-8, x, 1.0)
+        radial: np.ndarray = np.where(x > 1e-8, 2 * j1(safe) / safe, 1.0)
+        # np.sinc(x) is sin(pi x) / (pi x)
+        axial: np.ndarray = np.sinc(
+            q * length[chunk, None, None] * cosine / (2 * np.pi)
+        )
+        volume: np.ndarray = np.pi * radius[chunk] ** 2 * length[chunk]
+        amplitude: np.ndarray = contrast * volume[:, None, None] * radial * axial
+        mean[chunk], mean_square[chunk] = _average(amplitude, weights)
+    return mean, mean_square
+
+
+def _layer_contrast(
+    densities: dict[int, float], sld: dict[int, float], solvent: float
+) -> np.ndarray:
+    """The contrast of each type, 0 for a type sampled with no points"""
+    return np.array(
+        [sld[t] - solvent if density > 0 else 0.0 for t, density in densities.items()]
+    )
+
+
+def table_amplitudes(
+    table: ParticleTable,
+    q: np.ndarray,
+    sld: dict[int, float],
+    solvent: float = 0.0,
+    nodes: tuple[int, int] = ORIENTATION_NODES,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    The form factor amplitudes of the particles of a table
+
+    A layer sampled at density 0 holds no points, so it is taken as solvent, like
+    the points of the layer would be.
+
+    Parameters
+    ----------
+    table : ParticleTable
+        The particles, all ellipsoids, core-shell spheres or onions
+    q : np.ndarray
+        The magnitudes of the scattering vector, with shape (Q,)
+    sld : dict[int, float]
+        The scattering length density of each point type
+    solvent : float
+        The scattering length density of the solvent
+    nodes : tuple[int, int]
+        The polar and azimuthal nodes of the orientation average of ellipsoids
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        The mean amplitude and the mean squared amplitude of each particle at each
+        q over its orientations, each with shape (N, Q)
+    """
+    q = np.asarray(q, dtype=float)
+    assert table.kinds[0] in FORM_FACTOR_KINDS, f"no form factor for {table.kinds[0]}"
+    contrast: np.ndarray = _layer_contrast(table.type_densities(), sld, solvent)
+    if table.kinds[0] == "ellipsoid":
+        identity: bool = bool(np.all(table.orientations == [1.0, 0.0, 0.0, 0.0]))
+        return ellipsoid_amplitudes(
+            q,
+            table.sizes[:, :3],
+            float(contrast[0]),
+            None if identity else table.orientations,
+            nodes,
+        )
+    # core-shell sizes are the core and outer radius, onion sizes the thicknesses
+    thickness: np.ndarray = (
+        np.diff(table.sizes, axis=1, prepend=0)
+        if table.kinds[0] == "core_shell"
+        else table.sizes
+    )
+    amplitude: np.ndarray = shell_amplitudes(q, thickness, contrast)
+    return amplitude, amplitude**2
+
+
+def center_sum(centers: np.ndarray, amplitude: np.ndarray, q: np.ndarray) -> np.ndarray:
+    """
+    The Debye sum over the centers, sum_ij A_i(q) A_j(q) sin(q r_ij) / (q r_ij)
+
+    Parameters
+    ----------
+    centers : np.ndarray
+        The centers of the particles, with shape (N, 3)
+    amplitude : np.ndarray
+        The amplitude of each particle at each q, with shape (N, Q)
+    q : np.ndarray
+        The magnitudes of the scattering vector, with shape (Q,)
+
+    Returns
+    -------
+    np.ndarray
+        The sum at each q, the particles with themselves included
+    """
+    q = np.asarray(q, dtype=float)
+    total: np.ndarray = np.zeros(q.shape[0])
+    rows: int = max(1, FORM_FACTOR_BLOCK // (max(len(centers), 1) * max(len(q), 1)))
+    for start in range(0, len(centers), rows):
+        stop: int = min(start + rows, len(centers))
+        # the rows against themselves give both orders of their pairs, and the rows
+        # against the later particles count twice for the earlier ones
+        for columns, factor in ((slice(start, stop), 1), (slice(stop, None), 2)):
+            x: np.ndarray = (
+                np.linalg.norm(
+                    centers[start:stop, None, :] - centers[None, columns, :], axis=2
+                )[:, :, None]
+                * q
+            )
+            sinc: np.ndarray = np.ones_like(x)
+            np.divide(np.sin(x), x, out=sinc, where=x > 0)
+            sinc *= amplitude[None, columns]
+            total += factor * np.einsum("iq,ijq->q", amplitude[start:stop], sinc)
+    return total
+
+
+def analytic_intensity(
+    table: ParticleTable,
+    q: np.ndarray,
+    sld: dict[int, float],
+    solvent: float = 0.0,
+    structure: str = "debye",
+    nodes: tuple[int, int] = ORIENTATION_NODES,
+) -> np.ndarray:
+    """
+    The intensity of a box from the form factors of its particles and their centers
+
+    The same intensity as PairHistogram.intensity of the box's points with their
+    densities, without sampling the points (and without their shot noise).
+
+    With structure "debye", the particles interfere through the Debye sum over
+    their centers, exact for spheres, core-shell spheres and onions; for ellipsoids
+    it uses each one's amplitude averaged over orientations. With "decoupling" the
+    cross terms are the mean amplitude squared times the Debye sum of the centers
+    from a PairHistogram, which is much faster for many particles and exact if the
+    sizes do not depend on the positions.
+
+    Parameters
+    ----------
+    table : ParticleTable
+        The particles, all ellipsoids, core-shell spheres or onions
+    q : np.ndarray
+        The magnitudes of the scattering vector, with shape (Q,)
+    sld : dict[int, float]
+        The scattering length density of each point type
+    solvent : float
+        The scattering length density of the solvent
+    structure : str
+        "debye" or "decoupling"
+    nodes : tuple[int, int]
+        The polar and azimuthal nodes of the orientation average of ellipsoids
+
+    Returns
+    -------
+    np.ndarray
+        The intensity at each q
+    """
+    q = np.asarray(q, dtype=float)
+    mean, mean_square = table_amplitudes(table, q, sld, solvent, nodes)
+    own: np.ndarray = np.sum(mean_square, axis=0)
+    if structure == "debye":
+        return own + center_sum(table.centers, mean, q) - np.sum(mean**2, axis=0)
+    assert structure == "decoupling", f"unknown structure {structure}"
+    centers: PointBuffer = PointBuffer(len(table))
+    centers.append(table.centers, types=1)
+    pairs: PairHistogram = PairHistogram.from_points(centers, 0.1 / np.max(q))
+    others: np.ndarray = pairs.intensity(q, {1: 1.0}) - len(table)
+    return own + np.mean(mean, axis=0) ** 2 * others
+
+
+def object_intensity(
+    obj: Onion | Ellipsoid | Cylinder,
+    q: np.ndarray,
+    sld: dict[int, float],
+    solvent: float = 0.0,
+    nodes: tuple[int, int] = ORIENTATION_NODES,
+) -> np.ndarray:
+    """
+    The intensity of one onion, ellipsoid or cylinder, averaged over orientations
+
+    Parameters
+    ----------
+    obj : Onion | Ellipsoid | Cylinder
+        The object, whose shells are the types 1, 2, ... of its points
+    q : np.ndarray
+        The magnitudes of the scattering vector, with shape (Q,)
+    sld : dict[int, float]
+        The scattering length density of each point type
+    solvent : float
+        The scattering length density of the solvent
+    nodes : tuple[int, int]
+        The polar and azimuthal nodes of the orientation average
+
+    Returns
+    -------
+    np.ndarray
+        The intensity at each q
+    """
+    q = np.asarray(q, dtype=float)
+    if isinstance(obj, Onion):
+        densities: dict[int, float] = {
+            t + 1: float(d) for t, d in enumerate(obj.density)
+        }
+        contrast: np.ndarray = _layer_contrast(densities, sld, solvent)
+        amplitude: np.ndarray = shell_amplitudes(q, np.atleast_2d(obj.radii), contrast)
+        return amplitude[0] ** 2
+    (contrast,) = contrast_weights(np.array([1]), sld, solvent=solvent)
+    if isinstance(obj, Cylinder):
+        return cylinder_amplitudes(q, obj.radius, obj.length, contrast, None, nodes)[1][
+            0
+        ]
+    outer: np.ndarray = np.array(
+        [
+            obj.x_outer_radius,
+            obj.y_outer_radius or obj.x_outer_radius,
+            obj.z_outer_radius or obj.x_outer_radius,
+        ]
+    )
+    inner: np.ndarray | None = None
+    if obj.x_inner_radius:
+        inner = np.array(
+            [
+                obj.x_inner_radius,
+                obj.y_inner_radius or obj.x_inner_radius,
+                obj.z_inner_radius or obj.x_inner_radius,
+            ]
+        )
+    return ellipsoid_amplitudes(q, outer, contrast, None, nodes, inner)[1][0]
+
+
+def cross_check(
+    table: ParticleTable,
+    q: np.ndarray,
+    sld: dict[int, float],
+    solvent: float = 0.0,
+    bin_width: float | None = None,
+    workers: int | None = 1,
+) -> dict[str, np.ndarray]:
+    """
+    Compare the analytic intensity of a table with that of its sampled points
+
+    The points are regenerated from the table's seeds, so they are the points of
+    the build that saved it. Their intensity carries the shot noise of the points,
+    the sum of their squared scattering lengths, which is subtracted before the
+    two are compared.
+
+    Parameters
+    ----------
+    table : ParticleTable
+        The particles, all ellipsoids, core-shell spheres or onions
+    q : np.ndarray
+        The magnitudes of the scattering vector, with shape (Q,)
+    sld : dict[int, float]
+        The scattering length density of each point type
+    solvent : float
+        The scattering length density of the solvent
+    bin_width : float | None
+        The bin width of the pair histogram. Defaults to 0.1 / max(q)
+    workers : int | None
+        The number of processes that count the pairs, see PairHistogram.from_points
+
+    Returns
+    -------
+    dict[str, np.ndarray]
+        q, the analytic intensity, the intensity of the points, their shot noise
+        and the relative difference of the two (less the shot noise)
+    """
+    q = np.asarray(q, dtype=float)
+    analytic: np.ndarray = analytic_intensity(table, q, sld, solvent)
+    points: PointBuffer = PointBuffer.for_count(table.expected_count())
+    table.write(points)
+    densities: dict[int, float] = table.type_densities()
+    pairs: PairHistogram = PairHistogram.from_points(
+        points, bin_width or 0.1 / np.max(q), workers=workers
+    )
+    sampled: np.ndarray = pairs.intensity(q, sld, densities, solvent)
+    lengths: np.ndarray = contrast_weights(pairs.types, sld, densities, solvent)
+    counts: np.ndarray = np.array([np.sum(points.types == t) for t in pairs.types])
+    shot_noise: float = float(np.sum(counts * lengths**2))
+    return {
+        "q": q,
+        "analytic": analytic,
+        "points": sampled,
+        "shot_noise": np.full(q.shape, shot_noise),
+        "relative_difference": (sampled - shot_noise) / analytic - 1,
+    }
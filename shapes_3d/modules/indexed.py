@@ -0,0 +1,287 @@
+import numpy as np
+from .binary import COLUMNS, read_column, read_header, write_container, file_header
+from .buffer import PointBuffer
+
+# Columns of the particle table, one row per particle
+INDEX_COLUMNS: tuple[str, ...] = (
+    "index_ids",
+    "index_start",
+    "index_stop",
+    "index_type_min",
+    "index_type_max",
+    "index_lower",
+    "index_upper",
+    "index_centers",
+)
+
+
+def save_indexed(
+    points: PointBuffer,
+    filename: str,
+    box_len: float,
+    centers: np.ndarray | None = None,
+    sizes: np.ndarray | None = None,
+    metadata: dict | None = None,
+) -> None:
+    """
+    Save points grouped by particle, with a table of where each particle starts
+
+    The file is a points container (load_points still reads it) whose points are
+    sorted by particle id, followed by a table with one row per particle: its id,
+    its [start, stop) range of points, its smallest and largest type, its bounding
+    box, its center and, optionally, its size parameters. IndexedPoints uses the
+    table to read single particles, types or regions without a full scan.
+
+    Parameters
+    ----------
+    points : PointBuffer
+        The points to write
+    filename : str
+        The name of the file to save the points, e.g. out/box.pts
+    box_len : float
+        The length of the simulation box for the points.
+    centers : np.ndarray | None
+        The center of each particle, in order of particle id, with shape (N, 3).
+        Defaults to the middle of each particle's bounding box
+    sizes : np.ndarray | None
+        Size parameters of each particle (e.g. its radii), with shape (N,) or (N, K)
+    metadata : dict | None
+        Extra JSON-serializable information stored in the header
+    """
+    print("indexing...")
+    particles: np.ndarray = points.particles
+    order: np.ndarray | None = None
+    if particles.shape[0] > 1 and np.any(particles[1:] < particles[:-1]):
+        order = np.argsort(particles, kind="stable")
+    columns: dict[str, np.ndarray] = {
+        name: getattr(points, name) if order is None else getattr(points, name)[order]
+        for name in COLUMNS
+    }
+    particles = columns["particles"]
+    xyz: np.ndarray = columns["xyz"]
+    types: np.ndarray = columns["types"]
+
+    starts: np.ndarray = np.flatnonzero(np.diff(particles, prepend=-1) != 0)
+    if particles.shape[0] == 0:
+        starts = np.zeros(0, dtype=np.int64)
+    stops: np.ndarray = np.append(starts[1:], particles.shape[0])
+    lower: np.ndarray = np.minimum.reduceat(xyz, starts) if starts.size else xyz[:0]
+    upper: np.ndarray = np.maximum.reduceat(xyz, starts) if starts.size else xyz[:0]
+    if centers is None:
+        centers = (lower + upper) / 2
+    centers = np.asarray(centers, dtype=float).reshape(-1, 3)
+    assert centers.shape[0] == starts.shape[0], "one center per particle"
+    table: dict[str, np.ndarray] = {
+        "index_ids": particles[starts].astype(np.int64),
+        "index_start": starts.astype(np.int64),
+        "index_stop": stops.astype(np.int64),
+        "index_type_min": (
+            np.minimum.reduceat(types, starts) if starts.size else types[:0]
+        ),
+        "index_type_max": (
+            np.maximum.reduceat(types, starts) if starts.size else types[:0]
+        ),
+        "index_lower": lower,
+        "index_upper": upper,
+        "index_centers": centers,
+    }
+    if sizes is not None:
+        sizes = np.asarray(sizes, dtype=float)
+        assert sizes.shape[0] == starts.shape[0], "one size per particle"
+        table["index_sizes"] = sizes
+
+    header: dict = file_header(len(points), box_len, {}, metadata)
+    header["num_particles"] = int(starts.shape[0])
+    write_container(filename, header, columns | table)
+    print("saved to", filename)
+
+
+class IndexedPoints:
+    """
+    Random access to a file written by save_indexed
+
+    The particle table is read into memory and the points are memory-mapped, so a
+    query only touches the pages of the particles it returns.
+
+    Attributes
+    ----------
+    filename : str
+        The name of the file
+    header : dict
+        The header of the file
+    ids : np.ndarray
+        The id of each particle, sorted
+    start : np.ndarray
+        The index of the first point of each particle
+    stop : np.ndarray
+        The index after the last point of each particle
+    type_min : np.ndarray
+        The smallest type of each particle's points
+    type_max : np.ndarray
+        The largest type of each particle's points
+    lower : np.ndarray
+        The lower corner of each particle's bounding box, with shape (N, 3)
+    upper : np.ndarray
+        The upper corner of each particle's bounding box, with shape (N, 3)
+    centers : np.ndarray
+        The center of each particle, with shape (N, 3)
+    sizes : np.ndarray | None
+        The size parameters of each particle, if they were saved
+    """
+
+    def __init__(self, filename: str):
+        """
+        Opens the file
+
+        Parameters
+        ----------
+        filename : str
+            The name of the file
+        """
+        self.filename: str = filename
+        self.header: dict = read_header(filename)
+        columns: dict = self.header["columns"]
+        assert "index_ids" in columns, f"{filename} has no particle index"
+        table: dict[str, np.ndarray] = {
+            name: read_column(filename, columns[name], mmap=False)
+            for name in INDEX_COLUMNS
+        }
+        self.ids: np.ndarray = table["index_ids"]
+        self.start: np.ndarray = table["index_start"]
+        self.stop: np.ndarray = table["index_stop"]
+        self.type_min: np.ndarray = table["index_type_min"]
+        self.type_max: np.ndarray = table["index_type_max"]
+        self.lower: np.ndarray = table["index_lower"]
+        self.upper: np.ndarray = table["index_upper"]
+        self.centers: np.ndarray = table["index_centers"]
+        self.sizes: np.ndarray | None = (
+            read_column(filename, columns["index_sizes"], mmap=False)
+            if "index_sizes" in columns
+            else None
+        )
+        self._columns: list[np.ndarray] = [
+            read_column(filename, columns[name]) for name in COLUMNS
+        ]
+
+    def __len__(self) -> int:
+        return self.ids.shape[0]
+
+    @property
+    def num_points(self) -> int:
+        return self.header["num_points"]
+
+    @property
+    def box_len(self) -> float:
+        return self.header["box_len"]
+
+    def _rows(self, rows: np.ndarray) -> PointBuffer:
+        """Read the points of the particles in the given rows of the table"""
+        ranges: list[slice] = [
+            slice(start, stop) for start, stop in zip(self.start[rows], self.stop[rows])
+        ]
+        columns: list[np.ndarray] = [
+            (
+                np.concatenate([column[r] for r in ranges])
+                if ranges
+                else column[:0].copy()
+            )
+            for column in self._columns
+        ]
+        return PointBuffer.from_columns(*columns)
+
+    def particle(self, particle_id: int) -> PointBuffer:
+        """
+        Read the points of one particle
+
+        Parameters
+        ----------
+        particle_id : int
+            The id of the particle
+
+        Returns
+        -------
+        PointBuffer
+            Its points
+        """
+        return self.particles([particle_id])
+
+    def particles(self, particle_ids: np.ndarray | list[int]) -> PointBuffer:
+        """
+        Read the points of several particles
+
+        Parameters
+        ----------
+        particle_ids : np.ndarray | list[int]
+            The ids of the particles
+
+        Returns
+        -------
+        PointBuffer
+            Their points, in the order of the ids
+        """
+        particle_ids = np.asarray(particle_ids)
+        rows: np.ndarray = np.searchsorted(self.ids, particle_ids)
+        rows = np.minimum(rows, max(len(self) - 1, 0))
+        assert len(self) > 0 and np.all(
+            self.ids[rows] == particle_ids
+        ), "unknown particle id"
+        return self._rows(rows)
+
+    def of_type(self, type_id: int) -> PointBuffer:
+        """
+        Read every point of one type
+
+        Only the particles whose type range includes type_id are read.
+
+        Parameters
+        ----------
+        type_id : int
+            The type
+
+        Returns
+        -------
+        PointBuffer
+            The points of that type
+        """
+        rows: np.ndarray = np.flatnonzero(
+            (self.type_min <= type_id) & (self.type_max >= type_id)
+        )
+        points: PointBuffer = self._rows(rows)
+        keep: np.ndarray = points.types == type_id
+        return PointBuffer.from_columns(
+            points.xyz[keep], points.types[keep], points.particles[keep]
+        )
+
+    def in_region(
+        self, lower: np.ndarray, upper: np.ndarray, whole: bool = False
+    ) -> PointBuffer:
+        """
+        Read the points inside an axis-aligned box
+
+        Only the particles whose bounding box overlaps the region are read.
+
+        Parameters
+        ----------
+        lower : np.ndarray
+            The lower corner of the region
+        upper : np.ndarray
+            The upper corner of the region
+        whole : bool
+            Whether to return every point of the overlapping particles instead of
+            only the points inside the region
+
+        Returns
+        -------
+        PointBuffer
+            The points
+        """
+        lower = np.asarray(lower, dtype=float)
+        upper = np.asarray(upper, dtype=float)
+        overlaps = np.all((self.lower <= upper) & (self.upper >= lower), axis=1)
+        points: PointBuffer = self._rows(np.flatnonzero(overlaps))
+        if whole:
+            return points
+        keep = np.all((points.xyz >= lower) & (points.xyz <= upper), axis=1)
+        return PointBuffer.from_columns(
+            points.xyz[keep], points.types[keep], points.particles[keep]
+        )
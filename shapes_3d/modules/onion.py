@@ -1,4 +1,6 @@
+from functools import cached_property
 import numpy as np
+from .buffer import PointBuffer
 from .ellipsoid import Ellipsoid
 
 
@@ -15,7 +17,7 @@ class Onion:
     density : np.ndarray
         The uniform density to use for each shell. Corresponds with the radii
     pts : np.ndarray
-        The points of the onion
+        The points of the onion, generated on first access
     """
 
     def __init__(self, radii: np.ndarray, center: np.ndarray, density: np.ndarray):
@@ -34,31 +36,184 @@ class Onion:
         self.radii: np.ndarray = radii
         self.center: np.ndarray = center
         self.density: np.ndarray = density
-        self.pts: np.ndarray = self.construct_pts()
 
-    def construct_pts(self) -> np.ndarray:
+    @cached_property
+    def pts(self) -> np.ndarray:
+        return self.construct_pts()
+
+    def construct_pts(
+        self, dtype: np.dtype = np.float64, rng: np.random.Generator | None = None
+    ) -> np.ndarray:
         """
         Generate the onion in terms of points
 
+        Parameters
+        ----------
+        dtype : np.dtype
+            The dtype of the returned array
+        rng : np.random.Generator | None
+            The random generator to sample with. Defaults to the global np.random state
+
         Returns
         -------
         np.ndarray
             An array which contains the points
         """
-        points: list = []
+        shells: list[np.ndarray] = []
         current_radius: float = 0
-        shell_id: int = 0
         for shell_id, radius in enumerate(self.radii):
-            shell: list = (
+            shell: np.ndarray = (
                 Ellipsoid(
                     float(self.density[shell_id]),
                     current_radius + self.radii[shell_id],
-                    current_radius,
-                ).make_obj()
+                    x_inner_radius=current_radius,
+                ).make_obj(dtype, rng)
                 + self.center
-            ).tolist()
-            for row in shell:
-                row.append(shell_id + 1)
-            points.extend(shell)
+            )
+            shells.append(
+                np.column_stack((shell, np.full(shell.shape[0], shell_id + 1))).astype(
+                    dtype, copy=False
+                )
+            )
             current_radius += radius
-        return np.array(points)
+        if not shells:
+            return np.zeros((0, 4), dtype=dtype)
+        return np.concatenate(shells)
+
+    def write(
+        self,
+        buffer: PointBuffer,
+        particle: int = 0,
+        rng: np.random.Generator | None = None,
+    ) -> None:
+        """
+        Generate the onion straight into a buffer, with the shell number as the type
+
+        Parameters
+        ----------
+        buffer : PointBuffer
+            The buffer to append the points to
+        particle : int
+            The particle id of the onion
+        rng : np.random.Generator | None
+            The random generator to sample with. Defaults to the global np.random state
+        """
+        current_radius: float = 0
+        for shell_id, radius in enumerate(self.radii):
+            shell: np.ndarray = Ellipsoid(
+                float(self.density[shell_id]),
+                current_radius + radius,
+                x_inner_radius=current_radius,
+            ).make_obj(buffer.coord_dtype, rng)
+            shell += self.center.astype(buffer.coord_dtype)
+            buffer.append(shell, types=shell_id + 1, particles=particle)
+            current_radius += radius
+
+    def shell(self, points: np.ndarray) -> np.ndarray:
+        """
+        The shell each point lies in, the type write gives the points of that shell
+
+        Parameters
+        ----------
+        points : np.ndarray
+            The points in world coordinates, with shape (n, 3)
+
+        Returns
+        -------
+        np.ndarray
+            The shell of each point from 1 for the core, 0 outside, with shape (n,)
+        """
+        outer: np.ndarray = np.cumsum(self.radii)
+        distance: np.ndarray = np.linalg.norm(
+            np.asarray(points, dtype=float) - self.center, axis=1
+        )
+        shell: np.ndarray = np.searchsorted(outer, distance) + 1
+        shell[shell > len(outer)] = 0
+        return shell
+
+    def contains(self, points: np.ndarray) -> np.ndarray:
+        """
+        Whether points lie in the onion
+
+        Parameters
+        ----------
+        points : np.ndarray
+            The points in world coordinates, with shape (n, 3)
+
+        Returns
+        -------
+        np.ndarray
+            Whether each point is inside, with shape (n,)
+        """
+        return self.signed_distance(points) <= 0
+
+    def signed_distance(self, points: np.ndarray) -> np.ndarray:
+        """
+        The distance of points to the outer surface, negative inside the onion
+
+        Parameters
+        ----------
+        points : np.ndarray
+            The points in world coordinates, with shape (n, 3)
+
+        Returns
+        -------
+        np.ndarray
+            The signed distance of each point, with shape (n,)
+        """
+        distance: np.ndarray = np.linalg.norm(
+            np.asarray(points, dtype=float) - self.center, axis=1
+        )
+        return distance - np.sum(self.radii)
+
+    def expected_count(self) -> float:
+        """
+        The expected number of points, density times the volume of each shell
+
+        Returns
+        -------
+        float
+            The expected number of points
+        """
+        return float(expected_onion_count(self.radii, self.density))
+
+
+def expected_shell_counts(radii: np.ndarray, density: np.ndarray) -> np.ndarray:
+    """
+    The expected number of points of each shell of one or many onions
+
+    Parameters
+    ----------
+    radii : np.ndarray
+        The thickness of each shell, with shape (K,) or (N, K)
+    density : np.ndarray
+        The uniform density to use for each shell, with shape (K,)
+
+    Returns
+    -------
+    np.ndarray
+        The expected number of points of each shell, with the shape of radii
+    """
+    outer: np.ndarray = np.cumsum(radii, axis=-1)
+    inner: np.ndarray = outer - radii
+    shell_volume: np.ndarray = (4 / 3) * np.pi * (outer**3 - inner**3)
+    return density * shell_volume
+
+
+def expected_onion_count(radii: np.ndarray, density: np.ndarray) -> np.ndarray:
+    """
+    The expected number of points of one or many onions
+
+    Parameters
+    ----------
+    radii : np.ndarray
+        The thickness of each shell, with shape (K,) or (N, K)
+    density : np.ndarray
+        The uniform density to use for each shell, with shape (K,)
+
+    Returns
+    -------
+    np.ndarray
+        The expected number of points of each onion
+    """
+    return np.sum(expected_shell_counts(radii, density), axis=-1)
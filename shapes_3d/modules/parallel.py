@@ -0,0 +1,188 @@
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable, Iterator
+import os
+import numpy as np
+from .buffer import PointBuffer, column_dtypes
+from .population import ParticleTable
+
+# The expected number of points generated by one task
+PARALLEL_CHUNK: int = 2**20
+
+# The table of the worker process, sent once when the worker starts
+_table: ParticleTable | None = None
+
+
+def balanced_chunks(costs: np.ndarray, chunk_points: float) -> list[np.ndarray]:
+    """
+    Group particles into chunks of about chunk_points expected points, largest first
+
+    The particles are taken from the most to the least expensive, so the large ones
+    are started first and the small ones fill the idle workers at the end. The rows
+    of a chunk are sorted, and the chunks only depend on the costs, so the points
+    come out in the same order however many workers generate them.
+
+    Parameters
+    ----------
+    costs : np.ndarray
+        The expected number of points of each particle
+    chunk_points : float
+        The expected number of points of a chunk
+
+    Returns
+    -------
+    list[np.ndarray]
+        The rows of the particles in each chunk
+    """
+    costs = np.asarray(costs, dtype=float)
+    order: np.ndarray = np.argsort(-costs, kind="stable")
+    boundaries: np.ndarray = np.cumsum(costs[order]) // max(chunk_points, 1)
+    # a chunk ends at the particle that crosses a multiple of chunk_points
+    splits: np.ndarray = np.flatnonzero(np.diff(boundaries)) + 1
+    return [np.sort(chunk) for chunk in np.split(order, splits) if chunk.shape[0] > 0]
+
+
+def _init_worker(table: ParticleTable) -> None:
+    """Keep the table in the worker, so the tasks only send particle rows"""
+    global _table
+    _table = table
+
+
+def _write_chunk(
+    rows: np.ndarray, expected: float, compact: bool, max_type: int
+) -> tuple[str, int]:
+    """Generate the particles of one chunk into a new shared memory block"""
+    assert _table is not None
+    buffer: PointBuffer = PointBuffer.for_count(
+        expected, compact=compact, max_type=max_type
+    )
+    _table.write_rows(buffer, rows)
+    shared, columns = _shared_columns(len(buffer), compact, max_type)
+    for column, name in zip(columns, ("xyz", "types", "particles")):
+        column[:] = getattr(buffer, name)
+    del columns
+    shared.close()
+    return shared.name, len(buffer)
+
+
+def _shared_columns(
+    size: int, compact: bool, max_type: int, name: str | None = None
+) -> tuple[SharedMemory, list[np.ndarray]]:
+    """Create (or attach to) a shared memory block holding the three columns"""
+    shapes: list[tuple[int, ...]] = [(size, 3), (size,), (size,)]
+    dtypes: tuple[np.dtype, ...] = column_dtypes(compact, max_type)
+    nbytes: list[int] = [
+        int(np.prod(shape)) * dtype.itemsize for shape, dtype in zip(shapes, dtypes)
+    ]
+    shared: SharedMemory = (
+        SharedMemory(create=True, size=max(sum(nbytes), 1))
+        if name is None
+        else SharedMemory(name=name)
+    )
+    offsets: np.ndarray = np.cumsum([0] + nbytes[:-1])
+    columns: list[np.ndarray] = [
+        np.ndarray(shape, dtype, buffer=shared.buf, offset=offset)
+        for shape, dtype, offset in zip(shapes, dtypes, offsets)
+    ]
+    return shared, columns
+
+
+def _copy_chunk(
+    buffer: PointBuffer, future: Future, compact: bool, max_type: int
+) -> None:
+    """Copy a finished chunk out of its shared memory block and free the block"""
+    name, size = future.result()
+    shared, columns = _shared_columns(size, compact, max_type, name)
+    try:
+        for out, column in zip(buffer.allocate(size), columns):
+            out[:] = column
+    finally:
+        del columns
+        shared.close()
+        shared.unlink()
+
+
+def parallel_writers(
+    table: ParticleTable,
+    workers: int | None = None,
+    compact: bool = False,
+    max_type: int = 255,
+    chunk_points: float = PARALLEL_CHUNK,
+) -> Iterator[Callable[[PointBuffer], None]]:
+    """
+    Generate the particles of a table on a process pool, as writers
+
+    Every particle is sampled with its own generator, seeded from the table's
+    SeedSequence, and the chunks of balanced_chunks are copied out in the order
+    they were handed out, also with one worker, so the points are the same for
+    any number of workers. A worker writes its chunk into a shared memory block,
+    and the writer copies it straight into the buffer it is given, e.g. a
+    MappedPointBuffer or a batch of iter_batches. At most two chunks per
+    worker are generated ahead of the writers.
+
+    Parameters
+    ----------
+    table : ParticleTable
+        The particles
+    workers : int | None
+        The number of worker processes. 1 generates in this process, None uses
+        every CPU
+    compact : bool
+        Whether the workers sample float32 coordinates, like a compact buffer
+    max_type : int
+        The largest type id, used to pick the compact type dtype
+    chunk_points : float
+        The expected number of points of one task
+
+    Yields
+    ------
+    Callable[[PointBuffer], None]
+        Callables that each append the points of one chunk of particles
+    """
+    costs: np.ndarray = table.expected_counts()
+    chunks: list[np.ndarray] = balanced_chunks(costs, chunk_points)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for rows in chunks:
+            yield partial(_write_rows, table=table, rows=rows)
+        return
+    # the workers share this process's tracker, which forgets a block once it is
+    # unlinked here, instead of each starting one that warns about every block
+    resource_tracker.ensure_running()
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(table,)
+    ) as executor:
+        pending: deque[Future] = deque()
+        try:
+            for rows in chunks:
+                expected: float = float(np.sum(costs[rows]))
+                pending.append(
+                    executor.submit(_write_chunk, rows, expected, compact, max_type)
+                )
+                if len(pending) >= 2 * workers:
+                    yield partial(
+                        _copy_chunk,
+                        future=pending.popleft(),
+                        compact=compact,
+                        max_type=max_type,
+                    )
+            while pending:
+                yield partial(
+                    _copy_chunk,
+                    future=pending.popleft(),
+                    compact=compact,
+                    max_type=max_type,
+                )
+        finally:
+            # free the blocks of the chunks nobody copied, e.g. after an error
+            for future in pending:
+                if not future.cancel() and future.exception() is None:
+                    SharedMemory(name=future.result()[0]).unlink()
+
+
+def _write_rows(buffer: PointBuffer, table: ParticleTable, rows: np.ndarray) -> None:
+    """Generate the particles of one chunk in this process"""
+    table.write_rows(buffer, rows)
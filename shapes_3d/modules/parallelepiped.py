@@ -1,4 +1,7 @@
 import numpy as np
+from .buffer import PointBuffer
+from .profiling import count
+from .rotations import rotate, rotation_matrices, to_body
 
 
 class Parallelepiped:
@@ -9,12 +12,15 @@ class Parallelepiped:
         theta: float = np.pi / 2,
         phi: float = np.pi / 2,
         center: np.ndarray = np.array([0, 0, 0]),
+        orientation: np.ndarray | None = None,
     ) -> None:
         self.thickness: np.ndarray = thickness
         self.density: np.ndarray = density
         self.theta = theta
         self.phi = phi
         self.center = center
+        # the (w, x, y, z) quaternion of the shells about the center, None for none
+        self.orientation = orientation
 
     def get_final_bounds(self) -> float:
         summed: np.ndarray = np.sum(self.thickness, axis=0)
@@ -39,12 +45,60 @@ class Parallelepiped:
             )
         return x_condition & y_condition
 
+    def _past_faces(self, points: np.ndarray, total: np.ndarray) -> np.ndarray:
+        """How far (n, 3) world points are past the x, y and z faces of a solid shell"""
+        rotation: np.ndarray | None = (
+            None if self.orientation is None else rotation_matrices(self.orientation)[0]
+        )
+        x, y, z = to_body(points, self.center, rotation).T
+        sin_t, cos_t = np.sin(self.theta), np.cos(self.theta)
+        sin_p, cos_p = np.sin(self.phi), np.cos(self.phi)
+        z_length: float = total[2] * sin_t * sin_p
+        # the sheared coordinates of is_in_bounds, from 0 to the thickness
+        height: np.ndarray = z + z_length / 2
+        u: np.ndarray = x + (total[0] + total[2] * cos_t) / 2 - height * cos_t / sin_t
+        v: np.ndarray = y + (total[1] + total[2] * cos_p) / 2 - height * cos_p / sin_p
+        return np.column_stack(
+            (
+                (np.abs(u - total[0] / 2) - total[0] / 2) * sin_t,
+                (np.abs(v - total[1] / 2) - total[1] / 2) * sin_p,
+                np.abs(z) - z_length / 2,
+            )
+        )
+
+    def shell(self, points: np.ndarray) -> np.ndarray:
+        """The shell (1 for the innermost, 0 outside) of each of the (n, 3) points"""
+        shell: np.ndarray = np.zeros(len(points), dtype=np.int64)
+        outer: np.ndarray = np.cumsum(self.thickness, axis=0)
+        for k in range(outer.shape[0] - 1, -1, -1):
+            inside: np.ndarray = np.all(self._past_faces(points, outer[k]) <= 0, axis=1)
+            shell[inside] = k + 1
+        return shell
+
+    def contains(self, points: np.ndarray) -> np.ndarray:
+        """Whether each of the (n, 3) points in world coordinates is inside"""
+        return self.signed_distance(points) <= 0
+
+    def signed_distance(self, points: np.ndarray) -> np.ndarray:
+        """
+        The distance of each of the (n, 3) points to the surface, negative inside
+
+        Exact inside and in front of the faces, and everywhere for a rectangular
+        parallelepiped. Past the edges of a skewed one it is an approximation.
+        """
+        past: np.ndarray = self._past_faces(points, np.sum(self.thickness, axis=0))
+        return np.minimum(np.max(past, axis=1), 0) + np.linalg.norm(
+            np.maximum(past, 0), axis=1
+        )
+
     def make_shell(
         self,
         density: float,
         outer_thickness: np.ndarray,
         inner_thickness: np.ndarray,
         type: int | None = None,
+        dtype: np.dtype = np.float64,
+        rng: np.random.Generator | None = None,
     ) -> np.ndarray:
         x_length = outer_thickness[0] + outer_thickness[2] * np.cos(self.theta)
         y_length = outer_thickness[1] + outer_thickness[2] * np.cos(self.phi)
@@ -54,13 +108,14 @@ class Parallelepiped:
         zi_length = inner_thickness[2] * np.sin(self.theta) * np.sin(self.phi)
         box_volume = x_length * y_length * z_length
         N: int = int(density * box_volume)
-        x_points: np.ndarray = np.random.uniform(
+        random = np.random if rng is None else rng
+        x_points: np.ndarray = random.uniform(
             -x_length / 2,
             x_length / 2,
             N,
         )
-        y_points: np.ndarray = np.random.uniform(-y_length / 2, y_length / 2, N)
-        z_points: np.ndarray = np.random.uniform(
+        y_points: np.ndarray = random.uniform(-y_length / 2, y_length / 2, N)
+        z_points: np.ndarray = random.uniform(
             -z_length / 2,
             z_length / 2,
             N,
@@ -80,20 +135,33 @@ class Parallelepiped:
             z_points + z_length / 2,
         )
         is_good = np.bitwise_not(is_inner) & points_in_bounds
-        x_points_outer: np.ndarray = x_points[is_good] + self.center[0]
-        y_points_outer: np.ndarray = y_points[is_good] + self.center[1]
-        z_points_outer: np.ndarray = z_points[is_good] + self.center[2]
+        points: np.ndarray = np.column_stack(
+            (x_points[is_good], y_points[is_good], z_points[is_good])
+        )
+        if self.orientation is not None:
+            points = rotate(points, rotation_matrices(self.orientation)[0])
+        points += self.center
+        count("parallelepiped.candidates", N)
+        count("parallelepiped.accepted", points.shape[0])
         if type is not None:
             assert type > 0
-            type_arr: np.ndarray = np.full(x_points_outer.shape, type)
-            return np.column_stack(
-                (x_points_outer, y_points_outer, z_points_outer, type_arr)
-            )
+            type_arr: np.ndarray = np.full(points.shape[0], type)
+            return np.column_stack((points, type_arr)).astype(dtype, copy=False)
         else:
-            return np.column_stack((x_points_outer, y_points_outer, z_points_outer))
+            return points.astype(dtype, copy=False)
+
+    def expected_count(self) -> float:
+        summed: np.ndarray = np.cumsum(self.thickness, axis=0)
+        volume: np.ndarray = (
+            np.prod(summed, axis=1) * np.sin(self.theta) * np.sin(self.phi)
+        )
+        shell_volume: np.ndarray = np.diff(volume, prepend=0)
+        return float(np.sum(self.density * shell_volume))
 
-    def make_obj(self) -> np.ndarray:
-        points: list = []
+    def make_obj(
+        self, dtype: np.dtype = np.float64, rng: np.random.Generator | None = None
+    ) -> np.ndarray:
+        shells: list[np.ndarray] = []
         current_length: np.ndarray = np.zeros(3)
         for i in range(self.thickness.shape[0]):
             shell: np.ndarray = self.make_shell(
@@ -101,7 +169,29 @@ class Parallelepiped:
                 outer_thickness=current_length + self.thickness[i],
                 inner_thickness=current_length,
                 type=i + 1,
+                dtype=dtype,
+                rng=rng,
+            )
+            shells.append(shell)
+            current_length += self.thickness[i]
+        if not shells:
+            return np.zeros((0, 4))
+        return np.concatenate(shells)
+
+    def write(
+        self,
+        buffer: PointBuffer,
+        particle: int = 0,
+        rng: np.random.Generator | None = None,
+    ) -> None:
+        current_length: np.ndarray = np.zeros(3)
+        for i in range(self.thickness.shape[0]):
+            shell: np.ndarray = self.make_shell(
+                density=self.density[i],
+                outer_thickness=current_length + self.thickness[i],
+                inner_thickness=current_length,
+                dtype=buffer.coord_dtype,
+                rng=rng,
             )
-            points.extend(shell)
+            buffer.append(shell, types=i + 1, particles=particle)
             current_length += self.thickness[i]
-        return np.array(points)
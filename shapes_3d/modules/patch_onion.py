@@ -1,6 +1,7 @@
 import numpy as np
 from .onion import Onion
 from .patch_shell import PatchShell
+from .buffer import PointBuffer
 
 
 class PatchOnion:
@@ -11,6 +12,8 @@ class PatchOnion:
     ----------
     onion : Onion
         The base onion associated with the objects
+    center : np.ndarray
+        The center of the entire onion, with [x, y, z] coordinates
     patch_obj : PatchShell
         The patches on the onion
     """
@@ -43,11 +46,16 @@ class PatchOnion:
             The density of each patch
         """
         self.onion: Onion = Onion(radii, center, density)
+        self.center: np.ndarray = center
         total_radius: float = np.sum(radii)
         self.patch_obj: PatchShell = PatchShell(
             total_radius, patch_area, num_patches, patch_density
         )
 
+    def expected_count(self) -> float:
+        """Return the expected number of points of the onion and the patches"""
+        return self.onion.expected_count() + self.patch_obj.expected_count()
+
     def onion_base(self) -> np.ndarray:
         """Return the onion's points"""
         return self.onion.pts
@@ -55,3 +63,31 @@ class PatchOnion:
     def patches(self) -> np.ndarray:
         """Return the patches' points"""
         return self.patch_obj.make_patches()
+
+    def write(
+        self,
+        buffer: PointBuffer,
+        particle: int = 0,
+        patch_type: int | None = None,
+        rng: np.random.Generator | None = None,
+    ) -> None:
+        """
+        Write the onion and the shifted patches into a buffer
+
+        Parameters
+        ----------
+        buffer : PointBuffer
+            The buffer to append the points to
+        particle : int
+            The particle id of the patchy onion
+        patch_type : int | None
+            The type of the patch points. Defaults to one past the last shell
+        rng : np.random.Generator | None
+            The random generator to sample with. Defaults to the global np.random state
+        """
+        self.onion.write(buffer, particle, rng)
+        if patch_type is None:
+            patch_type = len(self.onion.radii) + 1
+        patches: np.ndarray = self.patch_obj.make_patches(buffer.coord_dtype, rng)
+        patches += self.center.astype(buffer.coord_dtype)
+        buffer.append(patches, types=patch_type, particles=particle)
@@ -1,6 +1,8 @@
 import numpy as np
-from scipy.spatial.transform import Rotation as Rot
-from scipy.stats import qmc
+from .rotations import polar_rotation, random_quaternions, rotate, rotation_matrices
+
+# scipy is imported where the patches are made, so that importing the shapes (e.g. in
+# a worker that only builds spheres) does not pay for it
 
 
 class PatchShell:
@@ -32,7 +34,11 @@ class PatchShell:
         return centers
 
     def make_circle(
-        self, patch_area: float, final_polar: float, final_azimuthal: float
+        self,
+        patch_area: float,
+        final_polar: float,
+        final_azimuthal: float,
+        rng: np.random.Generator | None = None,
     ) -> np.ndarray:
         """
         Make a circle on the current sphere with the given patch size
@@ -41,67 +47,69 @@ class PatchShell:
         patch_area: float - The current patch's area
         final_polar: float - The polar angle of the center of the circle
         final_azimuthal: float - The azimuthal angle of the center of the circle
+        rng: np.random.Generator | None - The random generator, defaults to np.random
         """
+        from scipy.stats import qmc
 
         num_pts: int = int(np.sqrt(self.density * patch_area))
         temp: float = patch_area / (2 * np.pi * self.radius**2)
         arc_radius: float = self.radius * np.arccos(1 - temp)
 
         polar_change: float = arc_radius / self.radius
-        sampler: qmc.Sobol = qmc.Sobol(d=2, scramble=True)
+        random = np.random if rng is None else rng
+        sampler: qmc.Sobol = qmc.Sobol(d=2, scramble=True, seed=rng)
         sobol_log_points: int = int(
             2 ** np.ceil(np.log2(num_pts))
         )  # Sobol needs points of 2^n
         sample: np.ndarray = sampler.random(sobol_log_points)
-        patch_points: np.ndarray = np.zeros((sobol_log_points**2, 3))
-
-        current_point: int = 0
         base_index: np.ndarray = sample[:, 0]
+        # the same draws as one row of angles per base, taken all at once
+        all_theta: np.ndarray = random.uniform(
+            0, 2 * np.pi, (sobol_log_points, sobol_log_points)
+        )
+        polar_angle: np.ndarray = np.arccos(
+            1 - base_index * (1 - np.cos(polar_change / 2))
+        )[:, None]
+        position: np.ndarray = self.radius * np.stack(
+            (
+                np.cos(all_theta) * np.sin(polar_angle),
+                np.sin(all_theta) * np.sin(polar_angle),
+                np.broadcast_to(np.cos(polar_angle), all_theta.shape),
+            ),
+            axis=-1,
+        ).reshape(-1, 3)
+        patch_points: np.ndarray = rotate(
+            position, polar_rotation(final_polar, final_azimuthal)
+        )
+        return patch_points
 
-        for curr_base in base_index:
-            all_theta: np.ndarray = np.random.uniform(0, 2 * np.pi, sobol_log_points)
-            polar_angle: float = np.arccos(
-                1 - curr_base * (1 - np.cos(polar_change / 2))
-            )
-            for azimuthal_angle in all_theta:
-                position: np.ndarray = self.radius * np.array(
-                    [
-                        np.cos(azimuthal_angle) * np.sin(polar_angle),
-                        np.sin(azimuthal_angle) * np.sin(polar_angle),
-                        np.cos(polar_angle),
-                    ]
-                )
-                quaternion_y: np.ndarray = np.array(
-                    [
-                        0,
-                        np.sin(final_polar / 2),
-                        0,
-                        np.cos(final_polar / 2),
-                    ],
-                )
-                quaternion_z: np.ndarray = np.array(
-                    [
-                        0,
-                        0,
-                        np.sin(final_azimuthal / 2),
-                        np.cos(final_azimuthal / 2),
-                    ]
-                )
-                rotation_1: Rot = Rot.from_quat(quaternion_y)
-                rotation_2: Rot = Rot.from_quat(quaternion_z)
-
-                position_1: np.ndarray = rotation_1.apply(position)
-                final_position: np.ndarray = rotation_2.apply(position_1)
+    def patch_areas(self) -> np.ndarray:
+        """
+        The area of every patch
+        """
+        return np.broadcast_to(
+            np.asarray(self.patch_area, dtype=float), (self.num_patches,)
+        )
 
-                patch_points[current_point] = final_position
-                current_point += 1
-        return patch_points
+    def expected_count(self) -> int:
+        """
+        The number of points make_patches returns. Each patch has (2^n)^2 points
+        """
+        num_pts: np.ndarray = np.sqrt(self.density * self.patch_areas()).astype(int)
+        sobol_log_points: np.ndarray = 2 ** np.ceil(np.log2(num_pts))
+        return int(np.sum(sobol_log_points**2))
 
-    def make_patches(self) -> np.ndarray:
+    def make_patches(
+        self, dtype: np.dtype = np.float64, rng: np.random.Generator | None = None
+    ) -> np.ndarray:
         """
         Make all the patches.
+
+        Params:
+        dtype: np.dtype - The dtype of the returned coordinates
+        rng: np.random.Generator | None - The random generator, defaults to np.random
         """
-        patches: list = []
+        patches: list[np.ndarray] = []
         centers: np.ndarray = self.gen_centers()
 
         for i, (_, polar_angle, azimuthal_angle) in enumerate(centers):
@@ -112,10 +120,11 @@ class PatchShell:
             else:
                 patch_area = self.patch_area
             patch: np.ndarray = self.make_circle(
-                patch_area, polar_angle, azimuthal_angle
+                patch_area, polar_angle, azimuthal_angle, rng
             )
-            patches.extend(patch)
+            patches.append(patch)
 
-        random_rotation: Rot = Rot.from_quat(np.random.uniform(0, 1, size=4))
-        final_patches: np.ndarray = random_rotation.apply(patches)
-        return np.array(final_patches)
+        # a uniformly random orientation of the whole set of patches
+        random_rotation: np.ndarray = rotation_matrices(random_quaternions(1, rng))[0]
+        final_patches: np.ndarray = rotate(np.concatenate(patches), random_rotation)
+        return np.asarray(final_patches, dtype=dtype)
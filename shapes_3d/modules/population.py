@@ -0,0 +1,503 @@
+from functools import partial
+from pathlib import Path
+from typing import Callable
+import json
+import numpy as np
+from .buffer import PointBuffer
+from .dump import dump_header, open_dump
+from .ellipsoid import Ellipsoid, EllipsoidPopulation
+from .onion import Onion, expected_onion_count
+from .parallelepiped import Parallelepiped
+from .patch_onion import PatchOnion
+
+# What the size columns of each kind of particle hold
+KINDS: dict[str, str] = {
+    "ellipsoid": "the x, y and z semi-axes",
+    "core_shell": "the core radius and the outer radius",
+    "onion": "the thickness of each shell",
+    "parallelepiped": "theta, phi, then the x, y and z thickness of each shell",
+    "patchy_onion": "the thickness of each shell",
+}
+# The per-particle columns of the aspherical OVITO dump
+OVITO_COLUMNS: str = "id type x y z shapex shapey shapez quatw quati quatj quatk"
+OVITO_FORMAT: str = "%d %d" + " %.6f" * 10 + "\n"
+# The kinds write_rows samples many particles at a time, not one by one
+BATCHED_KINDS: tuple[str, ...] = ("ellipsoid", "core_shell")
+
+
+def spawn_seeds(num: int, seed: int | None = None) -> tuple[np.ndarray, int]:
+    """
+    Give every particle its own seed, spawned from one root SeedSequence
+
+    Parameters
+    ----------
+    num : int
+        The number of particles
+    seed : int | None
+        The root seed. Defaults to fresh entropy from the OS
+
+    Returns
+    -------
+    tuple[np.ndarray, int]
+        The uint64 seed of each particle and the entropy of the root
+    """
+    root: np.random.SeedSequence = np.random.SeedSequence(seed)
+    # one draw of the root's state, instead of spawning a child per particle
+    seeds: np.ndarray = root.generate_state(num, np.uint64)
+    return seeds, root.entropy
+
+
+class ParticleTable:
+    """
+    The parameters of every particle of a box, as a structure of arrays
+
+    A few numbers per particle describe it completely, so the table is a tiny
+    substitute for the sampled points: every particle carries its own seed, and
+    write_particle regenerates exactly the same points from it on demand.
+
+    Attributes
+    ----------
+    ids : np.ndarray
+        The particle id of each particle, with shape (N,)
+    kinds : np.ndarray
+        The kind of each particle, one of the keys of KINDS, with shape (N,)
+    centers : np.ndarray
+        The center of each particle, with shape (N, 3)
+    sizes : np.ndarray
+        The size parameters of each particle, see KINDS, with shape (N, K)
+    orientations : np.ndarray
+        The orientation of each particle as a (w, x, y, z) quaternion, with shape (N, 4)
+    seeds : np.ndarray
+        The seed the points of each particle are sampled with, with shape (N,)
+    box_len : float
+        The length of the simulation box for the points.
+    params : dict
+        The parameters shared by every particle, e.g. the densities
+    """
+
+    def __init__(
+        self,
+        kinds: str | np.ndarray,
+        centers: np.ndarray,
+        sizes: np.ndarray,
+        box_len: float,
+        params: dict | None = None,
+        ids: np.ndarray | None = None,
+        orientations: np.ndarray | None = None,
+        seeds: np.ndarray | None = None,
+        seed: int | None = None,
+    ):
+        """
+        Initializes the table
+
+        Parameters
+        ----------
+        kinds : str | np.ndarray
+            The kind of every particle, or of each particle
+        centers : np.ndarray
+            The center of each particle, with shape (N, 3)
+        sizes : np.ndarray
+            The size parameters of each particle, with shape (N,) or (N, K)
+        box_len : float
+            The length of the simulation box for the points.
+        params : dict | None
+            The JSON-serializable parameters shared by every particle
+        ids : np.ndarray | None
+            The particle ids. Defaults to 0 to N - 1
+        orientations : np.ndarray | None
+            The (w, x, y, z) quaternions. Defaults to no rotation
+        seeds : np.ndarray | None
+            The seed of each particle. Defaults to seeds spawned from seed
+        seed : int | None
+            The root seed the particle seeds are spawned from
+        """
+        self.centers: np.ndarray = np.asarray(centers, dtype=float).reshape(-1, 3)
+        num: int = self.centers.shape[0]
+        sizes = np.asarray(sizes, dtype=float)
+        self.sizes: np.ndarray = sizes.reshape(num, sizes.size // max(num, 1))
+        self.kinds: np.ndarray = np.broadcast_to(np.asarray(kinds, dtype=str), (num,))
+        assert all(kind in KINDS for kind in np.unique(self.kinds)), "unknown kind"
+        self.box_len: float = box_len
+        self.params: dict = dict(params or {})
+        self.ids: np.ndarray = (
+            np.arange(num, dtype=np.int64) if ids is None else np.asarray(ids)
+        )
+        if orientations is None:
+            orientations = np.tile([1.0, 0.0, 0.0, 0.0], (num, 1))
+        self.orientations: np.ndarray = np.asarray(orientations, dtype=float)
+        if seeds is None:
+            seeds, entropy = spawn_seeds(num, seed)
+            self.params["entropy"] = str(entropy)
+        self.seeds: np.ndarray = np.asarray(seeds, dtype=np.uint64)
+
+    def __len__(self) -> int:
+        return self.centers.shape[0]
+
+    def save(self, filename: str) -> None:
+        """
+        Save the table as a .npz file
+
+        Parameters
+        ----------
+        filename : str
+            The name of the file, e.g. out/box.npz
+        """
+        Path(filename).parent.mkdir(parents=True, exist_ok=True)
+        np.savez(
+            filename,
+            ids=self.ids,
+            kinds=self.kinds,
+            centers=self.centers,
+            sizes=self.sizes,
+            orientations=self.orientations,
+            seeds=self.seeds,
+            box_len=self.box_len,
+            params=json.dumps(self.params),
+        )
+        print("saved the particle table to", filename)
+
+    @classmethod
+    def load(cls, filename: str) -> "ParticleTable":
+        """
+        Load a table saved with save
+
+        Parameters
+        ----------
+        filename : str
+            The name of the .npz file
+
+        Returns
+        -------
+        ParticleTable
+            The table
+        """
+        with np.load(filename) as data:
+            return cls(
+                data["kinds"],
+                data["centers"],
+                data["sizes"],
+                float(data["box_len"]),
+                json.loads(str(data["params"])),
+                ids=data["ids"],
+                orientations=data["orientations"],
+                seeds=data["seeds"],
+            )
+
+    def shapes(self) -> np.ndarray:
+        """
+        The half extents of each particle, as OVITO's aspherical shape
+
+        Returns
+        -------
+        np.ndarray
+            The x, y and z semi-axes of each particle, with shape (N, 3)
+        """
+        shapes: np.ndarray = np.zeros((len(self), 3))
+        for kind in np.unique(self.kinds):
+            rows: np.ndarray = self.kinds == kind
+            sizes: np.ndarray = self.sizes[rows]
+            if kind == "ellipsoid":
+                shapes[rows] = sizes[:, :3]
+            elif kind == "core_shell":
+                shapes[rows] = sizes[:, 1:2]
+            elif kind == "parallelepiped":
+                theta, phi = sizes[:, 0:1], sizes[:, 1:2]
+                total: np.ndarray = sizes[:, 2:].reshape(len(sizes), -1, 3).sum(axis=1)
+                extent: np.ndarray = np.column_stack(
+                    (
+                        total[:, 0] + total[:, 2] * np.cos(theta[:, 0]),
+                        total[:, 1] + total[:, 2] * np.cos(phi[:, 0]),
+                        total[:, 2] * np.sin(theta[:, 0]) * np.sin(phi[:, 0]),
+                    )
+                )
+                shapes[rows] = extent / 2
+            else:
+                shapes[rows] = np.sum(sizes, axis=1, keepdims=True)
+        return shapes
+
+    def save_ovito(self, filename: str, compression: str | None = None) -> None:
+        """
+        Save one line per particle with its shape and orientation, for use with OVITO.
+
+        OVITO reads the shapex/y/z and quatw/i/j/k columns as the aspherical shape and
+        orientation of each particle, so the box can be viewed without its points.
+
+        Parameters
+        ----------
+        filename : str
+            The name of the dump file
+        compression : str | None
+            "gzip", "zstd" or "none". Defaults to what the file name implies
+        """
+        names: list[str] = sorted(np.unique(self.kinds).tolist())
+        types: np.ndarray = np.searchsorted(names, self.kinds) + 1
+        block: np.ndarray = np.column_stack(
+            (self.ids, types, self.centers, self.shapes(), self.orientations)
+        )
+        header: str = dump_header(len(self), self.box_len, OVITO_COLUMNS)
+        with open_dump(filename, header, compression) as f:
+            f.write((OVITO_FORMAT * len(self)) % tuple(block.ravel().tolist()))
+        print("saved the particles to", filename)
+
+    def rng(self, i: int) -> np.random.Generator:
+        """
+        The random generator of a particle
+
+        Parameters
+        ----------
+        i : int
+            The row of the particle
+
+        Returns
+        -------
+        np.random.Generator
+            A fresh generator seeded with the particle's seed
+        """
+        return np.random.default_rng(int(self.seeds[i]))
+
+    def expected_counts(self) -> np.ndarray:
+        """
+        The expected number of points of each particle
+
+        Returns
+        -------
+        np.ndarray
+            The expected number of points, with shape (N,)
+        """
+        counts: np.ndarray = np.zeros(len(self))
+        for kind in np.unique(self.kinds):
+            rows: np.ndarray = np.flatnonzero(self.kinds == kind)
+            sizes: np.ndarray = self.sizes[rows]
+            if kind == "ellipsoid":
+                volume: np.ndarray = (4 / 3) * np.pi * np.prod(sizes[:, :3], axis=1)
+                counts[rows] = self.params["density"] * volume
+            elif kind == "core_shell":
+                volume = (4 / 3) * np.pi * sizes**3
+                counts[rows] = self.params["core_density"] * volume[:, 0]
+                counts[rows] += self.params["shell_density"] * (
+                    volume[:, 1] - volume[:, 0]
+                )
+            elif kind in ("onion", "patchy_onion"):
+                density: np.ndarray = np.asarray(self.params["density"])
+                counts[rows] = expected_onion_count(sizes, density)
+                if kind == "patchy_onion":
+                    counts[rows] += [
+                        self._patchy_onion(i).patch_obj.expected_count() for i in rows
+                    ]
+            else:
+                counts[rows] = [self._parallelepiped(i).expected_count() for i in rows]
+        return counts
+
+    def expected_count(self) -> float:
+        """
+        The expected number of points of every particle together
+
+        Returns
+        -------
+        float
+            The expected number of points
+        """
+        return float(np.sum(self.expected_counts()))
+
+    def type_densities(self) -> dict[int, float]:
+        """
+        The density each point type of the particles is sampled at
+
+        Returns
+        -------
+        dict[int, float]
+            The density of each type, the layers of a particle being the types 1, 2, ...
+            from the inside out
+        """
+        kinds: np.ndarray = np.unique(self.kinds)
+        assert len(kinds) == 1, "the table must hold one kind of particle"
+        kind: str = str(kinds[0])
+        if kind == "ellipsoid":
+            return {1: float(self.params["density"])}
+        if kind == "core_shell":
+            return {
+                1: float(self.params["core_density"]),
+                2: float(self.params["shell_density"]),
+            }
+        assert kind in ("onion", "parallelepiped"), f"{kind} has no layer densities"
+        return {t + 1: float(d) for t, d in enumerate(self.params["density"])}
+
+    def shape(self, i: int) -> Ellipsoid | Onion | Parallelepiped | PatchOnion:
+        """
+        The shape of one particle, to ask which points it contains
+
+        Parameters
+        ----------
+        i : int
+            The row of the particle
+
+        Returns
+        -------
+        Ellipsoid | Onion | Parallelepiped | PatchOnion
+            The shape, placed at the particle's center. A core-shell sphere is an
+            onion of two shells
+        """
+        kind: str = str(self.kinds[i])
+        if kind == "ellipsoid":
+            return Ellipsoid(
+                self.params["density"],
+                *self.sizes[i, :3],
+                center=self.centers[i],
+                orientation=self._orientation(i),
+            )
+        if kind == "core_shell":
+            density: np.ndarray = np.array(
+                [self.params["core_density"], self.params["shell_density"]]
+            )
+            return Onion(np.diff(self.sizes[i], prepend=0), self.centers[i], density)
+        if kind == "onion":
+            density = np.asarray(self.params["density"])
+            return Onion(self.sizes[i], self.centers[i], density)
+        if kind == "patchy_onion":
+            return self._patchy_onion(i)
+        return self._parallelepiped(i)
+
+    def _parallelepiped(self, i: int) -> Parallelepiped:
+        theta, phi = self.sizes[i, 0], self.sizes[i, 1]
+        thickness: np.ndarray = self.sizes[i, 2:].reshape(-1, 3)
+        density: np.ndarray = np.asarray(self.params["density"])
+        return Parallelepiped(
+            thickness,
+            density,
+            theta,
+            phi,
+            center=self.centers[i],
+            orientation=self._orientation(i),
+        )
+
+    def _orientation(self, i: int) -> np.ndarray | None:
+        # None for no rotation, so unrotated particles skip the matrix products
+        if np.all(self.orientations[i] == [1.0, 0.0, 0.0, 0.0]):
+            return None
+        return self.orientations[i : i + 1]
+
+    def _patchy_onion(self, i: int) -> PatchOnion:
+        return PatchOnion(
+            self.sizes[i],
+            self.centers[i],
+            np.asarray(self.params["density"]),
+            np.asarray(self.params["patch_area"]),
+            self.params["num_patches"],
+            self.params["patch_density"],
+        )
+
+    def write_particle(self, buffer: PointBuffer, i: int) -> None:
+        """
+        Regenerate the points of one particle from its parameters and seed
+
+        Parameters
+        ----------
+        buffer : PointBuffer
+            The buffer to append the points to
+        i : int
+            The row of the particle
+        """
+        kind: str = str(self.kinds[i])
+        rng: np.random.Generator = self.rng(i)
+        particle: int = int(self.ids[i])
+        if kind == "ellipsoid":
+            EllipsoidPopulation(
+                self.params["density"],
+                self.sizes[i : i + 1, :3],
+                self.centers[i : i + 1],
+                particle_offset=particle,
+                orientations=self._orientation(i),
+            ).write(buffer, rng)
+        elif kind == "core_shell":
+            inner, outer = self.sizes[i : i + 1, 0], self.sizes[i : i + 1, 1]
+            center: np.ndarray = self.centers[i : i + 1]
+            EllipsoidPopulation(
+                self.params["core_density"], inner, center, None, 1, particle
+            ).write(buffer, rng)
+            EllipsoidPopulation(
+                self.params["shell_density"], outer, center, inner, 2, particle
+            ).write(buffer, rng)
+        elif kind == "onion":
+            density: np.ndarray = np.asarray(self.params["density"])
+            Onion(self.sizes[i], self.centers[i], density).write(buffer, particle, rng)
+        elif kind == "patchy_onion":
+            self._patchy_onion(i).write(
+                buffer, particle, self.params.get("patch_type"), rng
+            )
+        else:
+            self._parallelepiped(i).write(buffer, particle, rng)
+
+    def write_rows(self, buffer: PointBuffer, rows: np.ndarray) -> None:
+        """
+        Regenerate the points of several particles
+
+        Rows of one of the BATCHED_KINDS are sampled together, each particle from
+        the generator of its own seed, so a particle gets the same points as from
+        write_particle and only their order in the buffer differs. Other rows are
+        written one particle at a time.
+
+        Parameters
+        ----------
+        buffer : PointBuffer
+            The buffer to append the points to
+        rows : np.ndarray
+            The rows of the particles
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        kinds: np.ndarray = np.unique(self.kinds[rows])
+        if kinds.shape[0] != 1 or str(kinds[0]) not in BATCHED_KINDS:
+            for i in rows:
+                self.write_particle(buffer, int(i))
+            return
+        rngs: list[np.random.Generator] = [self.rng(i) for i in rows]
+        ids: np.ndarray = self.ids[rows]
+        centers: np.ndarray = self.centers[rows]
+        if str(kinds[0]) == "ellipsoid":
+            orientations: np.ndarray = self.orientations[rows]
+            rotated: bool = bool(np.any(orientations != [1.0, 0.0, 0.0, 0.0]))
+            populations: list[EllipsoidPopulation] = [
+                EllipsoidPopulation(
+                    self.params["density"],
+                    self.sizes[rows, :3],
+                    centers,
+                    orientations=orientations if rotated else None,
+                )
+            ]
+        else:
+            inner, outer = self.sizes[rows, 0], self.sizes[rows, 1]
+            # every core is drawn before the shells, as each particle's generator
+            # draws its core before its shell in write_particle
+            populations = [
+                EllipsoidPopulation(self.params["core_density"], inner, centers),
+                EllipsoidPopulation(
+                    self.params["shell_density"], outer, centers, inner, 2
+                ),
+            ]
+        for population in populations:
+            for indices in population.chunks():
+                points, owner = population.sample_chunk(
+                    indices, buffer.coord_dtype, rngs=[rngs[k] for k in indices]
+                )
+                buffer.append(points, population.types[owner], ids[owner])
+
+    def writers(self) -> list[Callable[[PointBuffer], None]]:
+        """
+        One writer per particle, e.g. for iter_batches
+
+        Returns
+        -------
+        list[Callable[[PointBuffer], None]]
+            Callables that each append the points of one particle
+        """
+        return [partial(self.write_particle, i=i) for i in range(len(self))]
+
+    def write(self, buffer: PointBuffer) -> None:
+        """
+        Regenerate the points of every particle
+
+        Parameters
+        ----------
+        buffer : PointBuffer
+            The buffer to append the points to
+        """
+        self.write_rows(buffer, np.arange(len(self)))
@@ -0,0 +1,228 @@
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from pathlib import Path
+from typing import Callable, ContextManager, Iterator
+import json
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+# Set to 1 to profile every builder, or to "memory" to also trace the allocations
+PROFILE_ENV: str = "SHAPES3D_PROFILE"
+
+# The stage of a disabled profiler, shared so that entering it allocates nothing
+_NO_STAGE: ContextManager[None] = nullcontext()
+
+
+def peak_rss_mb() -> float:
+    """The peak resident memory of this process so far, in MB, or nan if unknown"""
+    # resource is Unix only, so importing it here keeps the package usable on Windows
+    try:
+        import resource
+    except ModuleNotFoundError:
+        return float("nan")
+    peak: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KiB on Linux
+    return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+
+class Profile:
+    """
+    Timers, memory peaks and counters of the stages of one build
+
+    Stages nest: a stage entered inside another is reported as "outer/inner", and
+    its time and memory are part of the outer stage's as well. A stage entered more
+    than once (e.g. once per particle) adds up its calls and time.
+
+    Attributes
+    ----------
+    name : str
+        The name of the build, e.g. box_onions
+    memory : bool
+        Whether the allocations are traced with tracemalloc, which slows the build
+    stages : dict[str, dict]
+        The calls, seconds and memory of each stage
+    counters : dict[str, int]
+        The counters, e.g. ellipsoid.candidates
+    """
+
+    def __init__(self, name: str, memory: bool = False):
+        self.name: str = name
+        self.memory: bool = memory
+        self.stages: dict[str, dict] = {}
+        self.counters: defaultdict[str, int] = defaultdict(int)
+        self._path: list[str] = []
+        self._peaks: list[int] = []
+        self._start: float = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Time a stage, and measure the memory it takes"""
+        if self.memory:
+            # the peak is reset for the stage, so the stages outside keep theirs
+            peak: int = tracemalloc.get_traced_memory()[1]
+            self._peaks = [max(outer, peak) for outer in self._peaks]
+            tracemalloc.reset_peak()
+            self._peaks.append(0)
+            start_traced: int = tracemalloc.get_traced_memory()[0]
+        self._path.append(name)
+        path: str = "/".join(self._path)
+        start_rss: float = peak_rss_mb()
+        start: float = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds: float = time.perf_counter() - start
+            self._path.pop()
+            entry: dict = self.stages.setdefault(
+                path, {"calls": 0, "seconds": 0.0, "rss_growth_mb": 0.0}
+            )
+            entry["calls"] += 1
+            entry["seconds"] += seconds
+            entry["rss_growth_mb"] += peak_rss_mb() - start_rss
+            entry["rss_peak_mb"] = peak_rss_mb()
+            if self.memory:
+                own: int = max(self._peaks.pop(), tracemalloc.get_traced_memory()[1])
+                self._peaks = [max(outer, own) for outer in self._peaks]
+                entry["peak_alloc_mb"] = max(
+                    entry.get("peak_alloc_mb", 0.0), (own - start_traced) / 2**20
+                )
+
+    def count(self, name: str, amount: int = 1) -> None:
+        self.counters[name] += int(amount)
+
+    def report(self) -> dict:
+        """
+        The stages, the counters and the ratios derived from them
+
+        Every pair of counters "x.candidates" and "x.accepted" gives the fraction
+        "x.acceptance" of candidates accepted, and the candidates drawn per accepted
+        one, "x.candidates_per_accepted".
+
+        Returns
+        -------
+        dict
+            The report, ready for JSON
+        """
+        ratios: dict[str, float] = {}
+        for name, candidates in self.counters.items():
+            if not name.endswith(".candidates"):
+                continue
+            sampler: str = name.removesuffix(".candidates")
+            accepted: int = self.counters.get(f"{sampler}.accepted", 0)
+            if candidates > 0:
+                ratios[f"{sampler}.acceptance"] = accepted / candidates
+            if accepted > 0:
+                ratios[f"{sampler}.candidates_per_accepted"] = candidates / accepted
+        return {
+            "name": self.name,
+            "seconds": time.perf_counter() - self._start,
+            "rss_peak_mb": peak_rss_mb(),
+            "stages": self.stages,
+            "counters": dict(self.counters),
+            "ratios": ratios,
+        }
+
+    def save(self, filename: str) -> None:
+        """Write the report as JSON"""
+        Path(filename).parent.mkdir(parents=True, exist_ok=True)
+        with open(filename, "w") as f:
+            json.dump(self.report(), f, indent=2)
+        print("saved the profile to", filename)
+
+
+# The profile of the running build, None when profiling is off
+_active: Profile | None = None
+
+
+def profile_level() -> str | None:
+    """The value of SHAPES3D_PROFILE, or None when profiling is off"""
+    level: str = os.environ.get(PROFILE_ENV, "")
+    return None if level in ("", "0") else level
+
+
+def stage(name: str) -> ContextManager[None]:
+    """
+    Time a stage of the running build
+
+    With profiling off this returns a shared null context, so it costs about one
+    function call.
+
+    Parameters
+    ----------
+    name : str
+        The name of the stage, e.g. centers
+
+    Returns
+    -------
+    ContextManager[None]
+        The stage
+    """
+    if _active is None:
+        return _NO_STAGE
+    return _active.stage(name)
+
+
+def count(name: str, amount: int = 1) -> None:
+    """
+    Add to a counter of the running build, if it is profiled
+
+    Parameters
+    ----------
+    name : str
+        The name of the counter, e.g. ellipsoid.accepted
+    amount : int
+        The amount to add
+    """
+    if _active is not None:
+        _active.count(name, amount)
+
+
+def profiled(build: Callable[..., dict]) -> Callable[..., dict]:
+    """
+    Profile a builder when SHAPES3D_PROFILE is set
+
+    The report is written as {name}_profile.json next to the builder's output and
+    added to the files it returns. Particles generated on worker processes (workers
+    other than 1) are timed in their stage, but their counters are not collected.
+
+    Parameters
+    ----------
+    build : Callable[..., dict]
+        A builder, taking a config and a random generator
+
+    Returns
+    -------
+    Callable[..., dict]
+        The builder, profiled
+    """
+    name: str = build.__name__.removeprefix("build_")
+
+    @wraps(build)
+    def run(config: dict | None = None, rng: np.random.Generator | None = None) -> dict:
+        global _active
+        level: str | None = profile_level()
+        if level is None or _active is not None:
+            return build(config, rng)
+        memory: bool = level == "memory"
+        started: bool = memory and not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        _active = Profile(name, memory)
+        try:
+            result: dict = build(config, rng)
+        finally:
+            profile: Profile = _active
+            _active = None
+            if started:
+                tracemalloc.stop()
+        output_dir: str = (config or {}).get("output_dir", "out")
+        report: str = str(Path(output_dir) / f"{name}_profile.json")
+        profile.save(report)
+        result["files"] = result["files"] + [report]
+        return result
+
+    return run
@@ -0,0 +1,183 @@
+import numpy as np
+
+# The (w, x, y, z) quaternion of no rotation
+IDENTITY: np.ndarray = np.array([1.0, 0.0, 0.0, 0.0])
+# The orientational distributions draw_orientations knows
+ORIENTATIONS: tuple[str, ...] = ("fixed", "uniform", "aligned")
+# The most points rotate multiplies at once, which bounds the gathered matrices
+ROTATION_BLOCK: int = 2**16
+
+
+def rotation_matrices(quaternions: np.ndarray) -> np.ndarray:
+    """
+    The rotation matrices of (w, x, y, z) quaternions
+
+    Parameters
+    ----------
+    quaternions : np.ndarray
+        The unit quaternions, with shape (N, 4)
+
+    Returns
+    -------
+    np.ndarray
+        The matrices, with shape (N, 3, 3)
+    """
+    w, x, y, z = np.asarray(quaternions, dtype=float).reshape(-1, 4).T
+    return np.stack(
+        (
+            np.stack((1 - 2 * (y**2 + z**2), 2 * (x * y - z * w), 2 * (x * z + y * w))),
+            np.stack((2 * (x * y + z * w), 1 - 2 * (x**2 + z**2), 2 * (y * z - x * w))),
+            np.stack((2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x**2 + y**2))),
+        )
+    ).transpose(2, 0, 1)
+
+
+def polar_rotation(polar: float, azimuthal: float) -> np.ndarray:
+    """
+    The rotation by a polar angle about y, then by an azimuthal angle about z
+
+    It takes the z axis to the direction with these spherical angles.
+
+    Parameters
+    ----------
+    polar : float
+        The angle from the z axis
+    azimuthal : float
+        The angle about the z axis
+
+    Returns
+    -------
+    np.ndarray
+        The matrix, with shape (3, 3)
+    """
+    cos_p, sin_p = np.cos(polar), np.sin(polar)
+    cos_a, sin_a = np.cos(azimuthal), np.sin(azimuthal)
+    about_y: np.ndarray = np.array([[cos_p, 0, sin_p], [0, 1, 0], [-sin_p, 0, cos_p]])
+    about_z: np.ndarray = np.array([[cos_a, -sin_a, 0], [sin_a, cos_a, 0], [0, 0, 1]])
+    return about_z @ about_y
+
+
+def random_quaternions(num: int, rng: np.random.Generator | None = None) -> np.ndarray:
+    """
+    Draw uniformly random orientations, with Shoemake's method
+
+    Parameters
+    ----------
+    num : int
+        The number of orientations
+    rng : np.random.Generator | None
+        The random generator to sample with. Defaults to the global np.random state
+
+    Returns
+    -------
+    np.ndarray
+        The (w, x, y, z) unit quaternions, with shape (num, 4)
+    """
+    random = np.random if rng is None else rng
+    u: np.ndarray = random.uniform(0, 1, size=(num, 3))
+    low, high = np.sqrt(1 - u[:, 0]), np.sqrt(u[:, 0])
+    first, second = 2 * np.pi * u[:, 1], 2 * np.pi * u[:, 2]
+    return np.column_stack(
+        (
+            low * np.sin(first),
+            low * np.cos(first),
+            high * np.sin(second),
+            high * np.cos(second),
+        )
+    )
+
+
+def draw_orientations(
+    num: int,
+    distribution: str = "uniform",
+    spread: float = 0.0,
+    rng: np.random.Generator | None = None,
+) -> np.ndarray:
+    """
+    Draw the orientations of a population at once
+
+    Parameters
+    ----------
+    num : int
+        The number of particles
+    distribution : str
+        "fixed" keeps every particle along the axes, "uniform" is isotropic and
+        "aligned" turns each particle about a random axis by a normal angle
+    spread : float
+        The standard deviation of the angle of "aligned", in radians
+    rng : np.random.Generator | None
+        The random generator to sample with. Defaults to the global np.random state
+
+    Returns
+    -------
+    np.ndarray
+        The (w, x, y, z) unit quaternions, with shape (num, 4)
+    """
+    assert distribution in ORIENTATIONS, f"unknown orientations {distribution}"
+    if distribution == "fixed":
+        return np.tile(IDENTITY, (num, 1))
+    if distribution == "uniform":
+        return random_quaternions(num, rng)
+    random = np.random if rng is None else rng
+    axis: np.ndarray = random.normal(size=(num, 3))
+    axis /= np.linalg.norm(axis, axis=1, keepdims=True)
+    angle: np.ndarray = spread * random.normal(size=num)
+    return np.column_stack((np.cos(angle / 2), np.sin(angle / 2)[:, None] * axis))
+
+
+def rotate(
+    points: np.ndarray, rotations: np.ndarray, owner: np.ndarray | None = None
+) -> np.ndarray:
+    """
+    Rotate points by the matrix of the particle each belongs to
+
+    Parameters
+    ----------
+    points : np.ndarray
+        The points relative to their particle's center, with shape (n, 3)
+    rotations : np.ndarray
+        The matrix of each particle, with shape (N, 3, 3), or one matrix
+    owner : np.ndarray | None
+        The particle of each point, with shape (n,). None for one matrix
+
+    Returns
+    -------
+    np.ndarray
+        The rotated points, with the dtype of points
+    """
+    if owner is None:
+        return (points @ rotations.T).astype(points.dtype, copy=False)
+    rotated: np.ndarray = np.empty_like(points)
+    for start in range(0, points.shape[0], ROTATION_BLOCK):
+        rows: slice = slice(start, start + ROTATION_BLOCK)
+        rotated[rows] = np.einsum("nij,nj->ni", rotations[owner[rows]], points[rows])
+    return rotated
+
+
+def to_body(
+    points: np.ndarray,
+    center: np.ndarray | None = None,
+    rotation: np.ndarray | None = None,
+) -> np.ndarray:
+    """
+    Take world coordinates into the frame of a particle
+
+    Parameters
+    ----------
+    points : np.ndarray
+        The points, with shape (n, 3)
+    center : np.ndarray | None
+        The center of the particle. None for the origin
+    rotation : np.ndarray | None
+        The rotation matrix of the particle, with shape (3, 3). None for none
+
+    Returns
+    -------
+    np.ndarray
+        The points relative to the center, along the axes of the particle
+    """
+    body: np.ndarray = np.asarray(points, dtype=float)
+    if center is not None:
+        body = body - np.asarray(center, dtype=float)
+    # rows of points, so x R is R^T applied to each of them
+    return body if rotation is None else body @ rotation
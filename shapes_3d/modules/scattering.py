@@ -0,0 +1,478 @@
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+import os
+import numpy as np
+from .buffer import PointBuffer
+
+# scipy is imported where the trees are built, so that importing this module stays fast
+
+# The number of points of each of the two chunks whose pairs one task counts
+PAIR_CHUNK: int = 2**12
+# The number of points put onto a density grid at once
+DEPOSIT_CHUNK: int = 2**18
+# The grid nodes a point is spread over along each axis, by assignment scheme
+ASSIGNMENT_ORDERS: dict[str, int] = {"ngp": 1, "cic": 2, "tsc": 3}
+
+# The points of each type in the worker process, sent once when the worker starts
+_points: dict[int, np.ndarray] = {}
+_box_length: float | None = None
+
+
+def contrast_weights(
+    types: np.ndarray,
+    sld: dict[int, float],
+    density: dict[int, float] | None = None,
+    solvent: float = 0.0,
+) -> np.ndarray:
+    """
+    The scattering length of a point of each type
+
+    A point of a region sampled at a density stands for a volume of 1 / density, so
+    it scatters with the contrast of the region times that volume.
+
+    Parameters
+    ----------
+    types : np.ndarray
+        The type ids
+    sld : dict[int, float]
+        The scattering length density of each type
+    density : dict[int, float] | None
+        The density each type was sampled at. None gives every point the contrast
+        of its type as its scattering length
+    solvent : float
+        The scattering length density of the solvent
+
+    Returns
+    -------
+    np.ndarray
+        The scattering length of a point of each of the types
+    """
+    assert all(t in sld for t in types), f"sld is missing a type of {list(types)}"
+    contrast: np.ndarray = np.array([sld[t] - solvent for t in types], dtype=float)
+    if density is None:
+        return contrast
+    return contrast / np.array([density[t] for t in types], dtype=float)
+
+
+def _init_worker(points: dict[int, np.ndarray], box_length: float | None) -> None:
+    """Keep the points of each type in the worker, so a task only sends its rows"""
+    global _points, _box_length
+    _points, _box_length = points, box_length
+
+
+def _count_chunks(
+    first: int, rows: slice, second: int, columns: slice, edges: np.ndarray
+) -> tuple[int, int, np.ndarray]:
+    """Count the pairs of a chunk of one type's points with a chunk of another's"""
+    from scipy.spatial import cKDTree
+
+    tree = cKDTree(_points[first][rows], boxsize=_box_length)
+    other = cKDTree(_points[second][columns], boxsize=_box_length)
+    counts: np.ndarray = tree.count_neighbors(other, edges, cumulative=False)
+    # a pair of two different chunks of one type also stands for its mirror
+    mirrored: bool = first == second and rows != columns
+    return first, second, np.asarray(counts, dtype=np.int64) * (2 if mirrored else 1)
+
+
+class PairHistogram:
+    """
+    The histogram of the distances between every pair of points, by type
+
+    The pairs are ordered, so each pair of two points is counted twice, and the
+    first bin holds the pairs at distance 0, including every point with itself.
+    Once built, the intensity of any q grid and any contrast is a sum over the bins,
+    without pairing the points again.
+
+    Attributes
+    ----------
+    edges : np.ndarray
+        The upper edge of each bin, starting with 0 for the pairs at distance 0
+    types : np.ndarray
+        The type ids, in the order of the counts
+    counts : np.ndarray
+        The number of pairs of each two types in each bin, with shape (T, T, bins)
+    box_length : float | None
+        The length of the periodic box the distances were taken in, if any
+    """
+
+    def __init__(
+        self,
+        edges: np.ndarray,
+        types: np.ndarray,
+        counts: np.ndarray,
+        box_length: float | None = None,
+    ):
+        self.edges: np.ndarray = np.asarray(edges, dtype=float)
+        self.types: np.ndarray = np.asarray(types, dtype=int)
+        self.counts: np.ndarray = np.asarray(counts, dtype=np.int64)
+        self.box_length: float | None = box_length
+
+    @classmethod
+    def from_points(
+        cls,
+        points: PointBuffer,
+        bin_width: float,
+        max_distance: float | None = None,
+        box_length: float | None = None,
+        workers: int | None = 1,
+        chunk_size: int = PAIR_CHUNK,
+    ) -> "PairHistogram":
+        """
+        Count the pairs of points with k-d trees, in chunks and across processes
+
+        Parameters
+        ----------
+        points : PointBuffer
+            The points and their types
+        bin_width : float
+            The width of the bins. The intensity is accurate for q well below
+            1 / bin_width
+        max_distance : float | None
+            The largest distance counted. Defaults to the diagonal of the points'
+            bounding box, or half the box length in a periodic box
+        box_length : float | None
+            The length of the box, centered on the origin, to take the distances in
+            with periodic images (the "pp pp pp" of save_dump). None takes them as
+            they are
+        workers : int | None
+            The number of worker processes. 1 counts in this process, None uses
+            every CPU
+        chunk_size : int
+            The number of points of each of the two chunks whose pairs one task
+            counts
+
+        Returns
+        -------
+        PairHistogram
+            The histogram
+        """
+        xyz: np.ndarray = np.asarray(points.xyz, dtype=float)
+        if box_length is not None:
+            # the periodic trees want the coordinates in [0, box_length)
+            xyz = np.mod(xyz + box_length / 2, box_length)
+        if max_distance is None and box_length is not None:
+            max_distance = box_length / 2
+        elif max_distance is None:
+            span: np.ndarray = np.ptp(xyz, axis=0) if len(xyz) else np.zeros(3)
+            max_distance = float(np.linalg.norm(span))
+        num_bins: int = max(int(np.ceil(max_distance / bin_width)), 1)
+        edges: np.ndarray = np.arange(num_bins + 1) * bin_width
+        types: np.ndarray = np.unique(points.types).astype(int)
+        by_type: dict[int, np.ndarray] = {t: xyz[points.types == t] for t in types}
+        index: dict[int, int] = {t: i for i, t in enumerate(types)}
+        counts: np.ndarray = np.zeros((len(types), len(types), num_bins + 1), np.int64)
+
+        # the pairs of two types, and of two chunks of a type, are counted once
+        chunks: dict[int, list[slice]] = {
+            t: [
+                slice(start, start + chunk_size)
+                for start in range(0, by_type[t].shape[0], chunk_size)
+            ]
+            for t in types
+        }
+        tasks: list[tuple[int, slice, int, slice]] = [
+            (first, rows, second, columns)
+            for first in types
+            for second in types[types >= first]
+            for i, rows in enumerate(chunks[first])
+            for columns in chunks[second][i if first == second else 0 :]
+        ]
+
+        def add(first: int, second: int, pairs: np.ndarray) -> None:
+            counts[index[first], index[second]] += pairs
+
+        workers = workers or os.cpu_count() or 1
+        if workers == 1:
+            _init_worker(by_type, box_length)
+            try:
+                for task in tasks:
+                    add(*_count_chunks(*task, edges))
+            finally:
+                _init_worker({}, None)
+        else:
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_worker,
+                initargs=(by_type, box_length),
+            ) as executor:
+                pending: deque[Future] = deque()
+                for task in tasks:
+                    pending.append(executor.submit(_count_chunks, *task, edges))
+                    if len(pending) >= 2 * workers:
+                        add(*pending.popleft().result())
+                while pending:
+                    add(*pending.popleft().result())
+        upper: tuple[np.ndarray, np.ndarray] = np.triu_indices(len(types), 1)
+        counts[upper[1], upper[0]] = counts[upper]
+        return cls(edges, types, counts, box_length)
+
+    @property
+    def distances(self) -> np.ndarray:
+        """The distance of each bin: 0, then the middle of each bin"""
+        return np.append(0.0, (self.edges[1:] + self.edges[:-1]) / 2)
+
+    def weighted_counts(self, weights: np.ndarray) -> np.ndarray:
+        """
+        The pairs of each bin, weighted by the scattering lengths of their points
+
+        Parameters
+        ----------
+        weights : np.ndarray
+            The scattering length of a point of each type, in the order of types
+
+        Returns
+        -------
+        np.ndarray
+            The weighted pairs of each bin
+        """
+        return np.einsum("a,b,abk->k", weights, weights, self.counts)
+
+    def intensity(
+        self,
+        q: np.ndarray,
+        sld: dict[int, float],
+        density: dict[int, float] | None = None,
+        solvent: float = 0.0,
+    ) -> np.ndarray:
+        """
+        The Debye intensity of the points, summed over the bins
+
+        I(q) is the sum over the pairs of b_i b_j sin(q r_ij) / (q r_ij), with the
+        distance of every pair taken as the middle of its bin.
+
+        Parameters
+        ----------
+        q : np.ndarray
+            The magnitudes of the scattering vector
+        sld : dict[int, float]
+            The scattering length density of each type
+        density : dict[int, float] | None
+            The density each type was sampled at, see contrast_weights
+        solvent : float
+            The scattering length density of the solvent
+
+        Returns
+        -------
+        np.ndarray
+            The intensity at each q
+        """
+        weighted: np.ndarray = self.weighted_counts(
+            contrast_weights(self.types, sld, density, solvent)
+        )
+        # np.sinc(x) is sin(pi x) / (pi x)
+        qr: np.ndarray = np.outer(np.asarray(q, dtype=float), self.distances)
+        return np.sinc(qr / np.pi) @ weighted
+
+    def save(self, filename: str) -> None:
+        """Save the histogram as a .npz file"""
+        np.savez(
+            filename,
+            edges=self.edges,
+            types=self.types,
+            counts=self.counts,
+            box_length=np.nan if self.box_length is None else self.box_length,
+        )
+
+    @classmethod
+    def load(cls, filename: str) -> "PairHistogram":
+        """Load a histogram written by save"""
+        with np.load(filename) as data:
+            box_length: float = float(data["box_length"])
+            return cls(
+                data["edges"],
+                data["types"],
+                data["counts"],
+                None if np.isnan(box_length) else box_length,
+            )
+
+
+def _assignment(u: np.ndarray, order: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    The grid nodes a coordinate is spread over, and their weights
+
+    Parameters
+    ----------
+    u : np.ndarray
+        The coordinates along one axis, in units of the grid spacing
+    order : int
+        1 for nearest grid point, 2 for cloud-in-cell, 3 for triangular-shaped cloud
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        The nodes (not yet wrapped) and the weights, each with shape (n, order)
+    """
+    if order == 2:
+        first: np.ndarray = np.floor(u)
+        d: np.ndarray = u - first
+        weights: np.ndarray = np.column_stack((1 - d, d))
+    else:
+        first = np.rint(u) - (order // 2)
+        d = u - np.rint(u)
+        if order == 1:
+            weights = np.ones((u.shape[0], 1))
+        else:
+            weights = np.column_stack(
+                (0.5 * (0.5 - d) ** 2, 0.75 - d**2, 0.5 * (0.5 + d) ** 2)
+            )
+    nodes: np.ndarray = first.astype(np.int64)[:, None] + np.arange(order)
+    return nodes, weights
+
+
+def deposit(
+    points: PointBuffer,
+    box_length: float,
+    grid_size: int,
+    weights: dict[int, float],
+    assignment: str = "cic",
+) -> np.ndarray:
+    """
+    Spread the weighted points of a periodic box onto a grid
+
+    Parameters
+    ----------
+    points : PointBuffer
+        The points and their types, in the box centered on the origin
+    box_length : float
+        The length of the periodic box
+    grid_size : int
+        The number of grid nodes along each axis
+    weights : dict[int, float]
+        The weight of a point of each type, e.g. its scattering length
+    assignment : str
+        The assignment scheme: "ngp", "cic" or "tsc"
+
+    Returns
+    -------
+    np.ndarray
+        The sum of the weights spread onto each node, with shape (n, n, n)
+    """
+    order: int = ASSIGNMENT_ORDERS[assignment]
+    lookup: np.ndarray = np.zeros(
+        max(max(weights), int(np.max(points.types, initial=0))) + 1
+    )
+    for t, weight in weights.items():
+        lookup[t] = weight
+    grid: np.ndarray = np.zeros(grid_size**3)
+    spacing: float = box_length / grid_size
+    for start in range(0, len(points), DEPOSIT_CHUNK):
+        xyz: np.ndarray = np.asarray(
+            points.xyz[start : start + DEPOSIT_CHUNK], dtype=float
+        )
+        point_weights: np.ndarray = lookup[points.types[start : start + DEPOSIT_CHUNK]]
+        u: np.ndarray = (xyz + box_length / 2) / spacing
+        (x, wx), (y, wy), (z, wz) = (_assignment(u[:, i], order) for i in range(3))
+        x, y, z = x % grid_size, y % grid_size, z % grid_size
+        # every combination of the nodes along the three axes
+        flat: np.ndarray = (
+            x[:, :, None, None] * grid_size + y[:, None, :, None]
+        ) * grid_size + z[:, None, None, :]
+        spread: np.ndarray = (
+            point_weights[:, None, None, None]
+            * wx[:, :, None, None]
+            * wy[:, None, :, None]
+            * wz[:, None, None, :]
+        )
+        np.add.at(grid, flat.ravel(), spread.ravel())
+    return grid.reshape(grid_size, grid_size, grid_size)
+
+
+def fft_intensity(
+    points: PointBuffer,
+    box_length: float,
+    grid_size: int,
+    sld: dict[int, float],
+    density: dict[int, float] | None = None,
+    solvent: float = 0.0,
+    assignment: str = "cic",
+    q_edges: np.ndarray | None = None,
+    structure_factor: bool = False,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    The intensity of a periodic box, from the FFT of its points put onto a grid
+
+    The points are spread onto the grid with their scattering lengths, the grid is
+    Fourier transformed, |F(k)|^2 is divided by the squared window of the
+    assignment, and the modes are averaged in shells of |k|. The box is periodic,
+    like the "pp pp pp" of save_dump, so only the multiples of 2 pi / box_length
+    are resolved. Above about half the Nyquist wavenumber pi * grid_size /
+    box_length the result is aliased.
+
+    Parameters
+    ----------
+    points : PointBuffer
+        The points and their types, in the box centered on the origin
+    box_length : float
+        The length of the periodic box
+    grid_size : int
+        The number of grid nodes along each axis
+    sld : dict[int, float]
+        The scattering length density of each type
+    density : dict[int, float] | None
+        The density each type was sampled at, see contrast_weights
+    solvent : float
+        The scattering length density of the solvent
+    assignment : str
+        The assignment scheme: "ngp", "cic" or "tsc"
+    q_edges : np.ndarray | None
+        The edges of the shells of |k|. Defaults to shells one 2 pi / box_length
+        wide around each multiple of it, up to the Nyquist wavenumber
+    structure_factor : bool
+        Whether to divide the intensity by the sum of the squared scattering
+        lengths, giving S(q), which tends to 1 for uncorrelated points
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        The mean |k| of the modes of each shell, and the intensity (or S(q)) of each
+        shell. Empty shells are dropped
+    """
+    types: np.ndarray = np.unique(points.types).astype(int)
+    lengths: np.ndarray = contrast_weights(types, sld, density, solvent)
+    grid: np.ndarray = deposit(
+        points, box_length, grid_size, dict(zip(types, lengths)), assignment
+    )
+    spectrum: np.ndarray = np.fft.rfftn(grid)
+    del grid
+
+    spacing: float = box_length / grid_size
+    k: np.ndarray = 2 * np.pi * np.fft.fftfreq(grid_size, spacing)
+    kz: np.ndarray = 2 * np.pi * np.fft.rfftfreq(grid_size, spacing)
+    # np.sinc(x) is sin(pi x) / (pi x); one axis's window is sinc(k H / 2)^order
+    order: int = ASSIGNMENT_ORDERS[assignment]
+    window: np.ndarray = np.sinc(k * spacing / (2 * np.pi)) ** (2 * order)
+    window_z: np.ndarray = np.sinc(kz * spacing / (2 * np.pi)) ** (2 * order)
+    # the half spectrum of rfftn stands for the other half as well
+    multiplicity: np.ndarray = np.full(kz.shape[0], 2.0)
+    multiplicity[0] = 1
+    if grid_size % 2 == 0:
+        multiplicity[-1] = 1
+
+    if q_edges is None:
+        q_edges = (np.arange(grid_size // 2 + 1) + 0.5) * (2 * np.pi / box_length)
+    bins: int = len(q_edges) + 1
+    modes: np.ndarray = np.zeros(bins)
+    q_sum: np.ndarray = np.zeros(bins)
+    intensity: np.ndarray = np.zeros(bins)
+    # one plane of the spectrum at a time, so the temporaries stay small
+    for i in range(grid_size):
+        plane: np.ndarray = np.abs(spectrum[i]) ** 2 / (
+            window[i] * window[:, None] * window_z[None, :]
+        )
+        magnitude: np.ndarray = np.sqrt(
+            k[i] ** 2 + k[:, None] ** 2 + kz[None, :] ** 2
+        ).ravel()
+        weight: np.ndarray = np.broadcast_to(multiplicity, plane.shape).ravel()
+        shell: np.ndarray = np.digitize(magnitude, q_edges)
+        modes += np.bincount(shell, weight, bins)
+        q_sum += np.bincount(shell, weight * magnitude, bins)
+        intensity += np.bincount(shell, weight * plane.ravel(), bins)
+    # the first and last bins hold the modes below and above the edges
+    keep: np.ndarray = modes > 0
+    keep[[0, -1]] = False
+    q: np.ndarray = q_sum[keep] / modes[keep]
+    intensity = intensity[keep] / modes[keep]
+    if structure_factor:
+        counts: np.ndarray = np.array([np.sum(points.types == t) for t in types])
+        intensity /= np.sum(counts * lengths**2)
+    return q, intensity
@@ -0,0 +1,188 @@
+from typing import Callable
+import numpy as np
+from .profiling import count
+
+# The number of particles drawn in the first batch, before the mean volume is known
+FIRST_BATCH: int = 1024
+# The most particles drawn in one batch, which bounds the memory of a batch
+MAX_BATCH: int = 2**20
+
+
+def lognormal_parameters(
+    mean: np.ndarray | float, std: np.ndarray | float
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    The parameters of the lognormal distribution with a given mean and deviation
+
+    Parameters
+    ----------
+    mean : np.ndarray | float
+        The mean of the sizes
+    std : np.ndarray | float
+        The standard deviation of the sizes
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        The mean and the standard deviation of the logarithm of the sizes
+    """
+    mean = np.asarray(mean, dtype=float)
+    std = np.asarray(std, dtype=float)
+    log_std: np.ndarray = np.sqrt(np.log(1 + (std / mean) ** 2))
+    return np.log(mean) - log_std**2 / 2, log_std
+
+
+def draw_lognormal(
+    random: np.random.Generator,
+    mean: np.ndarray | float,
+    std: np.ndarray | float,
+    num: int,
+    maximum: float | None = None,
+) -> np.ndarray:
+    """
+    Draw lognormal sizes (or angles) of a batch of particles
+
+    Parameters
+    ----------
+    random : np.random.Generator
+        The random generator, or the np.random module
+    mean : np.ndarray | float
+        The mean of each size, with any shape S
+    std : np.ndarray | float
+        The standard deviation of each size, with the shape of mean
+    num : int
+        The number of particles
+    maximum : float | None
+        Clip the draws to this value, e.g. pi / 2 for an angle
+
+    Returns
+    -------
+    np.ndarray
+        The sizes, with shape (num, *S)
+    """
+    log_mean, log_std = lognormal_parameters(mean, std)
+    drawn: np.ndarray = random.lognormal(log_mean, log_std, (num,) + log_mean.shape)
+    return drawn if maximum is None else np.minimum(drawn, maximum)
+
+
+def fill_volume(
+    draw: Callable[[np.random.Generator, int], np.ndarray],
+    volume: Callable[[np.ndarray], np.ndarray],
+    target: float,
+    rng: np.random.Generator | None = None,
+) -> np.ndarray:
+    """
+    Draw particles in batches until their total volume reaches a target
+
+    The particles are kept in the order they are drawn, up to the last one whose
+    cumulative volume is still at most the target. Each batch is sized from the mean
+    volume drawn so far to about fill what is left, so a box takes a few batches.
+
+    Parameters
+    ----------
+    draw : Callable[[np.random.Generator, int], np.ndarray]
+        Draws the sizes of a number of particles, with shape (num, ...)
+    volume : Callable[[np.ndarray], np.ndarray]
+        The volume of each particle of a batch, with shape (num,)
+    target : float
+        The total volume to fill
+    rng : np.random.Generator | None
+        The random generator to sample with. Defaults to the global np.random state
+
+    Returns
+    -------
+    np.ndarray
+        The sizes of the particles, with shape (N, ...)
+    """
+    random = np.random if rng is None else rng
+    batches: list[np.ndarray] = []
+    total: float = 0.0
+    num: int = FIRST_BATCH
+    drawn: int = 0
+    drawn_volume: float = 0.0
+    while True:
+        sizes: np.ndarray = draw(random, num)
+        volumes: np.ndarray = volume(sizes)
+        cumulative: np.ndarray = total + np.cumsum(volumes)
+        kept: int = int(np.searchsorted(cumulative, target, side="right"))
+        batches.append(sizes[:kept])
+        count("sizes.candidates", num)
+        count("sizes.accepted", kept)
+        if kept < num:
+            break
+        total = float(cumulative[-1])
+        drawn += num
+        drawn_volume += float(np.sum(volumes))
+        # enough for the rest at the mean volume so far, with some to spare
+        num = int(np.clip(1.1 * (target - total) * drawn / drawn_volume, 64, MAX_BATCH))
+    return np.concatenate(batches)
+
+
+def fill_shells(
+    thickness_mean: np.ndarray,
+    thickness_std: np.ndarray,
+    target: float,
+    rng: np.random.Generator | None = None,
+) -> np.ndarray:
+    """
+    Draw the shell thicknesses of spheres until their volume reaches a target
+
+    Every shell is lognormal on its own, and a sphere takes the volume of the ball
+    of its total radius.
+
+    Parameters
+    ----------
+    thickness_mean : np.ndarray
+        The mean thickness of each shell, from the inside out, with shape (K,)
+    thickness_std : np.ndarray
+        The standard deviation of each shell's thickness, with shape (K,)
+    target : float
+        The total volume to fill
+    rng : np.random.Generator | None
+        The random generator to sample with. Defaults to the global np.random state
+
+    Returns
+    -------
+    np.ndarray
+        The thickness of each shell of each sphere, with shape (N, K)
+    """
+    thickness_mean = np.asarray(thickness_mean, dtype=float)
+    return fill_volume(
+        lambda random, num: draw_lognormal(random, thickness_mean, thickness_std, num),
+        lambda radii: (4 / 3) * np.pi * np.sum(radii, axis=1) ** 3,
+        target,
+        rng,
+    ).reshape(-1, thickness_mean.shape[0])
+
+
+def fill_axes(
+    axis_mean: np.ndarray,
+    axis_std: np.ndarray,
+    target: float,
+    rng: np.random.Generator | None = None,
+) -> np.ndarray:
+    """
+    Draw the semi-axes of ellipsoids until their volume reaches a target
+
+    Parameters
+    ----------
+    axis_mean : np.ndarray
+        The mean x, y and z semi-axis
+    axis_std : np.ndarray
+        The standard deviation of each semi-axis
+    target : float
+        The total volume to fill
+    rng : np.random.Generator | None
+        The random generator to sample with. Defaults to the global np.random state
+
+    Returns
+    -------
+    np.ndarray
+        The semi-axes of each ellipsoid, with shape (N, 3)
+    """
+    return fill_volume(
+        lambda random, num: draw_lognormal(random, axis_mean, axis_std, num),
+        lambda axes: (4 / 3) * np.pi * np.prod(axes, axis=1),
+        target,
+        rng,
+    ).reshape(-1, 3)
@@ -1,8 +1,10 @@
-from pathlib import Path
 import time
 import numpy as np
 import sys
 import collections
+from .buffer import PointBuffer
+from .dump import dump_header, open_dump, write_atoms
+from .profiling import count, stage
 
 
 def relax_network_positions_alt(
@@ -16,7 +18,9 @@ def relax_network_positions_alt(
     learning_rate: float = 0.05,
     repulsion_strength: float = 2.5,
     force_stop_threshold: float = 1e-6,
+    rng: np.random.Generator | None = None,
 ) -> np.ndarray:
+    random = np.random if rng is None else rng
     positions = np.copy(initial_positions)
     num_nodes = len(positions)
 
@@ -29,16 +33,16 @@ def relax_network_positions_alt(
         for n in range(num_nodes):
             displacement = np.zeros(3)
             position = positions[n]
-            for i in range(3):
-                coord = position[i]
-                if coord > box_length / 2 - node_radii[i]:
-                    displacement[i] = coord - box_length / 2 + node_radii[i]
-                elif coord < -box_length / 2 + node_radii[i]:
-                    displacement[i] = box_length / 2 + coord - node_radii[i]
+            for axis in range(3):
+                coord = position[axis]
+                if coord > box_length / 2 - node_radii[axis]:
+                    displacement[axis] = coord - box_length / 2 + node_radii[axis]
+                elif coord < -box_length / 2 + node_radii[axis]:
+                    displacement[axis] = box_length / 2 + coord - node_radii[axis]
             dist = np.linalg.norm(displacement)
             if dist < 1e-6:
                 dist = 1e-6
-                displacement = np.random.rand(3) * 1e-6
+                displacement = random.random(3) * 1e-6
             direction = displacement / dist
             repulsion = learning_rate * repulsion_strength * displacement * direction
             forces[n] -= repulsion
@@ -51,7 +55,7 @@ def relax_network_positions_alt(
                 dist = np.linalg.norm(vec)
                 if dist < 1e-6:
                     dist = 1e-6
-                    vec = np.random.rand(3) * 1e-6
+                    vec = random.random(3) * 1e-6
                 if dist < min_dist:
                     overlap = min_dist - dist
                     direction = vec / dist
@@ -76,7 +80,7 @@ def relax_network_positions_alt(
                     direction = (
                         (positions[node_k] - closest_pt) / dist
                         if dist > 1e-6
-                        else np.random.rand(3)
+                        else random.random(3)
                     )
                     force_on_node = (
                         learning_rate * repulsion_strength * overlap * direction
@@ -111,7 +115,7 @@ def relax_network_positions_alt(
                     overlap = min_branch_dist - dist
                     if dist < 1e-6:
                         dist = 1e-6
-                        direction = np.random.rand(3)
+                        direction = random.random(3)
                     else:
                         direction = (closest_p1 - closest_p2) / dist
 
@@ -160,6 +164,7 @@ def relax_network_positions_alt(
             )
 
     print("\nRelaxation complete.")
+    count("relax.iterations", i + 1 if iterations > 0 else 0)
     return positions
 
 
@@ -173,7 +178,9 @@ def relax_network_positions(
     learning_rate: float = 0.05,
     repulsion_strength: float = 2.5,
     force_stop_threshold: float = 1e-5,
+    rng: np.random.Generator | None = None,
 ) -> np.ndarray:
+    random = np.random if rng is None else rng
     positions = np.copy(initial_positions)
     num_nodes = len(positions)
 
@@ -194,7 +201,7 @@ def relax_network_positions(
             # otherwise it will explode
             if dist < 1e-6:
                 dist = 1e-6
-                vec = np.random.rand(3) * 1e-6
+                vec = random.random(3) * 1e-6
 
             error = dist - target_length
             direction = vec / dist
@@ -213,7 +220,7 @@ def relax_network_positions(
                 dist = np.linalg.norm(vec)
                 if dist < 1e-6:
                     dist = 1e-6
-                    vec = np.random.rand(3) * 1e-6
+                    vec = random.random(3) * 1e-6
                 if dist < min_dist:
                     overlap = min_dist - dist
                     direction = vec / dist
@@ -238,7 +245,7 @@ def relax_network_positions(
                     direction = (
                         (positions[node_k] - closest_pt) / dist
                         if dist > 1e-6
-                        else np.random.rand(3)
+                        else random.random(3)
                     )
                     force_on_node = (
                         learning_rate * repulsion_strength * overlap * direction
@@ -273,7 +280,7 @@ def relax_network_positions(
                     overlap = min_branch_dist - dist
                     if dist < 1e-6:
                         dist = 1e-6
-                        direction = np.random.rand(3)
+                        direction = random.random(3)
                     else:
                         direction = (closest_p1 - closest_p2) / dist
 
@@ -322,6 +329,7 @@ def relax_network_positions(
             )
 
     print("\nRelaxation complete.")
+    count("relax.iterations", i + 1 if iterations > 0 else 0)
     return positions
 
 
@@ -440,7 +448,11 @@ def point_segment_distance(
 
 
 def make_centers(
-    num_pts: int, min_pt: float, max_pt: float, min_dist: float
+    num_pts: int,
+    min_pt: float,
+    max_pt: float,
+    min_dist: float,
+    rng: np.random.Generator | None = None,
 ) -> np.ndarray:
     """
     Generate random points in 3D space such that no two points are closer than min_dist.
@@ -455,16 +467,21 @@ def make_centers(
         The maximum coordinate value for each point.
     min_L : float
         The minimum distance between any two points.
+    rng : np.random.Generator | None
+        The random generator to sample with. Defaults to the global np.random state
 
     Returns
     -------
     np.ndarray
         A array of shape (N, 3), each representing an (x, y, z) center
     """
+    random = np.random if rng is None else rng
     points: np.ndarray = np.zeros((num_pts, 3))
     current_num_of_pts: int = 0
+    attempts: int = 0
     while current_num_of_pts < num_pts:
-        random_radius: np.ndarray = np.random.uniform(min_pt, max_pt, 3)
+        attempts += 1
+        random_radius: np.ndarray = random.uniform(min_pt, max_pt, 3)
         point_within_distance = True
         for pt in points:
             if np.linalg.norm(random_radius - pt) <= min_dist:
@@ -476,11 +493,17 @@ def make_centers(
             print(f"\rcenter {current_num_of_pts} out of {num_pts}", end="")
             sys.stdout.flush()
 
+    count("centers.candidates", attempts)
+    count("centers.accepted", num_pts)
     return points
 
 
 def make_centers_iter(
-    num_pts: int, min_pt: float, max_pt: float, min_dist: np.ndarray
+    num_pts: int,
+    min_pt: float,
+    max_pt: float,
+    min_dist: np.ndarray,
+    rng: np.random.Generator | None = None,
 ) -> np.ndarray:
     """
     Iteratively generate random points in 3D space such that no two points are closer than their corresponding min_dist.
@@ -495,17 +518,21 @@ def make_centers_iter(
         The maximum bound for each point.
     min_dist: np.ndarray
         The minimum distance (outward radius) for each point
+    rng : np.random.Generator | None
+        The random generator to sample with. Defaults to the global np.random state
 
     Returns
     -------
     np.ndarray
         A array of shape (N, 3), each representing an (x, y, z) center
     """
-
+    random = np.random if rng is None else rng
     points: np.ndarray = np.zeros((num_pts, 3))
     i: int = 0
+    attempts: int = 0
     while i < num_pts:
-        random_radius: np.ndarray = np.random.uniform(
+        attempts += 1
+        random_radius: np.ndarray = random.uniform(
             min_pt + min_dist[i], max_pt - min_dist[i], 3
         )
         point_within_distance = True
@@ -519,50 +546,60 @@ def make_centers_iter(
             print(f"\rcenter {i} out of {num_pts}", end="")
             sys.stdout.flush()
 
+    count("centers.candidates", attempts)
+    count("centers.accepted", num_pts)
     return points
 
 
-def save_dump(points, filename: str, box_len: float):
+def save_dump(
+    points: list[np.ndarray] | PointBuffer,
+    filename: str,
+    box_len: float,
+    compression: str | None = None,
+):
     """
     Save coordinates to a dump file, for use with OVITO.
 
     Parameters
     ----------
-    points : list of np.ndarray
+    points : list of np.ndarray | PointBuffer
         A list of 2D arrays, where each array contains points with their coordinates
-        (x, y, z), or (x, y, z, t)
+        (x, y, z), or (x, y, z, t). Any columns after t (e.g. particle ids) are ignored.
+        A PointBuffer is written with its own types and ids running from 1
     filename : str
         The name of the file to save the coordinates.
     box_len : float
         The length of the simulation box for the points.
+    compression : str | None
+        "gzip", "zstd" or "none". Defaults to what the file name implies, so
+        a name ending in .dump.gz is written gzip-compressed
 
     Returns
     -------
     None
         The function just writes to a file
     """
-    print("dumping...")
-    num: float = sum(pt.shape[0] for pt in points)
-    Path(filename).parent.mkdir(parents=True, exist_ok=True)
-    with open(filename, "w") as f:
-        f.write("ITEM: TIMESTEP\n0\n")
-        f.write(f"ITEM: NUMBER OF ATOMS\n{num}\n")
-        f.write(
-            f"ITEM: BOX BOUNDS pp pp pp\n{-box_len // 2} {box_len // 2}\n{-box_len // 2} {box_len // 2}\n{-box_len // 2} {box_len // 2}\n"
-        )
-        f.write("ITEM: ATOMS id type x y z\n")
-        max_type: int = 0
-        for i in range(0, len(points)):
-            if points[i].shape[1] == 4:
-                for j in range(points[i].shape[0]):
-                    f.write(
-                        f"{j + 1} {int(points[i][j][3] + i)} {points[i][j][0]:.6f} {points[i][j][1]:.6f} {points[i][j][2]:.6f}\n"
-                    )
-                    max_type = max(max_type, int(points[i][j][3]))
-            else:
-                for j, (x, y, z) in enumerate(points[i], start=1):
-                    f.write(f"{j} {i + 1 + max_type} {x:.6f} {y:.6f} {z:.6f}\n")
-        print("dumped to", filename)
+    with stage("dump"):
+        print("dumping...")
+        if isinstance(points, PointBuffer):
+            num: float = len(points)
+        else:
+            num: float = sum(pt.shape[0] for pt in points)
+        with open_dump(filename, dump_header(num, box_len), compression) as f:
+            if isinstance(points, PointBuffer):
+                write_atoms(f, 1, points.types, points.xyz)
+                print("dumped to", filename)
+                return
+            max_type: int = 0
+            for i in range(0, len(points)):
+                if points[i].shape[0] == 0:
+                    continue
+                if points[i].shape[1] >= 4:
+                    write_atoms(f, 1, points[i][:, 3] + i, points[i][:, :3])
+                    max_type = max(max_type, int(np.max(points[i][:, 3])))
+                else:
+                    write_atoms(f, 1, i + 1 + max_type, points[i])
+            print("dumped to", filename)
 
 
 def is_connected(adj_list, N):
@@ -596,13 +633,17 @@ def is_connected(adj_list, N):
     return len(visited) == N
 
 
-def create_network_graph(N: int, M: int) -> dict[int, list[int]] | None:
+def create_network_graph(
+    N: int, M: int, rng: np.random.Generator | None = None
+) -> dict[int, list[int]] | None:
     """
     Generates a connected graph with N nodes where each node has approximately M branches.
 
     Args:
         N (int): The number of nodes in the graph.
         M (int): The desired number of branches (degree) for each node.
+        rng (np.random.Generator | None): The random generator the extra edges are
+            shuffled with. Defaults to the global np.random state.
 
     Returns:
         dict: An adjacency list representation of the graph, or None if
@@ -643,7 +684,8 @@ def create_network_graph(N: int, M: int) -> dict[int, list[int]] | None:
             if j not in adj_list[i]:
                 potential_edges.append((i, j))
 
-    np.random.shuffle(potential_edges)
+    random = np.random if rng is None else rng
+    random.shuffle(potential_edges)
 
     for node1, node2 in potential_edges:
         if degrees[node1] < M and degrees[node2] < M:
@@ -0,0 +1,319 @@
+from typing import Callable, Iterable
+import numpy as np
+from .binary import read_column, read_header, write_container
+from .buffer import PointBuffer, iter_batches
+from .ellipsoid import Ellipsoid
+from .population import ParticleTable
+
+VOXEL_VERSION: int = 1
+# The most sample positions one block of a rasterized particle holds
+RASTER_BLOCK: int = 2**21
+# The kinds of particles rasterize can fill the grid with
+RASTER_KINDS: tuple[str, ...] = ("ellipsoid", "core_shell", "onion", "parallelepiped")
+
+
+class VoxelGrid:
+    """
+    The number density of the points of each type on a grid over a periodic box
+
+    The box is centered on the origin and cut into grid_size^3 cubic voxels, and a
+    point lands in the voxel that holds it, wrapped into the box. Its memory and
+    file size depend on the resolution and the number of types, not on the points.
+
+    Attributes
+    ----------
+    grid_size : int
+        The number of voxels along each axis
+    box_len : float
+        The length of the box
+    grids : dict[int, np.ndarray]
+        The density of each type, in points per unit volume, each a float32 array
+        with shape (grid_size, grid_size, grid_size)
+    """
+
+    def __init__(self, grid_size: int, box_len: float):
+        """
+        Initializes an empty grid
+
+        Parameters
+        ----------
+        grid_size : int
+            The number of voxels along each axis
+        box_len : float
+            The length of the box
+        """
+        self.grid_size: int = grid_size
+        self.box_len: float = box_len
+        self.grids: dict[int, np.ndarray] = {}
+
+    @property
+    def spacing(self) -> float:
+        """The edge length of a voxel"""
+        return self.box_len / self.grid_size
+
+    def grid(self, t: int) -> np.ndarray:
+        """The density of a type, created empty the first time the type is seen"""
+        if t not in self.grids:
+            n: int = self.grid_size
+            self.grids[t] = np.zeros((n, n, n), dtype=np.float32)
+        return self.grids[t]
+
+    def index(self, xyz: np.ndarray) -> np.ndarray:
+        """
+        The voxel of each position, wrapped into the box
+
+        Parameters
+        ----------
+        xyz : np.ndarray
+            The positions, with shape (n, 3)
+
+        Returns
+        -------
+        np.ndarray
+            The flat index of each voxel, with shape (n,)
+        """
+        n: int = self.grid_size
+        ijk: np.ndarray = np.floor(
+            (np.asarray(xyz, dtype=float) + self.box_len / 2) / self.spacing
+        ).astype(np.int64)
+        ijk %= n
+        return (ijk[:, 0] * n + ijk[:, 1]) * n + ijk[:, 2]
+
+    def add_points(self, points: PointBuffer) -> None:
+        """
+        Count points into the voxels of their types
+
+        Parameters
+        ----------
+        points : PointBuffer
+            The points, e.g. one batch of iter_batches
+        """
+        flat: np.ndarray = self.index(points.xyz)
+        per_point: float = 1 / self.spacing**3
+        for t in np.unique(points.types).tolist():
+            # only the voxels the batch reaches, so a batch costs its own size
+            cells, counts = np.unique(flat[points.types == t], return_counts=True)
+            self.grid(t).reshape(-1)[cells] += per_point * counts
+
+    def types(self) -> list[int]:
+        """The types on the grid, in increasing order"""
+        return sorted(self.grids)
+
+    def density(self) -> np.ndarray:
+        """
+        The densities of every type as one array
+
+        Returns
+        -------
+        np.ndarray
+            The density of each type of types(), with shape (T, n, n, n)
+        """
+        n: int = self.grid_size
+        if not self.grids:
+            return np.zeros((0, n, n, n), dtype=np.float32)
+        return np.stack([self.grids[t] for t in self.types()])
+
+    def expected_count(self) -> float:
+        """The number of points the densities add up to"""
+        return float(sum(np.sum(g, dtype=float) for g in self.grids.values())) * (
+            self.spacing**3
+        )
+
+    def save(self, filename: str, metadata: dict | None = None) -> None:
+        """
+        Save the densities to a binary container that VoxelGrid.load can memory-map
+
+        The file is the JSON header of a points container followed by one float32
+        array of shape (T, n, n, n), in the order of the types in the header.
+
+        Parameters
+        ----------
+        filename : str
+            The name of the file, e.g. out/box.vox
+        metadata : dict | None
+            Extra JSON-serializable information stored in the header
+        """
+        header: dict = {
+            "format": "shapes_3d-voxels",
+            "version": VOXEL_VERSION,
+            "grid_size": self.grid_size,
+            "box_len": self.box_len,
+            "types": self.types(),
+            "metadata": metadata or {},
+        }
+        write_container(filename, header, {"density": self.density()})
+        print("saved the voxels to", filename)
+
+    @classmethod
+    def load(cls, filename: str, mmap: bool = True) -> "VoxelGrid":
+        """
+        Load a grid saved by save, by default without reading it into memory
+
+        Parameters
+        ----------
+        filename : str
+            The name of the file
+        mmap : bool
+            Whether to memory-map the densities read-only instead of reading them
+
+        Returns
+        -------
+        VoxelGrid
+            The grid
+        """
+        header: dict = read_header(filename)
+        assert header["format"] == "shapes_3d-voxels", f"{filename} holds no voxels"
+        grid: VoxelGrid = cls(header["grid_size"], header["box_len"])
+        density: np.ndarray = read_column(filename, header["columns"]["density"], mmap)
+        grid.grids = dict(zip(header["types"], density))
+        return grid
+
+
+def rasterize(table: ParticleTable, grid_size: int, supersample: int = 2) -> VoxelGrid:
+    """
+    Fill a grid with the densities of the particles of a table, without any points
+
+    Every voxel gets the density of each layer times the fraction of
+    supersample^3 positions inside it that fall in that layer, so the grid holds
+    the expected number of points where the builder would sample them.
+
+    Parameters
+    ----------
+    table : ParticleTable
+        The particles, all ellipsoids, core-shell spheres, onions or parallelepipeds
+    grid_size : int
+        The number of voxels along each axis
+    supersample : int
+        The number of positions along each axis of a voxel
+
+    Returns
+    -------
+    VoxelGrid
+        The densities of the layers, the type of layer k being k
+    """
+    kind: str = str(table.kinds[0])
+    assert kind in RASTER_KINDS, f"cannot rasterize {kind} particles"
+    densities: dict[int, float] = table.type_densities()
+    grid: VoxelGrid = VoxelGrid(grid_size, table.box_len)
+    spacing: float = grid.spacing
+    # the positions inside a voxel, relative to its corner
+    offsets: np.ndarray = (np.arange(supersample) + 0.5) / supersample * spacing
+    sub: np.ndarray = np.stack(
+        np.meshgrid(offsets, offsets, offsets, indexing="ij"), axis=-1
+    ).reshape(-1, 3)
+    # the half extents of a parallelepiped are along its own axes
+    reach: np.ndarray = (
+        np.linalg.norm(table.shapes(), axis=1)
+        if kind == "parallelepiped"
+        else np.max(table.shapes(), axis=1)
+    )
+    for i in range(len(table)):
+        shape = table.shape(i)
+        center: np.ndarray = table.centers[i]
+        low: np.ndarray = np.floor(
+            (center - reach[i] + table.box_len / 2) / spacing
+        ).astype(np.int64)
+        high: np.ndarray = np.ceil(
+            (center + reach[i] + table.box_len / 2) / spacing
+        ).astype(np.int64)
+        corners: list[np.ndarray] = [
+            np.arange(low[a], high[a]) * spacing - table.box_len / 2 for a in range(3)
+        ]
+        plane: int = len(corners[1]) * len(corners[2]) * len(sub)
+        rows: int = max(1, RASTER_BLOCK // max(plane, 1))
+        for start in range(0, len(corners[0]), rows):
+            block: list[np.ndarray] = [corners[0][start : start + rows]] + corners[1:]
+            voxel: np.ndarray = np.stack(np.meshgrid(*block, indexing="ij"), axis=-1)
+            positions: np.ndarray = (voxel[..., None, :] + sub).reshape(-1, 3)
+            layer: np.ndarray = (
+                shape.contains(positions).astype(np.int64)
+                if isinstance(shape, Ellipsoid)
+                else shape.shell(positions)
+            ).reshape(voxel.shape[:3] + (len(sub),))
+            index: tuple[np.ndarray, ...] = np.ix_(
+                *(
+                    (np.arange(len(b)) + low[a] + (start if a == 0 else 0)) % grid_size
+                    for a, b in enumerate(block)
+                )
+            )
+            # a particle wider than the box wraps onto the same voxels more than once,
+            # and fancy-index += would add each of them only once
+            wraps: bool = any(len(b) > grid_size for b in block)
+            for t, density in densities.items():
+                fraction: np.ndarray = np.mean(layer == t, axis=-1)
+                if density > 0 and np.any(fraction):
+                    if wraps:
+                        np.add.at(grid.grid(t), index, density * fraction)
+                    else:
+                        grid.grid(t)[index] += density * fraction
+    return grid
+
+
+def check_rasterize(config: dict, kind: str) -> None:
+    """
+    Reject rasterize for particles it cannot fill the grid with, before any work
+
+    Parameters
+    ----------
+    config : dict
+        The parameters of the builder, with its voxels and rasterize options
+    kind : str
+        The kind of particles the builder makes
+
+    Raises
+    ------
+    ValueError
+        If voxels and rasterize are set for a kind not in RASTER_KINDS
+    """
+    if config["voxels"] and config["rasterize"] and kind not in RASTER_KINDS:
+        raise ValueError(
+            f"cannot rasterize {kind} particles, only {', '.join(RASTER_KINDS)}"
+        )
+
+
+def save_voxels(
+    writers: Iterable[Callable[[PointBuffer], None]],
+    filename: str,
+    box_len: float,
+    config: dict,
+    table: ParticleTable | None = None,
+) -> int:
+    """
+    Write the density grid of a box instead of its points
+
+    With rasterize the grid is filled from the table, and no point is sampled.
+    Otherwise the points are generated in batches of batch_size and counted into
+    the grid, so only one batch is held at a time.
+
+    Parameters
+    ----------
+    writers : Iterable[Callable[[PointBuffer], None]]
+        Callables that each append one particle (or one group of particles)
+    filename : str
+        The name of the file, e.g. out/box.vox
+    box_len : float
+        The length of the box
+    config : dict
+        The parameters of the builder, with its voxels, rasterize, batch_size and
+        compact options
+    table : ParticleTable | None
+        The particles, needed to rasterize
+
+    Returns
+    -------
+    int
+        The number of points sampled
+    """
+    num_points: int = 0
+    if config["rasterize"]:
+        assert table is not None, "rasterizing needs the particle table"
+        grid: VoxelGrid = rasterize(table, config["voxels"])
+    else:
+        grid = VoxelGrid(config["voxels"], box_len)
+        for batch in iter_batches(
+            writers, config["batch_size"], compact=config["compact"]
+        ):
+            grid.add_points(batch)
+            num_points += len(batch)
+    grid.save(filename, {"rasterized": config["rasterize"]})
+    return num_points
@@ -1,48 +1,237 @@
 import numpy as np
-from ..modules.ellipsoid import Ellipsoid
+from functools import partial
+from ..modules.buffer import PointBuffer, iter_batches
+from ..modules.cache import (
+    ORIENTED_STAGES,
+    StageCache,
+    cached_stage,
+    open_cache,
+    stage_rng,
+    stage_seeds,
+)
+from ..modules.config import OUTPUT_CONFIG, merge_config, output_path
+from ..modules.dump import save_dump_stream
+from ..modules.estimate import dry_run, estimate_build, plan_output, type_counts
+from ..modules.binary import save_points_stream
+from ..modules.parallel import parallel_writers
+from ..modules.population import ParticleTable
+from ..modules.profiling import profiled, stage
+from ..modules.rotations import draw_orientations
+from ..modules.sizes import fill_axes
+from ..modules.voxels import check_rasterize, save_voxels
 from ..modules.utils import save_dump, make_centers
 
-box_length = 1000
-axis_length_mean: np.ndarray = np.array([30, 50, 65])
-axis_length_std: np.ndarray = np.array([5, 6, 3])
-volume_fraction = 0.05
-density = 0.02
-
-log_std_axis: np.ndarray = np.sqrt(
-    np.log(1 + (axis_length_std / axis_length_mean) ** 2)
+DEFAULT_CONFIG: dict = {
+    "box_length": 1000.0,
+    "axis_length_mean": [30.0, 50.0, 65.0],
+    "axis_length_std": [5.0, 6.0, 3.0],
+    "volume_fraction": 0.05,
+    "density": 0.02,
+    # "fixed" along the axes, "uniform" or "aligned" within orientation_spread
+    "orientation": "fixed",
+    "orientation_spread": 0.2,
+} | OUTPUT_CONFIG
+# The parameters the sizes and centers depend on
+SIZE_PARAMETERS: tuple[str, ...] = (
+    "box_length",
+    "axis_length_mean",
+    "axis_length_std",
+    "volume_fraction",
 )
-log_mean_axis: np.ndarray = np.log(axis_length_mean) - log_std_axis**2 / 2
-axis_lengths_list: list = []
-total_volume = 0
-target = (box_length**3) * volume_fraction
-while total_volume < target:
-    x_length = np.random.lognormal(log_mean_axis[0], log_std_axis[0])
-    y_length = np.random.lognormal(log_mean_axis[1], log_std_axis[1])
-    z_length = np.random.lognormal(log_mean_axis[2], log_std_axis[2])
-    volume = (4 / 3) * np.pi * (x_length * y_length * z_length)
-    if total_volume + volume > target:
-        break
-    total_volume += volume
-    axis_lengths_list.append([x_length, y_length, z_length])
-axis_length: np.ndarray = np.array(axis_lengths_list)
-
-num_pts = axis_length.shape[0]
-
-max_r = np.amax(axis_length)
-print("particles:", num_pts)
-centers = make_centers(
-    num_pts, -box_length / 2 + max_r, box_length / 2 - max_r, 2 * max_r
-)
-points: list = []
-for i in range(num_pts):
-    ellipsoid: Ellipsoid = Ellipsoid(
-        density,
-        x_outer_radius=axis_length[i][0],
-        y_outer_radius=axis_length[i][1],
-        z_outer_radius=axis_length[i][2],
+
+
+def sample_axes(config: dict, rng: np.random.Generator | None = None) -> np.ndarray:
+    """
+    Draw the semi-axes of ellipsoids until they fill the volume fraction
+
+    Parameters
+    ----------
+    config : dict
+        The parameters of the box
+    rng : np.random.Generator | None
+        The random generator to sample with. Defaults to the global np.random state
+
+    Returns
+    -------
+    np.ndarray
+        The x, y and z semi-axes of each ellipsoid, with shape (N, 3)
+    """
+    target: float = (config["box_length"] ** 3) * config["volume_fraction"]
+    return fill_axes(config["axis_length_mean"], config["axis_length_std"], target, rng)
+
+
+def place_centers(
+    axis_length: np.ndarray, config: dict, rng: np.random.Generator | None = None
+) -> np.ndarray:
+    """
+    Place the ellipsoids in the box so that none of them overlap
+
+    Parameters
+    ----------
+    axis_length : np.ndarray
+        The semi-axes of each ellipsoid, with shape (N, 3)
+    config : dict
+        The parameters of the box
+    rng : np.random.Generator | None
+        The random generator to sample with. Defaults to the global np.random state
+
+    Returns
+    -------
+    np.ndarray
+        The center of each ellipsoid, with shape (N, 3)
+    """
+    box_length: float = config["box_length"]
+    max_r = np.amax(axis_length, initial=0)
+    return make_centers(
+        axis_length.shape[0],
+        -box_length / 2 + max_r,
+        box_length / 2 - max_r,
+        2 * max_r,
+        rng,
     )
-    shifted_ellipsoid = ellipsoid.make_obj() + centers[i]
-    for point in shifted_ellipsoid:
-        points.append(point)
-final_points: np.ndarray = np.array(points)
-save_dump([final_points], "out/ellipsoid_box.dump", box_length)
+
+
+def expected_points(axis_length: np.ndarray, config: dict) -> np.ndarray:
+    """
+    The expected number of points of each ellipsoid, density times volume
+
+    Parameters
+    ----------
+    axis_length : np.ndarray
+        The semi-axes of each ellipsoid, with shape (N, 3)
+    config : dict
+        The parameters of the box
+
+    Returns
+    -------
+    np.ndarray
+        The expected points of each ellipsoid, with shape (N, 1)
+    """
+    volume: np.ndarray = (4 / 3) * np.pi * np.prod(axis_length, axis=1)
+    return config["density"] * volume[:, None]
+
+
+@profiled
+def build_box_ellipsoids(
+    config: dict | None = None, rng: np.random.Generator | None = None
+) -> dict:
+    """
+    Fill a box with ellipsoids and save their points
+
+    The sizes, the centers, the orientations and the points are each sampled with
+    their own seed drawn from rng. With a cache_dir, the sizes and centers are cached
+    by their inputs, so e.g. a new density only resamples the points.
+
+    Parameters
+    ----------
+    config : dict | None
+        The parameters to override, see DEFAULT_CONFIG
+    rng : np.random.Generator | None
+        The random generator to sample with. Defaults to the global np.random state
+
+    Returns
+    -------
+    dict
+        The number of particles, the number of points and the files written
+    """
+    config = merge_config(DEFAULT_CONFIG, config)
+    check_rasterize(config, "ellipsoid")
+    box_length: float = config["box_length"]
+    density: float = config["density"]
+    compact: bool = config["compact"]
+
+    seeds: dict[str, int | None] = stage_seeds(rng, ORIENTED_STAGES)
+    cache: StageCache | None = open_cache(config, rng)
+    size_inputs: dict = {key: config[key] for key in SIZE_PARAMETERS}
+    # builders sample their sizes differently, so they never share entries
+    size_inputs["builder"] = "box_ellipsoids"
+    size_inputs["seed"] = seeds["sizes"]
+    with stage("sizes"):
+        axis_length: np.ndarray = cached_stage(
+            cache,
+            "sizes",
+            size_inputs,
+            partial(sample_axes, config, stage_rng(seeds["sizes"])),
+        )
+    num_pts = axis_length.shape[0]
+    print("particles:", num_pts)
+    estimate: dict = estimate_build(
+        type_counts(expected_points(axis_length, config)), num_pts, box_length, config
+    )
+    if config["dry_run"]:
+        return dry_run(estimate)
+    config = plan_output(config, estimate)
+    compact = config["compact"]
+    with stage("centers"):
+        centers: np.ndarray = cached_stage(
+            cache,
+            "centers",
+            size_inputs | {"center_seed": seeds["centers"]},
+            partial(place_centers, axis_length, config, stage_rng(seeds["centers"])),
+        )
+    with stage("orientations"):
+        orientations: np.ndarray = draw_orientations(
+            num_pts,
+            config["orientation"],
+            config["orientation_spread"],
+            stage_rng(seeds["orientations"]),
+        )
+    files: list[str] = []
+    table: ParticleTable = ParticleTable(
+        "ellipsoid",
+        centers,
+        axis_length,
+        box_length,
+        {"density": density},
+        orientations=orientations,
+        # the particle seeds are spawned from the points seed alone
+        seed=seeds["points"],
+    )
+    if config["save_table"]:
+        table_file: str = output_path(config, "ellipsoid_box.npz")
+        particles_file: str = output_path(config, "ellipsoid_box_particles.dump")
+        table.save(table_file)
+        table.save_ovito(particles_file, config["compression"])
+        files += [table_file, particles_file]
+    # every particle is sampled from its own seed, in the same order for any
+    # number of workers
+    writers = parallel_writers(table, config["workers"], compact)
+    with stage("points"):
+        if config["voxels"]:
+            voxel_file: str = output_path(config, "ellipsoid_box.vox")
+            num_points: int = save_voxels(
+                writers, voxel_file, box_length, config, table
+            )
+            files += [voxel_file]
+        elif config["binary"]:
+            pts_file: str = output_path(config, "ellipsoid_box.pts")
+            num_points = save_points_stream(
+                writers,
+                pts_file,
+                box_length,
+                table.expected_count(),
+                compact=compact,
+            )
+            files += [pts_file]
+        elif config["stream"]:
+            dump_file: str = output_path(config, "ellipsoid_box.dump")
+            batches = iter_batches(writers, config["batch_size"], compact=compact)
+            num_points = save_dump_stream(
+                batches, dump_file, box_length, compression=config["compression"]
+            )
+            files += [dump_file]
+        else:
+            points: PointBuffer = PointBuffer.for_count(
+                table.expected_count(), compact=compact
+            )
+            for write in writers:
+                write(points)
+            num_points = len(points)
+            dump_file = output_path(config, "ellipsoid_box.dump")
+            save_dump(points, dump_file, box_length, config["compression"])
+            files += [dump_file]
+    return {"num_particles": num_pts, "num_points": num_points, "files": files}
+
+
+if __name__ == "__main__":
+    build_box_ellipsoids()
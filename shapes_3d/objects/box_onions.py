@@ -1,52 +1,43 @@
 import numpy as np
-from ..modules.onion import Onion
+from ..modules.onion import expected_onion_count, expected_shell_counts
+from functools import partial
+from ..modules.buffer import PointBuffer, iter_batches
+from ..modules.cache import (
+    BUILD_STAGES,
+    StageCache,
+    cached_stage,
+    open_cache,
+    stage_rng,
+    stage_seeds,
+)
+from ..modules.config import OUTPUT_CONFIG, merge_config, output_path
+from ..modules.dump import save_dump_stream
+from ..modules.estimate import dry_run, estimate_build, plan_output, type_counts
+from ..modules.binary import save_points_stream
+from ..modules.parallel import parallel_writers
+from ..modules.population import ParticleTable
+from ..modules.profiling import profiled, stage
+from ..modules.sizes import fill_shells
 from pathlib import Path
+from ..modules.voxels import check_rasterize, save_voxels
 from ..modules.utils import save_dump, make_centers
 
-thickness_mean = np.array([10.0, 7.0, 6.0, 5.0, 4.0])
-thickness_std = np.array([1.5, 1.2, 0.5, 0.8, 1.0])
-density = np.array([0.0, 0.05, 0.1, 0.03, 0.2])
-box_length: float = 800
-volume_fraction: float = 0.05
-assert density.shape == thickness_std.shape == thickness_mean.shape
-
-radii = []
-target = (box_length**3) * volume_fraction
-current_volume: float = 0
-log_thickness_std: np.ndarray = np.sqrt(
-    np.log(1 + (thickness_std / thickness_mean) ** 2)
-)
-log_thickness_mean: np.ndarray = np.log(thickness_mean) - log_thickness_std**2 / 2
-while current_volume < target:
-    total_radius: float = 0
-    curr_sphere = np.random.lognormal(log_thickness_mean, log_thickness_std)
-    current_volume += float(np.sum(curr_sphere) ** 3) * np.pi * 4 / 3
-    if current_volume > target:
-        break
-    radii.append(curr_sphere)
-radii = np.array(radii)
-print(radii)
-N: int = radii.shape[0]
-
-
-max_total_radius: float = np.max(radii.sum(axis=1))
-centers = make_centers(
-    N,
-    -box_length / 2 + max_total_radius,
-    box_length / 2 - max_total_radius,
-    2 * max_total_radius,
+DEFAULT_CONFIG: dict = {
+    "thickness_mean": [10.0, 7.0, 6.0, 5.0, 4.0],
+    "thickness_std": [1.5, 1.2, 0.5, 0.8, 1.0],
+    "density": [0.0, 0.05, 0.1, 0.03, 0.2],
+    "box_length": 800.0,
+    "volume_fraction": 0.05,
+} | OUTPUT_CONFIG
+# The parameters the sizes and centers depend on
+SIZE_PARAMETERS: tuple[str, ...] = (
+    "thickness_mean",
+    "thickness_std",
+    "box_length",
+    "volume_fraction",
 )
 
 
-points = []
-for i in range(N):
-    if (i + 1) % 100 == 0 or i == 0 or i == N - 1:
-        print("N =", i + 1, "out of", N)
-    shell = Onion(radii[i], centers[i], density)
-    points.extend(shell.pts)
-points = np.array(points)
-
-
 def save_coords(points: np.ndarray, filename: str = "out.txt") -> None:
     """
     Save coordinates to a file
@@ -56,5 +47,196 @@ def save_coords(points: np.ndarray, filename: str = "out.txt") -> None:
     print("saved to", filename)
 
 
-save_coords(points, "out/box_onion.txt")
-save_dump([points], "out/box_onion.dump", box_length)
+def sample_radii(config: dict, rng: np.random.Generator | None = None) -> np.ndarray:
+    """
+    Draw the shell thicknesses of onions until they fill the volume fraction
+
+    Parameters
+    ----------
+    config : dict
+        The parameters of the box
+    rng : np.random.Generator | None
+        The random generator to sample with. Defaults to the global np.random state
+
+    Returns
+    -------
+    np.ndarray
+        The thickness of each shell of each onion, with shape (N, K)
+    """
+    target: float = (config["box_length"] ** 3) * config["volume_fraction"]
+    return fill_shells(config["thickness_mean"], config["thickness_std"], target, rng)
+
+
+def place_centers(
+    radii: np.ndarray, config: dict, rng: np.random.Generator | None = None
+) -> np.ndarray:
+    """
+    Place the onions in the box so that none of them overlap
+
+    Parameters
+    ----------
+    radii : np.ndarray
+        The thickness of each shell of each onion, with shape (N, K)
+    config : dict
+        The parameters of the box
+    rng : np.random.Generator | None
+        The random generator to sample with. Defaults to the global np.random state
+
+    Returns
+    -------
+    np.ndarray
+        The center of each onion, with shape (N, 3)
+    """
+    box_length: float = config["box_length"]
+    max_total_radius: float = np.max(radii.sum(axis=1), initial=0)
+    return make_centers(
+        radii.shape[0],
+        -box_length / 2 + max_total_radius,
+        box_length / 2 - max_total_radius,
+        2 * max_total_radius,
+        rng,
+    )
+
+
+def expected_points(radii: np.ndarray, config: dict) -> np.ndarray:
+    """
+    The expected number of points of each type of each onion, density times volume
+
+    Parameters
+    ----------
+    radii : np.ndarray
+        The thickness of each shell of each onion, with shape (N, layers)
+    config : dict
+        The parameters of the box
+
+    Returns
+    -------
+    np.ndarray
+        The expected points of each shell of each onion, with shape (N, layers)
+    """
+    return expected_shell_counts(radii, np.asarray(config["density"], dtype=float))
+
+
+@profiled
+def build_box_onions(
+    config: dict | None = None, rng: np.random.Generator | None = None
+) -> dict:
+    """
+    Fill a box with onions and save their points
+
+    The sizes, the centers and the points are each sampled with their own seed
+    drawn from rng. With a cache_dir, the sizes and centers are cached by their
+    inputs, so e.g. a new density only resamples the points.
+
+    Parameters
+    ----------
+    config : dict | None
+        The parameters to override, see DEFAULT_CONFIG
+    rng : np.random.Generator | None
+        The random generator to sample with. Defaults to the global np.random state
+
+    Returns
+    -------
+    dict
+        The number of particles, the number of points and the files written
+    """
+    config = merge_config(DEFAULT_CONFIG, config)
+    check_rasterize(config, "onion")
+    density: np.ndarray = np.asarray(config["density"], dtype=float)
+    box_length: float = config["box_length"]
+    compact: bool = config["compact"]
+    assert density.shape == np.shape(config["thickness_std"])
+    assert density.shape == np.shape(config["thickness_mean"])
+
+    seeds: dict[str, int | None] = stage_seeds(rng, BUILD_STAGES)
+    cache: StageCache | None = open_cache(config, rng)
+    size_inputs: dict = {key: config[key] for key in SIZE_PARAMETERS}
+    # builders sample their sizes differently, so they never share entries
+    size_inputs["builder"] = "box_onions"
+    size_inputs["seed"] = seeds["sizes"]
+    with stage("sizes"):
+        radii: np.ndarray = cached_stage(
+            cache,
+            "sizes",
+            size_inputs,
+            partial(sample_radii, config, stage_rng(seeds["sizes"])),
+        )
+    print(radii)
+    N: int = radii.shape[0]
+    # the in-memory output keeps a copy of the rows for its .txt as well
+    estimate: dict = estimate_build(
+        type_counts(expected_points(radii, config)),
+        N,
+        box_length,
+        config,
+        extra_bytes_per_point=32,
+        text_files=1 if config["stream"] or config["binary"] else 2,
+    )
+    if config["dry_run"]:
+        return dry_run(estimate)
+    config = plan_output(config, estimate)
+    compact = config["compact"]
+    with stage("centers"):
+        centers: np.ndarray = cached_stage(
+            cache,
+            "centers",
+            size_inputs | {"center_seed": seeds["centers"]},
+            partial(place_centers, radii, config, stage_rng(seeds["centers"])),
+        )
+
+    files: list[str] = []
+    table: ParticleTable = ParticleTable(
+        "onion",
+        centers,
+        radii,
+        box_length,
+        {"density": density.tolist()},
+        # the particle seeds are spawned from the points seed alone
+        seed=seeds["points"],
+    )
+    if config["save_table"]:
+        table_file: str = output_path(config, "box_onion.npz")
+        particles_file: str = output_path(config, "box_onion_particles.dump")
+        table.save(table_file)
+        table.save_ovito(particles_file, config["compression"])
+        files += [table_file, particles_file]
+    # every particle is sampled from its own seed, in the same order for any
+    # number of workers
+    writers = parallel_writers(table, config["workers"], compact)
+    expected: float = float(np.sum(expected_onion_count(radii, density)))
+    with stage("points"):
+        if config["voxels"]:
+            voxel_file: str = output_path(config, "box_onion.vox")
+            num_points: int = save_voxels(
+                writers, voxel_file, box_length, config, table
+            )
+            files += [voxel_file]
+        elif config["binary"]:
+            pts_file: str = output_path(config, "box_onion.pts")
+            num_points = save_points_stream(
+                writers, pts_file, box_length, expected, compact=compact
+            )
+            files += [pts_file]
+        elif config["stream"]:
+            dump_file: str = output_path(config, "box_onion.dump")
+            batches = iter_batches(writers, config["batch_size"], compact=compact)
+            num_points = save_dump_stream(
+                batches, dump_file, box_length, compression=config["compression"]
+            )
+            files += [dump_file]
+        else:
+            points: PointBuffer = PointBuffer.for_count(expected, compact=compact)
+            for write in writers:
+                write(points)
+            num_points = len(points)
+
+            coords_file: str = output_path(config, "box_onion.txt")
+            dump_file = output_path(config, "box_onion.dump")
+            save_coords(points.to_rows(), coords_file)
+            save_dump(points, dump_file, box_length, config["compression"])
+            files += [coords_file, dump_file]
+    return {"num_particles": N, "num_points": num_points, "files": files}
+
+
+if __name__ == "__main__":
+    build_box_onions()
@@ -1,83 +1,305 @@
-import sys
 import numpy as np
-from shapes_3d.modules.parallelepiped import Parallelepiped
+from functools import partial
+from ..modules.buffer import PointBuffer, iter_batches
+from ..modules.cache import (
+    ORIENTED_STAGES,
+    StageCache,
+    cached_stage,
+    open_cache,
+    stage_rng,
+    stage_seeds,
+)
+from ..modules.config import OUTPUT_CONFIG, merge_config, output_path
+from ..modules.dump import save_dump_stream
+from ..modules.estimate import dry_run, estimate_build, plan_output, type_counts
+from ..modules.binary import save_points_stream
+from ..modules.parallel import parallel_writers
+from ..modules.population import ParticleTable
+from ..modules.profiling import profiled, stage
+from ..modules.rotations import draw_orientations
+from ..modules.sizes import draw_lognormal, fill_volume
+from ..modules.voxels import check_rasterize, save_voxels
 from ..modules.utils import make_centers_iter, save_dump
 
-VOLUME_FRACTION = 0.05
-BOX_LEN = 800
+DEFAULT_CONFIG: dict = {
+    "volume_fraction": 0.05,
+    "box_length": 800.0,
+    "density": [0.1, 0.03],
+    "length_x_mean": [30.0, 20.0],
+    "length_y_mean": [10.0, 30.0],
+    "length_z_mean": [20.0, 10.0],
+    "length_x_std": [3.0, 2.0],
+    "length_y_std": [1.0, 3.0],
+    "length_z_std": [2.0, 1.0],
+    "theta_mean": np.pi / 3,
+    "phi_mean": np.pi / 3,
+    "theta_std": 0.2,
+    "phi_std": 0.2,
+    # "fixed" along the axes, "uniform" or "aligned" within orientation_spread
+    "orientation": "fixed",
+    "orientation_spread": 0.2,
+} | OUTPUT_CONFIG
+# The parameters the sizes and centers depend on
+SIZE_PARAMETERS: tuple[str, ...] = (
+    "volume_fraction",
+    "box_length",
+    "length_x_mean",
+    "length_y_mean",
+    "length_z_mean",
+    "length_x_std",
+    "length_y_std",
+    "length_z_std",
+    "theta_mean",
+    "phi_mean",
+    "theta_std",
+    "phi_std",
+)
 
 
-density: np.ndarray = np.array([0.1, 0.03])
+def sample_shapes(config: dict, rng: np.random.Generator | None = None) -> np.ndarray:
+    """
+    Draw the lengths and angles of parallelepipeds until they fill the volume fraction
 
+    Parameters
+    ----------
+    config : dict
+        The parameters of the box
+    rng : np.random.Generator | None
+        The random generator to sample with. Defaults to the global np.random state
 
-length_x_mean: np.ndarray = np.array([30.0, 20.0])
-length_y_mean: np.ndarray = np.array([10.0, 30.0])
-length_z_mean: np.ndarray = np.array([20.0, 10.0])
-length_mean: np.ndarray = np.array([length_x_mean, length_y_mean, length_z_mean])
+    Returns
+    -------
+    np.ndarray
+        theta, phi and the flattened (layers, 3) lengths of each parallelepiped, in
+        the row layout of a "parallelepiped" ParticleTable
+    """
+    length_mean: np.ndarray = np.array(
+        [config["length_x_mean"], config["length_y_mean"], config["length_z_mean"]],
+        dtype=float,
+    )
+    length_std: np.ndarray = np.array(
+        [config["length_x_std"], config["length_y_std"], config["length_z_std"]],
+        dtype=float,
+    )
+    layers: int = length_mean.shape[1]
+    # a row is the (3, layers) lengths, then theta and phi, all drawn at once
+    mean: np.ndarray = np.append(
+        length_mean, [config["theta_mean"], config["phi_mean"]]
+    )
+    std: np.ndarray = np.append(length_std, [config["theta_std"], config["phi_std"]])
+
+    def draw(random: np.random.Generator, num: int) -> np.ndarray:
+        drawn: np.ndarray = draw_lognormal(random, mean, std, num)
+        angles: np.ndarray = np.minimum(drawn[:, -2:], np.pi / 2)
+        length: np.ndarray = drawn[:, :-2].reshape(num, 3, layers).transpose(0, 2, 1)
+        return np.column_stack((angles, length.reshape(num, layers * 3)))
+
+    def volume(shapes: np.ndarray) -> np.ndarray:
+        edges: np.ndarray = shapes[:, 2:].reshape(-1, layers, 3).sum(axis=1)
+        return np.prod(edges, axis=1) * np.sin(shapes[:, 0]) * np.sin(shapes[:, 1])
+
+    target: float = (config["box_length"] ** 3) * config["volume_fraction"]
+    return fill_volume(draw, volume, target, rng).reshape(-1, 2 + layers * 3)
+
+
+def place_centers(
+    length: np.ndarray,
+    theta: np.ndarray,
+    phi: np.ndarray,
+    config: dict,
+    rng: np.random.Generator | None = None,
+) -> np.ndarray:
+    """
+    Place the parallelepipeds in the box so that none of them overlap
+
+    Parameters
+    ----------
+    length : np.ndarray
+        The lengths of each layer of each parallelepiped, with shape (N, layers, 3)
+    theta : np.ndarray
+        The theta angle of each parallelepiped
+    phi : np.ndarray
+        The phi angle of each parallelepiped
+    config : dict
+        The parameters of the box
+    rng : np.random.Generator | None
+        The random generator to sample with. Defaults to the global np.random state
+
+    Returns
+    -------
+    np.ndarray
+        The center of each parallelepiped, with shape (N, 3)
+    """
+    BOX_LEN: float = config["box_length"]
+    max_length_sum: np.ndarray = np.sum(length, axis=1).T
+    max_x, max_y, max_z = (max_length_sum[0], max_length_sum[1], max_length_sum[2])
+    max_height = max_z * np.sin(theta) * np.sin(phi)
+    min_dist = 0.5 * np.sqrt(max_x**2 + max_height**2 + max_y**2)
+
+    centers = make_centers_iter(
+        length.shape[0], -BOX_LEN / 2, BOX_LEN / 2, min_dist, rng
+    )
+    print("")
+    return centers
+
+
+def expected_points(sizes: np.ndarray, config: dict) -> np.ndarray:
+    """
+    The expected number of points of each type of each parallelepiped
+
+    Parameters
+    ----------
+    sizes : np.ndarray
+        theta, phi and the flattened (layers, 3) lengths of each parallelepiped
+    config : dict
+        The parameters of the box
+
+    Returns
+    -------
+    np.ndarray
+        The expected points of each layer of each parallelepiped, with shape
+        (N, layers)
+    """
+    density: np.ndarray = np.asarray(config["density"], dtype=float)
+    length: np.ndarray = sizes[:, 2:].reshape(-1, density.shape[0], 3)
+    summed: np.ndarray = np.cumsum(length, axis=1)
+    volume: np.ndarray = np.prod(summed, axis=2) * (
+        np.sin(sizes[:, :1]) * np.sin(sizes[:, 1:2])
+    )
+    return density * np.diff(volume, axis=1, prepend=0)
 
-length_x_std: np.ndarray = np.array([3.0, 2.0])
-length_y_std: np.ndarray = np.array([1.0, 3.0])
-length_z_std: np.ndarray = np.array([2.0, 1.0])
-length_std: np.ndarray = np.array([length_x_std, length_y_std, length_z_std])
 
-theta_mean: float = np.pi / 3
-phi_mean: float = np.pi / 3
+@profiled
+def build_box_parra(
+    config: dict | None = None, rng: np.random.Generator | None = None
+) -> dict:
+    """
+    Fill a box with parallelepiped shells and save their points
 
-theta_std: float = 0.2
-phi_std: float = 0.2
+    The sizes, the centers, the orientations and the points are each sampled with
+    their own seed drawn from rng. With a cache_dir, the sizes and centers are cached
+    by their inputs, so e.g. a new density only resamples the points.
 
+    Parameters
+    ----------
+    config : dict | None
+        The parameters to override, see DEFAULT_CONFIG
+    rng : np.random.Generator | None
+        The random generator to sample with. Defaults to the global np.random state
 
-log_length_std: np.ndarray = np.sqrt(np.log(1 + (length_std / length_mean) ** 2))
-log_length_mean: np.ndarray = np.log(length_mean) - log_length_std**2 / 2
-log_theta_std: float = np.sqrt(np.log(1 + (theta_std / theta_mean) ** 2))
-log_theta_mean: float = np.log(theta_mean) - log_theta_std**2 / 2
-log_phi_std: float = np.sqrt(np.log(1 + (phi_std / phi_mean) ** 2))
-log_phi_mean: float = np.log(phi_mean) - log_phi_std**2 / 2
+    Returns
+    -------
+    dict
+        The number of particles, the number of points and the files written
+    """
+    config = merge_config(DEFAULT_CONFIG, config)
+    check_rasterize(config, "parallelepiped")
+    BOX_LEN: float = config["box_length"]
+    COMPACT: bool = config["compact"]
 
-length_list: list = []
-theta_list: list[float] = []
-phi_list: list[float] = []
+    density: np.ndarray = np.asarray(config["density"], dtype=float)
 
-target = (BOX_LEN**3) * VOLUME_FRACTION
-current_volume: float = 0
-while current_volume < target:
-    curr_length = np.random.lognormal(log_length_mean, log_length_std)
-    curr_theta: float = min(
-        np.pi / 2, np.random.lognormal(log_theta_mean, log_theta_std)
+    seeds: dict[str, int | None] = stage_seeds(rng, ORIENTED_STAGES)
+    cache: StageCache | None = open_cache(config, rng)
+    size_inputs: dict = {key: config[key] for key in SIZE_PARAMETERS}
+    # builders sample their sizes differently, so they never share entries
+    size_inputs["builder"] = "box_parra"
+    size_inputs["seed"] = seeds["sizes"]
+    with stage("sizes"):
+        sizes: np.ndarray = cached_stage(
+            cache,
+            "sizes",
+            size_inputs,
+            partial(sample_shapes, config, stage_rng(seeds["sizes"])),
+        )
+    theta: np.ndarray = sizes[:, 0]
+    phi: np.ndarray = sizes[:, 1]
+    length: np.ndarray = sizes[:, 2:].reshape(-1, density.shape[0], 3)
+    print(length.shape)
+    N: int = length.shape[0]
+    print(f"N = {N} points")
+    estimate: dict = estimate_build(
+        type_counts(expected_points(sizes, config)), N, BOX_LEN, config
     )
-    curr_phi: float = min(np.pi / 2, np.random.lognormal(log_phi_mean, log_phi_std))
-    current_volume += (
-        np.prod(np.sum(curr_length, axis=1)) * np.sin(curr_theta) * np.sin(curr_phi)
+    if config["dry_run"]:
+        return dry_run(estimate)
+    config = plan_output(config, estimate)
+    COMPACT = config["compact"]
+
+    with stage("centers"):
+        centers: np.ndarray = cached_stage(
+            cache,
+            "centers",
+            size_inputs | {"center_seed": seeds["centers"]},
+            partial(
+                place_centers, length, theta, phi, config, stage_rng(seeds["centers"])
+            ),
+        )
+    with stage("orientations"):
+        orientations: np.ndarray = draw_orientations(
+            N,
+            config["orientation"],
+            config["orientation_spread"],
+            stage_rng(seeds["orientations"]),
+        )
+
+    files: list[str] = []
+    table: ParticleTable = ParticleTable(
+        "parallelepiped",
+        centers,
+        sizes,
+        BOX_LEN,
+        {"density": density.tolist()},
+        orientations=orientations,
+        # the particle seeds are spawned from the points seed alone
+        seed=seeds["points"],
     )
-    if current_volume > target:
-        break
-    length_list.append(curr_length.T)
-    theta_list.append(curr_theta)
-    phi_list.append(curr_phi)
-
-length: np.ndarray = np.array(length_list)
-theta: np.ndarray = np.array(theta_list)
-phi: np.ndarray = np.array(phi_list)
-print(length.shape)
-N: int = length.shape[0]
-print(f"N = {N} points")
-
-max_length_sum: np.ndarray = np.sum(length, axis=1).T
-max_x, max_y, max_z = (max_length_sum[0], max_length_sum[1], max_length_sum[2])
-max_height = max_z * np.sin(theta) * np.sin(phi)
-min_dist = 0.5 * np.sqrt(max_x**2 + max_height**2 + max_y**2)
-
-centers = make_centers_iter(N, -BOX_LEN / 2, BOX_LEN / 2, min_dist)
-print("")
-
-points = []
-for i in range(N):
-    print(f"\rcreated {i+1} out of {N}", end="")
-    sys.stdout.flush()
-    shell = Parallelepiped(length[i], density, theta[i], phi[i], center=centers[i])
-    points.extend(shell.make_obj())
-points = np.array(points)
-print("")
-
-save_dump(points=[points], box_len=BOX_LEN, filename="out/box_par.dump")
-points = np.array(points)
+    if config["save_table"]:
+        table_file: str = output_path(config, "box_par.npz")
+        particles_file: str = output_path(config, "box_par_particles.dump")
+        table.save(table_file)
+        table.save_ovito(particles_file, config["compression"])
+        files += [table_file, particles_file]
+    # every particle is sampled from its own seed, in the same order for any
+    # number of workers
+    writers = parallel_writers(table, config["workers"], COMPACT)
+    expected: float = table.expected_count()
+    with stage("points"):
+        if config["voxels"]:
+            voxel_file: str = output_path(config, "box_par.vox")
+            num_points: int = save_voxels(writers, voxel_file, BOX_LEN, config, table)
+            files += [voxel_file]
+        elif config["binary"]:
+            pts_file: str = output_path(config, "box_par.pts")
+            num_points = save_points_stream(
+                writers, pts_file, BOX_LEN, expected, compact=COMPACT
+            )
+            print("")
+            files += [pts_file]
+        elif config["stream"]:
+            dump_file: str = output_path(config, "box_par.dump")
+            batches = iter_batches(writers, config["batch_size"], compact=COMPACT)
+            num_points = save_dump_stream(
+                batches, dump_file, BOX_LEN, compression=config["compression"]
+            )
+            files += [dump_file]
+        else:
+            points: PointBuffer = PointBuffer.for_count(expected, compact=COMPACT)
+            for write in writers:
+                write(points)
+            print("")
+            num_points = len(points)
+
+            dump_file = output_path(config, "box_par.dump")
+            save_dump(
+                points=points,
+                box_len=BOX_LEN,
+                filename=dump_file,
+                compression=config["compression"],
+            )
+            files += [dump_file]
+    return {"num_particles": N, "num_points": num_points, "files": files}
+
+
+if __name__ == "__main__":
+    build_box_parra()
@@ -1,66 +1,247 @@
 import numpy as np
-from ..modules.ellipsoid import Ellipsoid
+from functools import partial
+from ..modules.buffer import PointBuffer, iter_batches
+from ..modules.cache import (
+    BUILD_STAGES,
+    StageCache,
+    cached_stage,
+    open_cache,
+    stage_rng,
+    stage_seeds,
+)
+from ..modules.config import OUTPUT_CONFIG, merge_config, output_path
+from ..modules.dump import save_dump_stream
+from ..modules.estimate import dry_run, estimate_build, plan_output, type_counts
+from ..modules.binary import save_points_stream
+from ..modules.parallel import parallel_writers
+from ..modules.population import ParticleTable
+from ..modules.profiling import profiled, stage
+from ..modules.sizes import fill_shells
+from pathlib import Path
+from ..modules.voxels import check_rasterize, save_voxels
 from ..modules.utils import save_dump, make_centers_iter
 
-box_length = 1000
-outer_radius_mean = 30.0
-outer_radius_std = 5.0
-inner_radius_mean = 20.0
-inner_radius_std = 3.0
-volume_fraction = 0.05
-core_density = 0.1
-shell_density = 0.05
-
-thickness_mean = outer_radius_mean - inner_radius_mean
-thickness_std = np.sqrt(outer_radius_std**2 - inner_radius_std**2)
+DEFAULT_CONFIG: dict = {
+    "box_length": 1000.0,
+    "outer_radius_mean": 30.0,
+    "outer_radius_std": 5.0,
+    "inner_radius_mean": 20.0,
+    "inner_radius_std": 3.0,
+    "volume_fraction": 0.05,
+    "core_density": 0.1,
+    "shell_density": 0.05,
+} | OUTPUT_CONFIG
+# The parameters the sizes and centers depend on
+SIZE_PARAMETERS: tuple[str, ...] = (
+    "box_length",
+    "outer_radius_mean",
+    "outer_radius_std",
+    "inner_radius_mean",
+    "inner_radius_std",
+    "volume_fraction",
+)
 
 
 def save_coords(points, filename="out.txt"):
     """
     Save coordinates to a file
     """
+    Path(filename).parent.mkdir(parents=True, exist_ok=True)
     np.savetxt(filename, points, fmt="%.4f")
 
 
-log_std_thickness = np.sqrt(np.log(1 + (thickness_std / thickness_mean) ** 2))
-log_mean_thickness = np.log(thickness_mean) - log_std_thickness**2 / 2
-log_std_core = np.sqrt(np.log(1 + (inner_radius_std / inner_radius_mean) ** 2))
-lgo_mean_core = np.log(inner_radius_mean) - log_std_core**2 / 2
-R_outer = []
-R_inner = []
-total_volume = 0
-target = (box_length**3) * volume_fraction
-while total_volume < target:
-    thickness = np.random.lognormal(log_mean_thickness, log_std_thickness)
-    inner_radius = np.random.lognormal(lgo_mean_core, log_std_core)
-    outer_radius = thickness + inner_radius
-    volume = (4 / 3) * np.pi * ((outer_radius**3))
-    if total_volume + volume > target:
-        break
-    total_volume += volume
-    R_outer.append(outer_radius)
-    R_inner.append(inner_radius)
-R_outer = np.array(R_outer)
-R_inner = np.array(R_inner)
-num_pts = R_outer.shape[0]
-
-dist: np.ndarray = R_outer
-print("particles:", num_pts)
-centers: np.ndarray = make_centers_iter(num_pts, -box_length / 2, box_length / 2, dist)
-core_points = []
-shell_points = []
-for i in range(num_pts):
-    core = Ellipsoid(core_density, R_inner[i])
-    core_shift = core.make_obj() + centers[i]
-    for point in core_shift:
-        core_points.append(point)
-    shell = Ellipsoid(shell_density, R_outer[i], R_inner[i])
-    shell_shift = shell.make_obj() + centers[i]
-    for point in shell_shift:
-        shell_points.append(point)
-core_points = np.array(core_points)
-shell_points = np.array(shell_points)
-
-save_coords(core_points, "out/cube_sphere_core.txt")
-save_coords(shell_points, "out/cube_sphere_shell.txt")
-save_dump([core_points, shell_points], "out/cube_spheres.dump", box_length)
+def sample_radii(config: dict, rng: np.random.Generator | None = None) -> np.ndarray:
+    """
+    Draw the core and outer radii of spheres until they fill the volume fraction
+
+    Parameters
+    ----------
+    config : dict
+        The parameters of the box
+    rng : np.random.Generator | None
+        The random generator to sample with. Defaults to the global np.random state
+
+    Returns
+    -------
+    np.ndarray
+        The inner and outer radius of each sphere, with shape (N, 2)
+    """
+    thickness_mean: float = config["outer_radius_mean"] - config["inner_radius_mean"]
+    thickness_std: float = np.sqrt(
+        config["outer_radius_std"] ** 2 - config["inner_radius_std"] ** 2
+    )
+    # the shell and the core are independent, the outer radius is their sum
+    target: float = (config["box_length"] ** 3) * config["volume_fraction"]
+    shell_core: np.ndarray = fill_shells(
+        [thickness_mean, config["inner_radius_mean"]],
+        [thickness_std, config["inner_radius_std"]],
+        target,
+        rng,
+    )
+    return np.column_stack((shell_core[:, 1], shell_core.sum(axis=1)))
+
+
+def expected_points(radii: np.ndarray, config: dict) -> np.ndarray:
+    """
+    The expected number of points of each type of each sphere, density times volume
+
+    Parameters
+    ----------
+    radii : np.ndarray
+        The inner and outer radius of each sphere, with shape (N, 2)
+    config : dict
+        The parameters of the box
+
+    Returns
+    -------
+    np.ndarray
+        The expected points of the core (type 1) and the shell (type 2) of each
+        sphere, with shape (N, 2)
+    """
+    core: np.ndarray = (4 / 3) * np.pi * radii[:, 0] ** 3
+    ball: np.ndarray = (4 / 3) * np.pi * radii[:, 1] ** 3
+    return np.column_stack(
+        (config["core_density"] * core, config["shell_density"] * (ball - core))
+    )
+
+
+@profiled
+def build_box_spheres(
+    config: dict | None = None, rng: np.random.Generator | None = None
+) -> dict:
+    """
+    Fill a box with core-shell spheres and save their points
+
+    The sizes, the centers and the points are each sampled with their own seed
+    drawn from rng. With a cache_dir, the sizes and centers are cached by their
+    inputs, so e.g. a new density only resamples the points.
+
+    Parameters
+    ----------
+    config : dict | None
+        The parameters to override, see DEFAULT_CONFIG
+    rng : np.random.Generator | None
+        The random generator to sample with. Defaults to the global np.random state
+
+    Returns
+    -------
+    dict
+        The number of particles, the number of points and the files written
+    """
+    config = merge_config(DEFAULT_CONFIG, config)
+    check_rasterize(config, "core_shell")
+    box_length: float = config["box_length"]
+    core_density: float = config["core_density"]
+    shell_density: float = config["shell_density"]
+    compact: bool = config["compact"]
+
+    seeds: dict[str, int | None] = stage_seeds(rng, BUILD_STAGES)
+    cache: StageCache | None = open_cache(config, rng)
+    size_inputs: dict = {key: config[key] for key in SIZE_PARAMETERS}
+    # builders sample their sizes differently, so they never share entries
+    size_inputs["builder"] = "box_spheres"
+    size_inputs["seed"] = seeds["sizes"]
+    with stage("sizes"):
+        radii: np.ndarray = cached_stage(
+            cache,
+            "sizes",
+            size_inputs,
+            partial(sample_radii, config, stage_rng(seeds["sizes"])),
+        )
+    R_inner: np.ndarray = radii[:, 0]
+    R_outer: np.ndarray = radii[:, 1]
+    num_pts = R_outer.shape[0]
+
+    dist: np.ndarray = R_outer
+    print("particles:", num_pts)
+    in_memory: bool = not (config["stream"] or config["binary"])
+    # the in-memory output copies each type's coordinates to its own .txt as well
+    estimate: dict = estimate_build(
+        type_counts(expected_points(radii, config)),
+        num_pts,
+        box_length,
+        config,
+        extra_bytes_per_point=24 if in_memory else 0,
+        text_files=2 if in_memory else 1,
+    )
+    if config["dry_run"]:
+        return dry_run(estimate)
+    config = plan_output(config, estimate)
+    compact = config["compact"]
+    with stage("centers"):
+        centers: np.ndarray = cached_stage(
+            cache,
+            "centers",
+            size_inputs | {"center_seed": seeds["centers"]},
+            partial(
+                make_centers_iter,
+                num_pts,
+                -box_length / 2,
+                box_length / 2,
+                dist,
+                stage_rng(seeds["centers"]),
+            ),
+        )
+    files: list[str] = []
+    table: ParticleTable = ParticleTable(
+        "core_shell",
+        centers,
+        np.column_stack((R_inner, R_outer)),
+        box_length,
+        {"core_density": core_density, "shell_density": shell_density},
+        # the particle seeds are spawned from the points seed alone
+        seed=seeds["points"],
+    )
+    if config["save_table"]:
+        table_file: str = output_path(config, "cube_spheres.npz")
+        particles_file: str = output_path(config, "cube_spheres_particles.dump")
+        table.save(table_file)
+        table.save_ovito(particles_file, config["compression"])
+        files += [table_file, particles_file]
+    # every particle is sampled from its own seed, in the same order for any
+    # number of workers
+    writers = parallel_writers(table, config["workers"], compact)
+    with stage("points"):
+        if config["voxels"]:
+            voxel_file: str = output_path(config, "cube_spheres.vox")
+            num_points: int = save_voxels(
+                writers, voxel_file, box_length, config, table
+            )
+            files += [voxel_file]
+        elif config["binary"]:
+            pts_file: str = output_path(config, "cube_spheres.pts")
+            num_points = save_points_stream(
+                writers,
+                pts_file,
+                box_length,
+                table.expected_count(),
+                compact=compact,
+            )
+            files += [pts_file]
+        elif config["stream"]:
+            dump_file: str = output_path(config, "cube_spheres.dump")
+            batches = iter_batches(writers, config["batch_size"], compact=compact)
+            num_points = save_dump_stream(
+                batches, dump_file, box_length, compression=config["compression"]
+            )
+            files += [dump_file]
+        else:
+            points: PointBuffer = PointBuffer.for_count(
+                table.expected_count(), compact=compact
+            )
+            for write in writers:
+                write(points)
+            num_points = len(points)
+
+            core_file: str = output_path(config, "cube_sphere_core.txt")
+            shell_file: str = output_path(config, "cube_sphere_shell.txt")
+            dump_file = output_path(config, "cube_spheres.dump")
+            save_coords(points.xyz[points.types == 1], core_file)
+            save_coords(points.xyz[points.types == 2], shell_file)
+            save_dump(points, dump_file, box_length, config["compression"])
+            files += [core_file, shell_file, dump_file]
+    return {"num_particles": num_pts, "num_points": num_points, "files": files}
+
+
+if __name__ == "__main__":
+    build_box_spheres()
@@ -1,13 +1,48 @@
+import numpy as np
+from ..modules.buffer import PointBuffer
+from ..modules.config import OBJECT_CONFIG, merge_config, output_path
+from ..modules.profiling import profiled
 from ..modules.ellipsoid import Ellipsoid
 from ..modules.utils import save_dump
 
-a = 40
-b = 30
-c = 80
+DEFAULT_CONFIG: dict = {
+    "axis_length": [40.0, 30.0, 80.0],
+    "density": 0.02,
+} | OBJECT_CONFIG
 
-density = 0.02
-ellipsoid = Ellipsoid(
-    density, x_outer_radius=a, y_outer_radius=b, z_outer_radius=c
-).make_obj()
 
-save_dump([ellipsoid], "out/ellipsoid.dump", 2 * max(a, b, c))
+@profiled
+def build_ellipsoid(
+    config: dict | None = None, rng: np.random.Generator | None = None
+) -> dict:
+    """
+    Make a single uniform ellipsoid and save its points
+
+    Parameters
+    ----------
+    config : dict | None
+        The parameters to override, see DEFAULT_CONFIG
+    rng : np.random.Generator | None
+        The random generator to sample with. Defaults to the global np.random state
+
+    Returns
+    -------
+    dict
+        The number of particles, the number of points and the files written
+    """
+    config = merge_config(DEFAULT_CONFIG, config)
+    a, b, c = config["axis_length"]
+    density: float = config["density"]
+    ellipsoid = Ellipsoid(density, x_outer_radius=a, y_outer_radius=b, z_outer_radius=c)
+
+    points: PointBuffer = PointBuffer.for_count(
+        ellipsoid.expected_count(), compact=config["compact"]
+    )
+    points.append(ellipsoid.make_obj(points.coord_dtype, rng), types=1, particles=0)
+    dump_file: str = output_path(config, "ellipsoid.dump")
+    save_dump(points, dump_file, 2 * max(a, b, c), config["compression"])
+    return {"num_particles": 1, "num_points": len(points), "files": [dump_file]}
+
+
+if __name__ == "__main__":
+    build_ellipsoid()
@@ -1,9 +1,48 @@
+import numpy as np
+from ..modules.buffer import PointBuffer
+from ..modules.config import OBJECT_CONFIG, merge_config, output_path
+from ..modules.profiling import profiled
 from ..modules.onion import Onion
 from ..modules.utils import save_dump
-import numpy as np
 
-thickness: np.ndarray = np.array([10.0, 7.0, 6.0, 5.0, 4.0])
-density: np.ndarray = np.array([0, 0.05, 0.1, 0.03, 0.2])
-onion_pts = Onion(thickness, np.array([0, 0, 0]), density).construct_pts()
+DEFAULT_CONFIG: dict = {
+    "thickness": [10.0, 7.0, 6.0, 5.0, 4.0],
+    "density": [0, 0.05, 0.1, 0.03, 0.2],
+} | OBJECT_CONFIG
+
+
+@profiled
+def build_onion(
+    config: dict | None = None, rng: np.random.Generator | None = None
+) -> dict:
+    """
+    Make a single onion and save its points, with the shell number as the type
+
+    Parameters
+    ----------
+    config : dict | None
+        The parameters to override, see DEFAULT_CONFIG
+    rng : np.random.Generator | None
+        The random generator to sample with. Defaults to the global np.random state
+
+    Returns
+    -------
+    dict
+        The number of particles, the number of points and the files written
+    """
+    config = merge_config(DEFAULT_CONFIG, config)
+    thickness: np.ndarray = np.asarray(config["thickness"], dtype=float)
+    density: np.ndarray = np.asarray(config["density"], dtype=float)
+    onion = Onion(thickness, np.array([0, 0, 0]), density)
+
+    points: PointBuffer = PointBuffer.for_count(
+        onion.expected_count(), compact=config["compact"]
+    )
+    onion.write(points, rng=rng)
+    dump_file: str = output_path(config, "onion.dump")
+    save_dump(points, dump_file, 2 * np.sum(thickness), config["compression"])
+    return {"num_particles": 1, "num_points": len(points), "files": [dump_file]}
+
 
-save_dump([onion_pts], "out/onion.dump", 2 * np.sum(thickness))
+if __name__ == "__main__":
+    build_onion()
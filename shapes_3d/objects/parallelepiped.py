@@ -1,11 +1,54 @@
 import numpy as np
 
+from shapes_3d.modules.buffer import PointBuffer
+from shapes_3d.modules.config import OBJECT_CONFIG, merge_config, output_path
+from shapes_3d.modules.profiling import profiled
 from shapes_3d.modules.parallelepiped import Parallelepiped
 from shapes_3d.modules.utils import save_dump
 
-# thickness = np.array([[50, 20, 30], [20, 30, 30]])
-thickness = np.array([[50, 20, 30], [10, 20, 10]])
-density = np.array([0.5, 0.06])
-obj: Parallelepiped = Parallelepiped(thickness, density, np.pi / 2, np.pi / 6)
-points: np.ndarray = obj.make_obj()
-save_dump([points], "out/parall.dump", obj.get_final_bounds() + 3)
+DEFAULT_CONFIG: dict = {
+    # "thickness": [[50, 20, 30], [20, 30, 30]],
+    "thickness": [[50.0, 20.0, 30.0], [10.0, 20.0, 10.0]],
+    "density": [0.5, 0.06],
+    "theta": np.pi / 2,
+    "phi": np.pi / 6,
+} | OBJECT_CONFIG
+
+
+@profiled
+def build_parallelepiped(
+    config: dict | None = None, rng: np.random.Generator | None = None
+) -> dict:
+    """
+    Make a single layered parallelepiped and save its points
+
+    Parameters
+    ----------
+    config : dict | None
+        The parameters to override, see DEFAULT_CONFIG
+    rng : np.random.Generator | None
+        The random generator to sample with. Defaults to the global np.random state
+
+    Returns
+    -------
+    dict
+        The number of particles, the number of points and the files written
+    """
+    config = merge_config(DEFAULT_CONFIG, config)
+    thickness: np.ndarray = np.asarray(config["thickness"], dtype=float)
+    density: np.ndarray = np.asarray(config["density"], dtype=float)
+    obj: Parallelepiped = Parallelepiped(
+        thickness, density, config["theta"], config["phi"]
+    )
+
+    points: PointBuffer = PointBuffer.for_count(
+        obj.expected_count(), compact=config["compact"]
+    )
+    obj.write(points, rng=rng)
+    dump_file: str = output_path(config, "parall.dump")
+    save_dump(points, dump_file, obj.get_final_bounds() + 3, config["compression"])
+    return {"num_particles": 1, "num_points": len(points), "files": [dump_file]}
+
+
+if __name__ == "__main__":
+    build_parallelepiped()
@@ -1,49 +1,251 @@
-from ..modules.patch_onion import PatchOnion
+from ..modules.patch_shell import PatchShell
+from ..modules.onion import expected_onion_count, expected_shell_counts
+from functools import partial
+from ..modules.buffer import PointBuffer, iter_batches
+from ..modules.cache import (
+    BUILD_STAGES,
+    StageCache,
+    cached_stage,
+    open_cache,
+    stage_rng,
+    stage_seeds,
+)
+from ..modules.config import OUTPUT_CONFIG, merge_config, output_path
+from ..modules.dump import save_dump_stream
+from ..modules.estimate import dry_run, estimate_build, plan_output, type_counts
+from ..modules.binary import save_points_stream
+from ..modules.parallel import parallel_writers
+from ..modules.population import ParticleTable
+from ..modules.profiling import profiled, stage
+from ..modules.sizes import fill_shells
+from ..modules.voxels import check_rasterize, save_voxels
 from ..modules.utils import save_dump, make_centers
 import numpy as np
 
-THICKNESS_MEAN: np.ndarray = np.array([10.0, 7.0, 6.0, 5.0, 4.0])
-STD_THICKNESS: np.ndarray = np.array([1.5, 1.2, 0.5, 0.8, 1.0])
-DENSITY = np.array([0.0, 0.05, 0.1, 0.03, 0.2])
-L: float = 800
-VOLUME_FRACTION: float = 0.05
-PATCH_DENSITY: float = 0.3
-Y: np.ndarray = np.array([300.0, 200.0, 900.0, 1500.0, 200.0, 3000.0])
-X: int = 6
-
-assert DENSITY.shape == STD_THICKNESS.shape == THICKNESS_MEAN.shape
-
-radii_list: list = []
-tgt: float = (L**3) * VOLUME_FRACTION
-curr_vol: float = 0
-sigma_ts: np.ndarray = np.sqrt(np.log(1 + (STD_THICKNESS / THICKNESS_MEAN) ** 2))
-mu_ts: np.ndarray = np.log(THICKNESS_MEAN) - sigma_ts**2 / 2
-while curr_vol < tgt:
-    rad_tot: float = 0
-    curr_sphere = np.random.lognormal(mu_ts, sigma_ts)
-    curr_vol += float(np.sum(curr_sphere) ** 3) * np.pi * 4 / 3
-    if curr_vol > tgt:
-        break
-    radii_list.append(curr_sphere)
-radii: np.ndarray = np.array(radii_list)
-N: int = radii.shape[0]
-
-
-max_r: float = np.max(radii.sum(axis=1))
-print("making the centers")
-centers = make_centers(N, -L / 2 + max_r, L / 2 - max_r, 2 * max_r)
-onion_list = []
-patch_list = []
-print("making the patches and shells")
-for i in range(N):
-    if (i + 1) % 100 == 0 or i == 0 or i == N - 1:
-        print("N =", i + 1, "out of", N)
-    shell = PatchOnion(radii[i], centers[i], DENSITY, Y, X, PATCH_DENSITY)
-    onion_list.extend(shell.onion_base())
-    patches = shell.patches() + centers[i]
-    patch_list.extend(patches)
-
-onion_pts: np.ndarray = np.array(onion_list)
-patch_pts: np.ndarray = np.array(patch_list)
-
-save_dump([onion_pts, patch_pts], "out/patchy_box.dump", box_len=L)
+DEFAULT_CONFIG: dict = {
+    "thickness_mean": [10.0, 7.0, 6.0, 5.0, 4.0],
+    "std_thickness": [1.5, 1.2, 0.5, 0.8, 1.0],
+    "density": [0.0, 0.05, 0.1, 0.03, 0.2],
+    "box_length": 800.0,
+    "volume_fraction": 0.05,
+    "patch_density": 0.3,
+    "patch_area": [300.0, 200.0, 900.0, 1500.0, 200.0, 3000.0],
+    "num_patches": 6,
+} | OUTPUT_CONFIG
+# The parameters the sizes and centers depend on
+SIZE_PARAMETERS: tuple[str, ...] = (
+    "thickness_mean",
+    "std_thickness",
+    "box_length",
+    "volume_fraction",
+)
+
+
+def sample_radii(config: dict, rng: np.random.Generator | None = None) -> np.ndarray:
+    """
+    Draw the layer thicknesses of onions until they fill the volume fraction
+
+    Parameters
+    ----------
+    config : dict
+        The parameters of the box
+    rng : np.random.Generator | None
+        The random generator to sample with. Defaults to the global np.random state
+
+    Returns
+    -------
+    np.ndarray
+        The thickness of each layer of each onion, with shape (N, layers)
+    """
+    target: float = (config["box_length"] ** 3) * config["volume_fraction"]
+    return fill_shells(config["thickness_mean"], config["std_thickness"], target, rng)
+
+
+def place_centers(
+    radii: np.ndarray, config: dict, rng: np.random.Generator | None = None
+) -> np.ndarray:
+    """
+    Place the onions in the box so that none of them overlap
+
+    Parameters
+    ----------
+    radii : np.ndarray
+        The thickness of each layer of each onion, with shape (N, layers)
+    config : dict
+        The parameters of the box
+    rng : np.random.Generator | None
+        The random generator to sample with. Defaults to the global np.random state
+
+    Returns
+    -------
+    np.ndarray
+        The center of each onion, with shape (N, 3)
+    """
+    L: float = config["box_length"]
+    max_r: float = np.max(radii.sum(axis=1), initial=0)
+    print("making the centers")
+    return make_centers(radii.shape[0], -L / 2 + max_r, L / 2 - max_r, 2 * max_r, rng)
+
+
+def expected_points(radii: np.ndarray, config: dict) -> np.ndarray:
+    """
+    The expected number of points of each type of each patchy onion
+
+    Parameters
+    ----------
+    radii : np.ndarray
+        The thickness of each layer of each onion, with shape (N, layers)
+    config : dict
+        The parameters of the box
+
+    Returns
+    -------
+    np.ndarray
+        The expected points of each shell and of the patches of each onion, with
+        shape (N, layers + 1)
+    """
+    shells: np.ndarray = expected_shell_counts(
+        radii, np.asarray(config["density"], dtype=float)
+    )
+    patches: float = PatchShell(
+        1.0,
+        np.asarray(config["patch_area"], dtype=float),
+        config["num_patches"],
+        config["patch_density"],
+    ).expected_count()
+    return np.column_stack((shells, np.full(radii.shape[0], patches)))
+
+
+@profiled
+def build_patchy_box(
+    config: dict | None = None, rng: np.random.Generator | None = None
+) -> dict:
+    """
+    Fill a box with patchy onions and save their points
+
+    The sizes, the centers and the points are each sampled with their own seed
+    drawn from rng. With a cache_dir, the sizes and centers are cached by their
+    inputs, so e.g. a new density only resamples the points.
+
+    Parameters
+    ----------
+    config : dict | None
+        The parameters to override, see DEFAULT_CONFIG
+    rng : np.random.Generator | None
+        The random generator to sample with. Defaults to the global np.random state
+
+    Returns
+    -------
+    dict
+        The number of particles, the number of points and the files written
+    """
+    config = merge_config(DEFAULT_CONFIG, config)
+    check_rasterize(config, "patchy_onion")
+    THICKNESS_MEAN: np.ndarray = np.asarray(config["thickness_mean"], dtype=float)
+    STD_THICKNESS: np.ndarray = np.asarray(config["std_thickness"], dtype=float)
+    DENSITY: np.ndarray = np.asarray(config["density"], dtype=float)
+    L: float = config["box_length"]
+    PATCH_DENSITY: float = config["patch_density"]
+    Y: np.ndarray = np.asarray(config["patch_area"], dtype=float)
+    X: int = config["num_patches"]
+    COMPACT: bool = config["compact"]
+
+    assert DENSITY.shape == STD_THICKNESS.shape == THICKNESS_MEAN.shape
+
+    seeds: dict[str, int | None] = stage_seeds(rng, BUILD_STAGES)
+    cache: StageCache | None = open_cache(config, rng)
+    size_inputs: dict = {key: config[key] for key in SIZE_PARAMETERS}
+    # builders sample their sizes differently, so they never share entries
+    size_inputs["builder"] = "patchy_box"
+    size_inputs["seed"] = seeds["sizes"]
+    with stage("sizes"):
+        radii: np.ndarray = cached_stage(
+            cache,
+            "sizes",
+            size_inputs,
+            partial(sample_radii, config, stage_rng(seeds["sizes"])),
+        )
+    N: int = radii.shape[0]
+    # only the dump is written, without a copy of the rows, so the defaults hold
+    estimate: dict = estimate_build(
+        type_counts(expected_points(radii, config)), N, L, config
+    )
+    if config["dry_run"]:
+        return dry_run(estimate)
+    config = plan_output(config, estimate)
+    COMPACT = config["compact"]
+
+    with stage("centers"):
+        centers: np.ndarray = cached_stage(
+            cache,
+            "centers",
+            size_inputs | {"center_seed": seeds["centers"]},
+            partial(place_centers, radii, config, stage_rng(seeds["centers"])),
+        )
+    patch_type: int = DENSITY.shape[0] + 1
+    points_per_patchy_onion: float = PatchShell(
+        1.0, Y, X, PATCH_DENSITY
+    ).expected_count()
+
+    print("making the patches and shells")
+    files: list[str] = []
+    table: ParticleTable = ParticleTable(
+        "patchy_onion",
+        centers,
+        radii,
+        L,
+        {
+            "density": DENSITY.tolist(),
+            "patch_area": Y.tolist(),
+            "num_patches": X,
+            "patch_density": PATCH_DENSITY,
+            "patch_type": patch_type,
+        },
+        # the particle seeds are spawned from the points seed alone
+        seed=seeds["points"],
+    )
+    if config["save_table"]:
+        table_file: str = output_path(config, "patchy_box.npz")
+        particles_file: str = output_path(config, "patchy_box_particles.dump")
+        table.save(table_file)
+        table.save_ovito(particles_file, config["compression"])
+        files += [table_file, particles_file]
+    # every particle is sampled from its own seed, in the same order for any
+    # number of workers
+    writers = parallel_writers(table, config["workers"], COMPACT)
+    expected: float = (
+        float(np.sum(expected_onion_count(radii, DENSITY)))
+        + N * points_per_patchy_onion
+    )
+    with stage("points"):
+        if config["voxels"]:
+            voxel_file: str = output_path(config, "patchy_box.vox")
+            num_points: int = save_voxels(writers, voxel_file, L, config, table)
+            files += [voxel_file]
+        elif config["binary"]:
+            pts_file: str = output_path(config, "patchy_box.pts")
+            num_points = save_points_stream(
+                writers, pts_file, L, expected, compact=COMPACT
+            )
+            files += [pts_file]
+        elif config["stream"]:
+            dump_file: str = output_path(config, "patchy_box.dump")
+            batches = iter_batches(writers, config["batch_size"], compact=COMPACT)
+            num_points = save_dump_stream(
+                batches, dump_file, box_len=L, compression=config["compression"]
+            )
+            files += [dump_file]
+        else:
+            points: PointBuffer = PointBuffer.for_count(expected, compact=COMPACT)
+            for write in writers:
+                write(points)
+            num_points = len(points)
+
+            dump_file = output_path(config, "patchy_box.dump")
+            save_dump(points, dump_file, box_len=L, compression=config["compression"])
+            files += [dump_file]
+    return {"num_particles": N, "num_points": num_points, "files": files}
+
+
+if __name__ == "__main__":
+    build_patchy_box()
@@ -1,19 +1,62 @@
+from ..modules.buffer import PointBuffer
+from ..modules.config import OBJECT_CONFIG, merge_config, output_path
+from ..modules.profiling import profiled
 from ..modules.patch_onion import PatchOnion
 from ..modules.utils import save_dump
 import numpy as np
 
-onion = PatchOnion(
-    radii=np.array([50, 30, 10]),
-    center=np.array([0, 0, 0]),
-    density=np.array([1, 0.5, 0.25]),
-    patch_area=np.array([20000, 10000, 12000, 8000, 9000, 17000, 8000, 9000]),
-    num_patches=8,
-    patch_density=0.4,
-)
-
-# patch_area=np.array([1000, 5000, 6000, 8000, 4000, 7000, 5000, 3000]),
-# patch_area=np.array([10000, 8000, 12000, 13000, 8000, 17000, 6000, 9000]),
-# patch_area=np.array([20000, 10000, 12000, 8000, 9000, 17000, 8000, 9000]),
-base = onion.onion_base()
-patches = onion.patches()
-save_dump([base, patches], "out/patch_onion.dump", 50 + 30 + 10)
+DEFAULT_CONFIG: dict = {
+    "radii": [50.0, 30.0, 10.0],
+    "density": [1.0, 0.5, 0.25],
+    # [1000, 5000, 6000, 8000, 4000, 7000, 5000, 3000]
+    # [10000, 8000, 12000, 13000, 8000, 17000, 6000, 9000]
+    "patch_area": [20000.0, 10000.0, 12000.0, 8000.0, 9000.0, 17000.0, 8000.0, 9000.0],
+    "num_patches": 8,
+    "patch_density": 0.4,
+} | OBJECT_CONFIG
+
+
+@profiled
+def build_patchy_onion(
+    config: dict | None = None, rng: np.random.Generator | None = None
+) -> dict:
+    """
+    Make a single onion with patches on its surface and save its points
+
+    The shells have their number as the type, and the patches the type after the
+    last shell.
+
+    Parameters
+    ----------
+    config : dict | None
+        The parameters to override, see DEFAULT_CONFIG
+    rng : np.random.Generator | None
+        The random generator to sample with. Defaults to the global np.random state
+
+    Returns
+    -------
+    dict
+        The number of particles, the number of points and the files written
+    """
+    config = merge_config(DEFAULT_CONFIG, config)
+    radii: np.ndarray = np.asarray(config["radii"], dtype=float)
+    onion = PatchOnion(
+        radii=radii,
+        center=np.array([0, 0, 0]),
+        density=np.asarray(config["density"], dtype=float),
+        patch_area=np.asarray(config["patch_area"], dtype=float),
+        num_patches=config["num_patches"],
+        patch_density=config["patch_density"],
+    )
+
+    points: PointBuffer = PointBuffer.for_count(
+        onion.expected_count(), compact=config["compact"]
+    )
+    onion.write(points, rng=rng)
+    dump_file: str = output_path(config, "patch_onion.dump")
+    save_dump(points, dump_file, np.sum(radii), config["compression"])
+    return {"num_particles": 1, "num_points": len(points), "files": [dump_file]}
+
+
+if __name__ == "__main__":
+    build_patchy_onion()
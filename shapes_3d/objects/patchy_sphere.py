@@ -1,15 +1,57 @@
+from ..modules.buffer import PointBuffer
+from ..modules.config import OBJECT_CONFIG, merge_config, output_path
+from ..modules.profiling import profiled
 from ..modules.patch_onion import PatchOnion
 from ..modules.utils import save_dump
 import numpy as np
 
-sphere = PatchOnion(
-    radii=np.array([50]),
-    center=np.array([0, 0, 0]),
-    density=np.array([1]),
-    patch_area=5000,
-    num_patches=8,
-    patch_density=0.1,
-)
-base = sphere.onion_base()
-patches = sphere.patches()
-save_dump([base, patches], "out/patchy_sphere.dump", 50)
+DEFAULT_CONFIG: dict = {
+    "radius": 50.0,
+    "density": 1.0,
+    "patch_area": 5000.0,
+    "num_patches": 8,
+    "patch_density": 0.1,
+} | OBJECT_CONFIG
+
+
+@profiled
+def build_patchy_sphere(
+    config: dict | None = None, rng: np.random.Generator | None = None
+) -> dict:
+    """
+    Make a single sphere with equal patches on its surface and save its points
+
+    Parameters
+    ----------
+    config : dict | None
+        The parameters to override, see DEFAULT_CONFIG
+    rng : np.random.Generator | None
+        The random generator to sample with. Defaults to the global np.random state
+
+    Returns
+    -------
+    dict
+        The number of particles, the number of points and the files written
+    """
+    config = merge_config(DEFAULT_CONFIG, config)
+    radius: float = config["radius"]
+    sphere = PatchOnion(
+        radii=np.array([radius]),
+        center=np.array([0, 0, 0]),
+        density=np.array([config["density"]]),
+        patch_area=config["patch_area"],
+        num_patches=config["num_patches"],
+        patch_density=config["patch_density"],
+    )
+
+    points: PointBuffer = PointBuffer.for_count(
+        sphere.expected_count(), compact=config["compact"]
+    )
+    sphere.write(points, rng=rng)
+    dump_file: str = output_path(config, "patchy_sphere.dump")
+    save_dump(points, dump_file, radius, config["compression"])
+    return {"num_particles": 1, "num_points": len(points), "files": [dump_file]}
+
+
+if __name__ == "__main__":
+    build_patchy_sphere()
@@ -1,8 +1,48 @@
+import numpy as np
+from ..modules.buffer import PointBuffer
+from ..modules.config import OBJECT_CONFIG, merge_config, output_path
+from ..modules.profiling import profiled
 from ..modules.ellipsoid import Ellipsoid
 from ..modules.utils import save_dump
 
-R = 50
-d = 0.05
-sphere = Ellipsoid(d, R).make_obj()
+DEFAULT_CONFIG: dict = {
+    "radius": 50.0,
+    "density": 0.05,
+} | OBJECT_CONFIG
 
-save_dump([sphere], "out/sphere.dump", 2 * R)
+
+@profiled
+def build_sphere(
+    config: dict | None = None, rng: np.random.Generator | None = None
+) -> dict:
+    """
+    Make a single uniform sphere and save its points
+
+    Parameters
+    ----------
+    config : dict | None
+        The parameters to override, see DEFAULT_CONFIG
+    rng : np.random.Generator | None
+        The random generator to sample with. Defaults to the global np.random state
+
+    Returns
+    -------
+    dict
+        The number of particles, the number of points and the files written
+    """
+    config = merge_config(DEFAULT_CONFIG, config)
+    R: float = config["radius"]
+    d: float = config["density"]
+    sphere = Ellipsoid(d, R)
+
+    points: PointBuffer = PointBuffer.for_count(
+        sphere.expected_count(), compact=config["compact"]
+    )
+    points.append(sphere.make_obj(points.coord_dtype, rng), types=1, particles=0)
+    dump_file: str = output_path(config, "sphere.dump")
+    save_dump(points, dump_file, 2 * R, config["compression"])
+    return {"num_particles": 1, "num_points": len(points), "files": [dump_file]}
+
+
+if __name__ == "__main__":
+    build_sphere()